@@ -0,0 +1,73 @@
+###
+# Constraint-aware attachment of nodes to parents with limited capacity.
+#
+# CapacityPool keeps the parents that still have room in a flat list plus an
+# index of their positions, so a random pick, a round-robin pick and the
+# removal of a full parent are all O(1) (swap with the last entry and pop).
+# This replaces rebuilding "routers with fewer than N switches" for every
+# switch, which was O(switches x routers).
+###
+
+
+class CapacityPool:
+
+    def __init__(self, parents, capacity=1, used=None):
+        # capacity: how many children each parent may take (None = unlimited);
+        # with capacity < 1 no parent has room, so the pool starts empty.
+        # used: {parent: children it already has}, counted against capacity
+        self.capacity = capacity
+        self.used = dict(used or {})
+        if capacity is None:
+            self.available = list(parents)
+        else:
+            self.available = [parent for parent in parents if self.used.get(parent, 0) < capacity]
+        self.position = {parent: i for i, parent in enumerate(self.available)}
+        self._cursor = 0
+
+    def __len__(self):
+        return len(self.available)
+
+    def __bool__(self):
+        return bool(self.available)
+
+    def __contains__(self, parent):
+        return parent in self.position
+
+    def remove(self, parent):
+        i = self.position.pop(parent)
+        last = self.available.pop()
+        if last != parent:
+            self.available[i] = last
+            self.position[last] = i
+
+    def take(self, parent):
+        # Records one child on parent and drops it from the pool when full
+        self.used[parent] = self.used.get(parent, 0) + 1
+        if self.capacity is not None and self.used[parent] >= self.capacity:
+            self.remove(parent)
+
+    def pick_random(self, rng):
+        return self.available[rng.randrange(len(self.available))]
+
+    def pick_next(self):
+        # Round-robin over the parents that still have room
+        self._cursor %= len(self.available)
+        parent = self.available[self._cursor]
+        self._cursor += 1
+        return parent
+
+
+def attach(children, pool, link_index, rng=None):
+    # Attaches each child to a parent with spare capacity (random if rng is
+    # given, round-robin otherwise) and records the link in link_index.
+    # Returns the children that were attached; the rest are left once every
+    # parent is full.
+    attached = []
+    for child in children:
+        if not pool:
+            break
+        parent = pool.pick_random(rng) if rng is not None else pool.pick_next()
+        if link_index.add(child, parent):
+            pool.take(parent)
+            attached.append(child)
+    return attached
@@ -1,23 +1,135 @@
 import xml.etree.ElementTree as ET
+from functools import lru_cache
+from scenario_writer import indentation, serialize
 
 ###
 # CORE XML fixed section / element handlers 
 #
 # These functions add required metadata and default settings
-# to the <scenario> root element for CORE.
+# to the <scenario> root element for CORE. Each section is built
+# completely before it is appended, so `scenario` may also be a
+# ScenarioWriter that streams the section straight to disk. The static
+# sections are rendered once and spliced in as text in that case.
 ####
 
+###
+# Shared definitions of the static sections.
+#
+# createXmlV2 and "check_and modify_xml_format.py" both read these, so the
+# two tools always agree on what a correct section looks like. Only the
+# canvas dimensions in <session_metadata> vary between scenarios.
+##
+STATIC_SECTIONS = ["session_origin", "session_options", "session_metadata", "default_services"]
+
+SESSION_ORIGIN = {
+    "lat": "47.579166412353516",
+    "lon": "-122.13232421875",
+    "alt": "2.0",
+    "scale": "150.0"
+}
+
+SESSION_OPTIONS = [
+    ("controlnet", ""), ("controlnet0", ""), ("controlnet1", ""), ("controlnet2", ""), ("controlnet3", ""),
+    ("controlnet_updown_script", ""), ("enablerj45", "1"), ("preservedir", "0"), ("enablesdt", "0"),
+    ("sdturl", "tcp://127.0.0.1:50000/"), ("ovs", "0"), ("platform_id_start", "1"), ("nem_id_start", "1"),
+    ("link_enabled", "1"), ("loss_threshold", "30"), ("link_interval", "1"), ("link_timeout", "4"),
+    ("mtu", "0")
+]
+
+# <session_metadata> entries before the "canvas" entry
+SESSION_METADATA = [
+    ("shapes", "[]"),
+    ("hidden", "[]"),
+    ("edges", "[]")
+]
+
+DEFAULT_CANVAS_DIMENSIONS = (1000, 750)
+
+DEFAULT_SERVICES = {
+    "mdr": ["zebra", "OSPFv3MDR", "IPForward"],
+    "PC": ["DefaultRoute"],
+    "prouter": [],
+    "router": ["zebra", "OSPFv2", "OSPFv3", "IPForward"],
+    "host": ["DefaultRoute", "SSH"]
+}
+
+
+def canvas_value(dimensions):
+    width, height = dimensions
+    return f"{{\"gridlines\": true, \"canvases\": [{{\"id\": 1, \"wallpaper\": null, \"wallpaper_style\": 1, \"fit_image\": false, \"dimensions\": [{width}, {height}]}}]}}"
+
+
+##
+# Builds a fresh Element for one of STATIC_SECTIONS from the shared
+# definitions above.
+##
+def build_static_section(tag, dimensions=DEFAULT_CANVAS_DIMENSIONS):
+    if tag == "session_origin":
+        return ET.Element("session_origin", SESSION_ORIGIN)
+
+    section = ET.Element(tag)
+    if tag == "session_options":
+        for name, value in SESSION_OPTIONS:
+            ET.SubElement(section, "configuration", {"name": name, "value": value})
+
+    elif tag == "session_metadata":
+        for name, value in SESSION_METADATA + [("canvas", canvas_value(dimensions))]:
+            ET.SubElement(section, "configuration", {"name": name, "value": value})
+
+    elif tag == "default_services":
+        for node_type, services in DEFAULT_SERVICES.items():
+            node = ET.SubElement(section, "node", {"type": node_type})
+            for svc in services:
+                ET.SubElement(node, "service", {"name": svc})
+
+    else:
+        raise ValueError(f"<{tag}> is not a static section")
+    return section
+
+
+##
+# Pre-rendered static sections.
+#
+# Each section is serialized once per (dimensions, indentation) and the
+# text is reused for every scenario after that: "\n" plus the indent for
+# its depth, then the indented element, exactly as ScenarioWriter or
+# ET.indent + tree.write would have produced it (space=None: compact, no
+# whitespace at all). Writers splice the text straight into their output
+# instead of rebuilding the subtree.
+##
+@lru_cache(maxsize=None)
+def _render_fragment(tag, dimensions, space, level):
+    return indentation(space, level) + serialize(build_static_section(tag, dimensions), space, level)
+
+
+def static_fragment(tag, dimensions=DEFAULT_CANVAS_DIMENSIONS, space="  ", level=1):
+    return _render_fragment(tag, tuple(dimensions), space, level)
+
+
+@lru_cache(maxsize=None)
+def _render_fragment_bytes(tag, dimensions, space, level):
+    return _render_fragment(tag, dimensions, space, level).encode("utf-8")
+
+
+def static_fragment_bytes(tag, dimensions=DEFAULT_CANVAS_DIMENSIONS, space="  ", level=1):
+    # UTF-8 encoded static_fragment() for binary outputs such as the XML fixer
+    return _render_fragment_bytes(tag, tuple(dimensions), space, level)
+
+
+def _add_static_section(scenario, tag, dimensions=DEFAULT_CANVAS_DIMENSIONS):
+    if isinstance(scenario, ET.Element):
+        # In-memory trees are indented as a whole later on
+        scenario.append(build_static_section(tag, dimensions))
+    else:
+        scenario.splice(static_fragment(tag, dimensions, scenario.space))
+
+
 ###
 # Adds the <session_origin> element with map location and scale.
 # This defines where the scenario is centered.
 ##
 def add_session_origin(scenario):
-    ET.SubElement(scenario, "session_origin", {
-        "lat": "47.579166412353516",
-        "lon": "-122.13232421875",
-        "alt": "2.0",
-        "scale": "150.0"
-    })
+    _add_static_section(scenario, "session_origin")
 
 
 
@@ -27,82 +139,59 @@ def add_session_origin(scenario):
 # control interfaces, and system preferences.
 ##
 def add_session_options(scenario):
-    session_options = ET.SubElement(scenario, "session_options")
-    config_list = [
-        ("controlnet", ""), ("controlnet0", ""), ("controlnet1", ""), ("controlnet2", ""), ("controlnet3", ""),
-        ("controlnet_updown_script", ""), ("enablerj45", "1"), ("preservedir", "0"), ("enablesdt", "0"),
-        ("sdturl", "tcp://127.0.0.1:50000/"), ("ovs", "0"), ("platform_id_start", "1"), ("nem_id_start", "1"),
-        ("link_enabled", "1"), ("loss_threshold", "30"), ("link_interval", "1"), ("link_timeout", "4"),
-        ("mtu", "0")
-    ]
-    for name, value in config_list:
-        ET.SubElement(session_options, "configuration", {"name": name, "value": value})
+    _add_static_section(scenario, "session_options")
 
 ##
 # Adds the <session_metadata> element.
 # This contains visual layout and canvas metadata for the GUI.
+# dimensions is the canvas [width, height] in pixels; large scenarios
+# pass NetworkBuilder.canvas_dimensions() so every node stays visible.
 ##
-def add_session_metadata(scenario):
-    session_metadata = ET.SubElement(scenario, "session_metadata")
-    metadata = [
-        ("shapes", "[]"),
-        ("hidden", "[]"),
-        ("edges", "[]"),
-        ("canvas", "{\"gridlines\": true, \"canvases\": [{\"id\": 1, \"wallpaper\": null, \"wallpaper_style\": 1, \"fit_image\": false, \"dimensions\": [1000, 750]}]}")
-    ]
-    for name, value in metadata:
-        ET.SubElement(session_metadata, "configuration", {"name": name, "value": value})
+def add_session_metadata(scenario, dimensions=DEFAULT_CANVAS_DIMENSIONS):
+    _add_static_section(scenario, "session_metadata", dimensions)
 
 ##
 # Adds the <default_services> section that assigns core services 
 # to certain types of nodes by default (ex. routers get OSPF, zebra).
 ##
 def add_default_services(scenario):
-    default_services = ET.SubElement(scenario, "default_services")
+    _add_static_section(scenario, "default_services")
 
-    node_data = {
-        "mdr": ["zebra", "OSPFv3MDR", "IPForward"],
-        "PC": ["DefaultRoute"],
-        "prouter": [],
-        "router": ["zebra", "OSPFv2", "OSPFv3", "IPForward"],
-        "host": ["DefaultRoute", "SSH"]
-    }
 
-    for node_type, services in node_data.items():
-        node = ET.SubElement(default_services, "node", {"type": node_type})
-        for svc in services:
-            ET.SubElement(node, "service", {"name": svc})
+            
+# Settings of the basic_range mobility model given to every WIRELESS_LAN
+MOBILITY_SETTINGS = [
+    ("range", "275"),
+    ("bandwidth", "54000000"),
+    ("jitter", "0"),
+    ("delay", "5000"),
+    ("error", "0.0"),
+    ("promiscuous", "0")
+]
+
+
+def mobility_configuration(device_id):
+    # One <mobility_configuration> for a WIRELESS_LAN node
+    mobility = ET.Element("mobility_configuration", {
+        "node": str(device_id),
+        "model": "basic_range"
+    })
+    for name, value in MOBILITY_SETTINGS:
+        ET.SubElement(mobility, "configuration", {
+            "name": name,
+            "value": value
+        })
+    return mobility
 
 
-            
 def add_mobility_configurations(scenario, device_registry):
     # Add mobility_configurations section for WIRELESS_LAN devices
     mobility_configurations = ET.Element("mobility_configurations")
     added_any = False
 
-    for device_id, info in device_registry.items():
-        if info["type"] == "WIRELESS_LAN":
-            mobility = ET.SubElement(mobility_configurations, "mobility_configuration", {
-                "node": str(device_id),
-                "model": "basic_range"
-            })
-
-            configs = [
-                ("range", "275"),
-                ("bandwidth", "54000000"),
-                ("jitter", "0"),
-                ("delay", "5000"),
-                ("error", "0.0"),
-                ("promiscuous", "0")
-            ]
-
-            for name, value in configs:
-                ET.SubElement(mobility, "configuration", {
-                    "name": name,
-                    "value": value
-                })
-
-            added_any = True
+    for device_id in device_registry.ids_of("WIRELESS_LAN"):
+        mobility_configurations.append(mobility_configuration(device_id))
+        added_any = True
 
     if added_any:
         scenario.append(mobility_configurations)
@@ -0,0 +1,185 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from createXmlV2 import build_scenario
+from emitters import EMITTERS
+from scenario_cache import DEFAULT_MAX_BYTES, ScenarioCache
+from validation import TopologyError
+from instrumentation import Instrumentation
+
+###
+# Batch scenario generation.
+#
+# Builds many scenarios in parallel, one NetworkBuilder per task in a
+# process pool, and writes a manifest.json with per-scenario timing next
+# to the generated files. Configs come from:
+#
+#   python batch_generate.py configs/            # every *.json in a directory
+#   python batch_generate.py campaign.jsonl      # one config per line
+#   python batch_generate.py scenario_config.json --seeds 1000
+#
+# A JSONL line may carry a "name" key used for its output file. With
+# --validate every topology is checked before it is written (see
+# validation.py); scenarios with errors fail, and the diagnostics of every
+# scenario go into the manifest (validated scenarios are never taken from
+# --cache). With --profile the manifest also holds
+# per-stage timings and counters of every scenario (see instrumentation.py).
+# With --compress gz|zst the scenarios are written compressed (see
+# scenario_io.py) and the manifest records the size of every file.
+###
+
+COMPRESS_SUFFIXES = {"gz": ".gz", "zst": ".zst"}
+
+
+def check_name(name):
+    # Task names become file names in the output directory; anything that
+    # could point elsewhere ("../x", "/abs", "a/b") is refused
+    if not isinstance(name, str) or name in ("", ".", "..") or "/" in name or "\\" in name:
+        raise ValueError(f"Scenario name {name!r} is not a plain file name")
+    return name
+
+
+def load_tasks(source, seeds=None):
+    # Returns (name, config, seed) tuples
+    tasks = []
+
+    if os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, "*.json"))):
+            with open(path) as f:
+                tasks.append((os.path.splitext(os.path.basename(path))[0], json.load(f), None))
+
+    elif source.endswith(".jsonl"):
+        with open(source) as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                config = json.loads(line)
+                name = config.pop("name", f"scenario_{line_no}")
+                try:
+                    check_name(name)
+                except ValueError as e:
+                    raise ValueError(f"{source}:{line_no}: {e}") from None
+                tasks.append((name, config, None))
+
+    else:
+        with open(source) as f:
+            tasks.append((os.path.splitext(os.path.basename(source))[0], json.load(f), None))
+
+    if seeds:
+        # N seeded variations of every config (passed to the link generator as "seed")
+        tasks = [(f"{name}_seed{seed}", config, seed) for name, config, _ in tasks for seed in range(seeds)]
+
+    return tasks
+
+
+def _build_one(task):
+    # Runs in a worker process
+    name, config, seed, output_path, streaming, backend, cache, validate, profile, compact = task
+    if seed is not None:
+        config = dict(config, seed=seed)
+
+    instrumentation = Instrumentation() if profile else None
+    start = time.perf_counter()
+    try:
+        builder = build_scenario(config, output_path, streaming=streaming, backend=backend, cache=cache,
+                                 validate=validate, instrumentation=instrumentation, compact=compact)
+    except TopologyError as e:
+        # Keep the rest of the batch going
+        return {"name": name, "output": output_path, "seed": seed, "error": str(e),
+                "diagnostics": e.report["diagnostics"]}
+    except Exception as e:
+        return {"name": name, "output": output_path, "seed": seed, "error": f"{type(e).__name__}: {e}"}
+
+    result = {
+        "name": name,
+        "output": output_path,
+        "seed": seed,
+        "seconds": round(time.perf_counter() - start, 6)
+    }
+    result["bytes"] = os.path.getsize(output_path)
+    if builder is None:
+        result["cached"] = True
+    else:
+        result["nodes"] = len(builder.device_registry)
+        if builder.validation is not None and builder.validation["diagnostics"]:
+            result["diagnostics"] = builder.validation["diagnostics"]
+        if instrumentation is not None:
+            result["profile"] = instrumentation.report()
+    return result
+
+
+def run_batch(tasks, output_dir, workers=None, streaming=True, backend="etree", cache=None, validate=False,
+              profile=False, compact=False, compress=None):
+    for name, _, _ in tasks:
+        check_name(name)
+    os.makedirs(output_dir, exist_ok=True)
+    suffix = ".xml" + COMPRESS_SUFFIXES.get(compress, "")
+    jobs = [
+        (name, config, seed, os.path.join(output_dir, name + suffix), streaming, backend, cache, validate, profile,
+         compact)
+        for name, config, seed in tasks
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    # Small chunks keep every worker busy without one round trip per scenario
+    chunksize = max(1, len(jobs) // (workers * 8))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_build_one, jobs, chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+
+    manifest = {
+        "workers": workers,
+        "scenarios": results,
+        "generated": sum(1 for r in results if "error" not in r),
+        "failed": sum(1 for r in results if "error" in r),
+        "cache_hits": sum(1 for r in results if r.get("cached")),
+        "with_warnings": sum(1 for r in results if "error" not in r and r.get("diagnostics")),
+        "total_bytes": sum(r.get("bytes", 0) for r in results),
+        "total_seconds": round(elapsed, 6)
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate many CORE scenarios in parallel")
+    parser.add_argument("source", help="directory of *.json configs, a .jsonl file, or a single config")
+    parser.add_argument("--seeds", type=int, help="build N seeded variations of every config")
+    parser.add_argument("--output-dir", default="generated_scenarios")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--no-stream", action="store_true", help="build each tree in memory instead of streaming")
+    parser.add_argument("--backend", choices=list(EMITTERS), default="etree",
+                        help="serialize records with ElementTree or with string templates")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="reuse scenarios generated earlier from the same config (not with --validate)")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES >> 20, metavar="MB",
+                        help="evict least recently used scenarios beyond this size")
+    parser.add_argument("--validate", action="store_true",
+                        help="check every topology before writing it; invalid ones fail")
+    parser.add_argument("--compact", action="store_true", help="write the XML without indentation")
+    parser.add_argument("--compress", choices=list(COMPRESS_SUFFIXES),
+                        help="write every scenario compressed (.xml.gz / .xml.zst)")
+    parser.add_argument("--profile", action="store_true",
+                        help="record per-stage timings and counters of every scenario in the manifest")
+    args = parser.parse_args()
+
+    try:
+        tasks = load_tasks(args.source, args.seeds)
+    except ValueError as e:
+        parser.error(str(e))
+
+    cache = ScenarioCache(args.cache, args.cache_size << 20) if args.cache else None
+    manifest = run_batch(tasks, args.output_dir, args.workers,
+                         not args.no_stream, args.backend, cache, args.validate, args.profile,
+                         args.compact, args.compress)
+
+    print(f"Generated {manifest['generated']} scenarios in {manifest['total_seconds']:.2f}s "
+          f"({manifest['failed']} failed, {manifest['cache_hits']} from cache) -> {os.path.join(args.output_dir, 'manifest.json')}")
+    sys.exit(1 if manifest["failed"] else 0)
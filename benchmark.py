@@ -0,0 +1,217 @@
+import xml.etree.ElementTree as ET
+import os
+import random
+import sys
+import tempfile
+import time
+from network_builder import NetworkBuilder
+from link_index import LinkIndex
+from attachment import CapacityPool, attach
+from createXmlV2 import build_scenario
+from topologies import TOPOLOGIES
+
+###
+# Regression benchmark for the automatic link generators.
+#
+#   python benchmark.py            # run and fail (exit 1) on a regression
+#
+# generate_random_links must stay linear in the number of links it emits
+# and must keep producing exactly the same link list as the original
+# list-based implementation (kept below as _legacy_generate_random_links).
+# The template emitter must write the same bytes as the ElementTree one
+# and stay at least MIN_TEMPLATE_SPEEDUP times faster.
+####
+
+# (SWITCH, router, PC) mixes; the router mesh dominates the link count
+LINK_SIZES = [(25, 50, 100), (50, 100, 200), (100, 200, 400), (200, 400, 800)]
+
+# Allowed growth of seconds-per-link between the smallest and largest size
+MAX_PER_LINK_GROWTH = 3.0
+
+# Switch -> router attachment with one switch per router
+ATTACH_SIZE = 10000
+MAX_ATTACH_SECONDS = 1.0
+
+# Whole scenario written by both emitter backends
+BACKEND_CONFIG = {
+    "devices": {"SWITCH": 50, "router": 50, "PC": 20000},
+    "deterministic_links": True,
+    "ip4_subnet_prefix": 22
+}
+# Against the ElementTree backend as scenario_writer.serialize writes it;
+# that path lost its ET.indent pass and runs about twice as fast as it
+# used to, so the template backend is now 2.4-2.9x ahead of it (it was
+# 6-7x ahead of ET.indent + tree.write) at unchanged absolute speed
+MIN_TEMPLATE_SPEEDUP = 2.0
+BACKEND_ROUNDS = 5
+
+# Router counts for the topology models; seconds-per-link may grow at most
+# MAX_PER_LINK_GROWTH between them
+TOPOLOGY_SIZES = [1000, 10000]
+
+
+def make_builder(switches, routers, pcs):
+    builder = NetworkBuilder()
+    device_counts = {"SWITCH": switches, "router": routers, "PC": pcs}
+    builder.add_user_networks(ET.Element("networks"), device_counts)
+    builder.add_user_devices(ET.Element("devices"), device_counts)
+    return builder
+
+
+def _legacy_generate_random_links(device_registry):
+    # Original O(links^2) implementation, only used to check equivalence
+    links = []
+    seen_links = []
+    routers, switch_and_hubs, pcs = [], [], []
+    for device_id, info in device_registry.items():
+        dtype = info["type"].lower()
+        if dtype == "router":
+            routers.append(device_id)
+        elif dtype in {"switch", "hub"}:
+            switch_and_hubs.append(device_id)
+        elif dtype == "pc":
+            pcs.append(device_id)
+
+    for i in range(len(routers)):
+        for j in range(i + 1, len(routers)):
+            r1, r2 = routers[i], routers[j]
+            link = (min(r1, r2), max(r1, r2))
+            if link not in seen_links:
+                links.append(link)
+                seen_links.append(link)
+
+    router_index = 0
+    switches_connected_to_routers = set()
+    for switch_id in switch_and_hubs:
+        if routers:
+            router_id = routers[router_index % len(routers)]
+            link = (min(switch_id, router_id), max(switch_id, router_id))
+            if link not in seen_links:
+                links.append(link)
+                seen_links.append(link)
+                switches_connected_to_routers.add(switch_id)
+                router_index += 1
+
+    preferred_parents = list(switches_connected_to_routers) or routers
+    parent_index = 0
+    for pc in pcs:
+        for _ in range(len(preferred_parents)):
+            parent = preferred_parents[parent_index % len(preferred_parents)]
+            link = (min(pc, parent), max(pc, parent))
+            if link not in seen_links:
+                links.append(link)
+                seen_links.append(link)
+                parent_index += 1
+                break
+            parent_index += 1
+
+    return links
+
+
+def check_random_links_match_legacy():
+    for switches, routers, pcs in [(0, 0, 3), (0, 3, 5), (2, 2, 4), (3, 4, 10), (7, 9, 40)]:
+        builder = make_builder(switches, routers, pcs)
+        expected = _legacy_generate_random_links(builder.device_registry)
+        if builder.generate_random_links() != expected:
+            print(f"FAIL generate_random_links differs from legacy output for {switches}/{routers}/{pcs}")
+            return False
+    print("generate_random_links matches legacy output")
+    return True
+
+
+def time_call(func, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_random_links():
+    per_link = []
+    print(f"{'switch':>7} {'router':>7} {'pc':>7} {'links':>9} {'seconds':>9} {'us/link':>9}")
+    for switches, routers, pcs in LINK_SIZES:
+        builder = make_builder(switches, routers, pcs)
+        seconds, links = time_call(builder.generate_random_links)
+        per_link.append(seconds / len(links))
+        print(f"{switches:>7} {routers:>7} {pcs:>7} {len(links):>9} {seconds:>9.4f} {per_link[-1] * 1e6:>9.3f}")
+
+    growth = per_link[-1] / per_link[0]
+    if growth > MAX_PER_LINK_GROWTH:
+        print(f"FAIL generate_random_links is not linear: seconds/link grew {growth:.2f}x")
+        return False
+    print(f"generate_random_links is linear (seconds/link grew {growth:.2f}x)")
+    return True
+
+
+def bench_switch_attachment():
+    routers = list(range(ATTACH_SIZE))
+    switches = list(range(ATTACH_SIZE, 2 * ATTACH_SIZE))
+
+    def run():
+        link_index = LinkIndex()
+        attach(switches, CapacityPool(routers, capacity=1), link_index, random.Random(0))
+        return link_index
+
+    seconds, link_index = time_call(run)
+    print(f"attach {ATTACH_SIZE} switches to {ATTACH_SIZE} routers: {len(link_index)} links in {seconds:.4f}s")
+    if seconds > MAX_ATTACH_SECONDS or len(link_index) != ATTACH_SIZE:
+        print(f"FAIL switch attachment took {seconds:.4f}s (limit {MAX_ATTACH_SECONDS}s)")
+        return False
+    return True
+
+
+def bench_topologies():
+    ok = True
+    print(f"{'topology':>16} {'routers':>8} {'links':>9} {'seconds':>9}")
+    for name in TOPOLOGIES:
+        per_link = []
+        for routers in TOPOLOGY_SIZES:
+            builder = make_builder(routers // 5, routers, routers)
+            seconds, links = time_call(lambda: builder.generate_topology_links(name, 0))
+            per_link.append(seconds / len(links))
+            print(f"{name:>16} {routers:>8} {len(links):>9} {seconds:>9.4f}")
+        growth = per_link[-1] / per_link[0]
+        if growth > MAX_PER_LINK_GROWTH:
+            print(f"FAIL topology {name} is not linear: seconds/link grew {growth:.2f}x")
+            ok = False
+    return ok
+
+
+def bench_backends():
+    with tempfile.TemporaryDirectory() as tmp:
+        seconds = {}
+        output = {}
+        # Alternating rounds, so a slow patch of the machine hits both
+        for _ in range(BACKEND_ROUNDS):
+            for backend in ("etree", "template"):
+                path = os.path.join(tmp, f"{backend}.xml")
+                elapsed, _ = time_call(lambda: build_scenario(BACKEND_CONFIG, path, streaming=True, backend=backend),
+                                       repeat=1)
+                seconds[backend] = min(seconds.get(backend, elapsed), elapsed)
+        for backend in seconds:
+            with open(os.path.join(tmp, f"{backend}.xml"), "rb") as f:
+                output[backend] = f.read()
+
+    speedup = seconds["etree"] / seconds["template"]
+    print(f"scenario with {sum(BACKEND_CONFIG['devices'].values())} nodes: etree {seconds['etree']:.3f}s, "
+          f"template {seconds['template']:.3f}s ({speedup:.1f}x)")
+    if output["etree"] != output["template"]:
+        print("FAIL template backend output differs from the ElementTree backend")
+        return False
+    if speedup < MIN_TEMPLATE_SPEEDUP:
+        print(f"FAIL template backend is only {speedup:.1f}x faster (expected {MIN_TEMPLATE_SPEEDUP}x)")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    ok = check_random_links_match_legacy()
+    ok = bench_random_links() and ok
+    ok = bench_switch_attachment() and ok
+    ok = bench_topologies() and ok
+    ok = bench_backends() and ok
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,82 @@
+import base64
+import json
+import os
+
+###
+# On-disk NetworkBuilder state for incremental updates.
+#
+# createXmlV2 saves the builder next to the scenario it wrote
+# (scenario.xml -> scenario.xml.state.json) together with the config it
+# was built from. update_scenario() restores it, applies only what changed
+# in the config and saves it again, so IDs, interface numbers and subnets
+# of untouched nodes never move.
+#
+# JSON has no bytes or tuple keys, so byte columns are base64 and the
+# link / LAN / adjacency maps are stored as flat lists.
+###
+
+STATE_VERSION = 1
+
+
+def default_state_path(output_path):
+    return output_path + ".state.json"
+
+
+def _encode_builder(snapshot):
+    registry = dict(snapshot["registry"], type_codes=base64.b64encode(snapshot["registry"]["type_codes"]).decode("ascii"))
+    subnets = dict(snapshot["subnets"], used=base64.b64encode(snapshot["subnets"]["used"]).decode("ascii"))
+
+    links = []
+    for (node1, node2), subnet in snapshot["links"].items():
+        links.extend((node1, node2, subnet))
+
+    return dict(
+        snapshot,
+        registry=registry,
+        subnets=subnets,
+        adjacency=[[node_id, neighbors] for node_id, neighbors in snapshot["adjacency"].items()],
+        links=links,
+        lans=[[center_id, subnet, next_host] for center_id, (subnet, next_host) in snapshot["lans"].items()]
+    )
+
+
+def _decode_builder(data):
+    registry = dict(data["registry"], type_codes=base64.b64decode(data["registry"]["type_codes"]))
+    subnets = dict(data["subnets"], used=base64.b64decode(data["subnets"]["used"]))
+
+    flat = data["links"]
+    links = {(flat[i], flat[i + 1]): flat[i + 2] for i in range(0, len(flat), 3)}
+
+    return dict(
+        data,
+        registry=registry,
+        subnets=subnets,
+        adjacency={node_id: neighbors for node_id, neighbors in data["adjacency"]},
+        links=links,
+        lans={center_id: [subnet, next_host] for center_id, subnet, next_host in data["lans"]}
+    )
+
+
+def save_state(path, builder, config):
+    state = {
+        "version": STATE_VERSION,
+        "config": config,
+        "builder": _encode_builder(builder.snapshot())
+    }
+    # Write then rename, so an interrupted save never leaves half a state
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(state, separators=(",", ":")))  # dumps uses the C encoder, dump does not
+    os.replace(tmp_path, path)
+
+
+def load_state(path):
+    # Returns (config, builder snapshot), or None if there is no usable state
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("version") != STATE_VERSION:
+        return None
+    return state["config"], _decode_builder(state["builder"])
@@ -1,27 +1,15 @@
 import xml.etree.ElementTree as ET
+import argparse
 import glob
+import json
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from basic_core_structure import STATIC_SECTIONS, build_static_section
+from xml_repair import canvas_dimensions, fix_duplicate_ids, repair_file
+from scenario_io import STDIO, SUFFIXES
 
-FULL_SESSION_OPTIONS = [
-    {"name": "controlnet", "value": ""},
-    {"name": "controlnet0", "value": ""},
-    {"name": "controlnet1", "value": ""},
-    {"name": "controlnet2", "value": ""},
-    {"name": "controlnet3", "value": ""},
-    {"name": "controlnet_updown_script", "value": ""},
-    {"name": "enablerj45", "value": "1"},
-    {"name": "preservedir", "value": "0"},
-    {"name": "enablesdt", "value": "0"},
-    {"name": "sdturl", "value": "tcp://127.0.0.1:50000/"},
-    {"name": "ovs", "value": "0"},
-    {"name": "platform_id_start", "value": "1"},
-    {"name": "nem_id_start", "value": "1"},
-    {"name": "link_enabled", "value": "1"},
-    {"name": "loss_threshold", "value": "30"},
-    {"name": "link_interval", "value": "1"},
-    {"name": "link_timeout", "value": "4"},
-    {"name": "mtu", "value": "0"}
-]
 def ensure_default_services(root):
     # Remove existing <default_services> if it exists
     default_services = root.find("default_services")
@@ -30,17 +18,7 @@ def ensure_default_services(root):
         print("Removed existing <default_services> section")
 
     # Create fresh <default_services> with known correct structure
-    default_services = ET.SubElement(root, "default_services")
-    for node_type, services in {
-        "mdr": ["zebra", "OSPFv3MDR", "IPForward"],
-        "PC": ["DefaultRoute"],
-        "prouter": [],
-        "router": ["zebra", "OSPFv2", "OSPFv3", "IPForward"],
-        "host": ["DefaultRoute", "SSH"]
-    }.items():
-        node_elem = ET.SubElement(default_services, "node", {"type": node_type})
-        for svc_name in services:
-            ET.SubElement(node_elem, "service", {"name": svc_name})
+    root.append(build_static_section("default_services"))
     print("Replaced <default_services> with correct version")
 
 
@@ -51,9 +29,7 @@ def ensure_session_options(root):
         print("Removed existing <session_options> section")
 
     # Create fresh <session_options> block
-    session_options = ET.SubElement(root, "session_options")
-    for opt in FULL_SESSION_OPTIONS:
-        ET.SubElement(session_options, "configuration", opt)
+    root.append(build_static_section("session_options"))
     print("Replaced <session_options> with correct version")
 
 def ensure_session_metadata(root):
@@ -64,9 +40,7 @@ def ensure_session_metadata(root):
         print("Removed existing <session_metadata> section")
 
     # Create fresh <session_metadata> with required structure
-    session_metadata = ET.SubElement(root, "session_metadata")
-    ET.SubElement(session_metadata, "configuration", {"name": "user", "value": "core"})
-    ET.SubElement(session_metadata, "configuration", {"name": "node_prefix", "value": "n"})
+    root.append(build_static_section("session_metadata"))
     print("Replaced <session_metadata> section")
 
 def ensure_session_origin(root):
@@ -77,12 +51,7 @@ def ensure_session_origin(root):
         print("Removed existing <session_origin> section")
 
     # Create fresh <session_origin>
-    session_origin = ET.SubElement(root, "session_origin")
-    ET.SubElement(session_origin, "location", {
-        "lat": "47.5791667",
-        "lon": "-122.132322",
-        "alt": "2.000000"
-    })
+    root.append(build_static_section("session_origin"))
     print("Replaced <session_origin> section")
 
 def ensure_element(parent, tag):
@@ -93,99 +62,146 @@ def ensure_element(parent, tag):
     return found
 
 
-def add_missing_sections(tree):
-    root = tree.getroot()
-    fix_duplicate_ids(root)
+def existing_canvas_dimensions(root):
+    # Canvas size of an existing <session_metadata>, so grown canvases survive the fix
+    return canvas_dimensions(root.find("session_metadata"))
 
-    # Remove existing sections if they exist
-    for tag in ["session_origin", "session_options", "session_metadata", "default_services"]:
+
+def strip_static_sections(root):
+    # Removes the static sections and returns the index they belong at
+    closing = root[-1].tail if len(root) else None
+    for tag in STATIC_SECTIONS:
         existing = root.find(tag)
         if existing is not None:
             root.remove(existing)
             print(f"Removed existing <{tag}> section")
+    if len(root):
+        root[-1].tail = closing  # keep the whitespace before </scenario>
 
     # Find index to insert after configservice_configurations
-    insertion_index = None
     for i, elem in enumerate(root):
         if elem.tag == "configservice_configurations":
-            insertion_index = i + 1
-            break
+            return i + 1
+
+    # Default to appending at the end if configservice_configurations is not found
+    return len(root)
 
-    if insertion_index is None:
-        # Default to appending at the end if configservice_configurations is not found
-        insertion_index = len(root)
 
-    # Helper function to insert and return newly created element
-    def insert_section(tag, attrib=None):
-        elem = ET.Element(tag, attrib or {})
-        root.insert(insertion_index, elem)
+def add_missing_sections(tree):
+    # In-memory variant of check_and_fix_xml: the static sections are
+    # inserted as Elements after configservice_configurations
+    root = tree.getroot()
+    report = fix_duplicate_ids(root)
+    for remap in report["remapped"]:
+        renamed = f" and renamed it {remap['renamed']!r}" if "renamed" in remap else ""
+        print(f"Renumbered <{remap['tag']}> {remap['name']!r} from id {remap['old']} to {remap['new']}{renamed}")
+
+    dimensions = existing_canvas_dimensions(root)
+    insertion_index = strip_static_sections(root)
+    for tag in STATIC_SECTIONS:
+        root.insert(insertion_index, build_static_section(tag, dimensions))
         print(f"Inserted <{tag}> at index {insertion_index}")
-        insertion_index_plus_one = insertion_index + 1
-        return elem, insertion_index_plus_one
-
-    # 1. <session_origin>
-    session_origin, insertion_index = insert_section("session_origin", {
-        "lat": "47.579166412353516",
-        "lon": "-122.13232421875",
-        "alt": "2.0",
-        "scale": "150.0"
-    })
-
-    # 2. <session_options>
-    session_options, insertion_index = insert_section("session_options")
-    for opt in FULL_SESSION_OPTIONS:
-        ET.SubElement(session_options, "configuration", opt)
-
-    # 3. <session_metadata>
-    session_metadata, insertion_index = insert_section("session_metadata")
-    for meta in [
-        {"name": "shapes", "value": "[]"},
-        {"name": "hidden", "value": "[]"},
-        {"name": "edges", "value": "[]"},
-        {"name": "canvas", "value": '{"gridlines": true, "canvases": [{"id": 1, "wallpaper": null, "wallpaper_style": 1, "fit_image": false, "dimensions": [1000, 750]}]}'}
-    ]:
-        ET.SubElement(session_metadata, "configuration", meta)
-
-    # 4. <default_services>
-    default_services, insertion_index = insert_section("default_services")
-    for node_type, services in {
-        "mdr": ["zebra", "OSPFv3MDR", "IPForward"],
-        "PC": ["DefaultRoute"],
-        "prouter": [],
-        "router": ["zebra", "OSPFv2", "OSPFv3", "IPForward"],
-        "host": ["DefaultRoute", "SSH"]
-    }.items():
-        node_elem = ET.SubElement(default_services, "node", {"type": node_type})
-        for svc_name in services:
-            ET.SubElement(node_elem, "service", {"name": svc_name})
+        insertion_index += 1
 
     print("Finished adding missing sections in correct order")
 
-  
-
-def fix_duplicate_ids(root):
-    print("duplicate id found")
-
 
 def check_and_fix_xml(file_path, output_path=None):
-    tree = ET.parse(file_path)
-    add_missing_sections(tree)
-    if not output_path:
-        output_path = file_path
-    tree.write(output_path, encoding="utf-8", xml_declaration=True)
-    print(f"Checked and updated: {output_path}")
-
-
-input_dir = "." 
-
-input_pattern = os.path.join(input_dir, "generated_core_scenario-throughcode-3feedback*.xml")
- 
-xml_files = glob.glob(input_pattern)
-
-output_dir = "fixed_scenarios"
-
-
-for file_path in xml_files:
-    base_name = os.path.basename(file_path)
-    output_path = os.path.join(output_dir, f"fixed_{base_name}")
-    check_and_fix_xml(file_path, output_path)
+    # Streams file_path into output_path (default: in place) with fresh
+    # static sections; see xml_repair.py
+    result = repair_file(file_path, output_path or file_path)
+    if "error" in result:
+        raise ValueError(f"{file_path}: {result['error']}")
+    return result
+
+
+def _repair_one(job):
+    # Runs in a worker process
+    return repair_file(*job)
+
+
+def output_path_for(path, output_dir=None, compress=None):
+    # fixed_<name> in output_dir, or path itself (in place). compress "gz" /
+    # "zst" swaps the compression suffix of the name; without it the output
+    # is compressed like the input name says.
+    if compress:
+        root, suffix = os.path.splitext(path)
+        path = (root if suffix.lower() in SUFFIXES else path) + "." + compress
+    return os.path.join(output_dir, f"fixed_{os.path.basename(path)}") if output_dir else path
+
+
+##
+# Repairs every file matching the patterns with a pool of worker processes.
+# Returns the summary that is printed (and saved with --summary).
+# output_dir "-" writes the one matching file to stdout.
+##
+def repair_all(patterns, output_dir=None, workers=None, compress=None):
+    files = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    if output_dir == STDIO:
+        if len(files) != 1:
+            raise ValueError(f"stdout takes exactly one file, {len(files)} match")
+        jobs = [(files[0], STDIO)]
+    else:
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        jobs = [(path, output_path_for(path, output_dir, compress)) for path in files]
+
+    workers = min(workers or os.cpu_count() or 1, max(1, len(jobs)))
+    start = time.perf_counter()
+    if workers == 1:
+        results = [_repair_one(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # One file per task: files can differ in size by orders of magnitude
+            results = list(executor.map(_repair_one, jobs))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "workers": workers,
+        "files": results,
+        "repaired": sum(1 for r in results if "error" not in r),
+        "failed": sum(1 for r in results if "error" in r),
+        "bytes": sum(r.get("bytes", 0) for r in results),
+        "total_seconds": round(elapsed, 6)
+    }
+
+
+def print_summary(summary):
+    for result in summary["files"]:
+        if "error" in result:
+            print(f"  FAILED  {result['input']}: {result['error']}")
+        else:
+            remapped = len(result["duplicates"]["remapped"]) if "duplicates" in result else 0
+            note = f"  ({remapped} duplicate ids renumbered)" if remapped else ""
+            print(f"  {result['seconds']:9.3f}s  {result.get('bytes', 0) / 1e6:10.1f} MB  {result['output']}{note}")
+    seconds = summary["total_seconds"]
+    rate = summary["bytes"] / 1e6 / seconds if seconds else 0.0
+    print(f"Repaired {summary['repaired']} files ({summary['failed']} failed) in {seconds:.2f}s "
+          f"with {summary['workers']} workers, {rate:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replace the static sections of CORE scenario files")
+    parser.add_argument("patterns", nargs="*",
+                        default=[os.path.join(".", "generated_core_scenario-throughcode-3feedback*.xml")],
+                        help="files or glob patterns to repair")
+    parser.add_argument("--output-dir", default="fixed_scenarios",
+                        help="write fixed_<name> files here (empty string: repair in place, "
+                             "\"-\": write the one matching file to stdout)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--summary", help="also write the summary with per-file timings here as JSON")
+    parser.add_argument("--compress", choices=[suffix[1:] for suffix in SUFFIXES],
+                        help="write the fixed files compressed (inputs may be compressed either way)")
+    args = parser.parse_args()
+    if args.output_dir == STDIO:
+        sys.stdout = sys.stderr  # the fixed XML goes to stdout; messages must not
+
+    try:
+        summary = repair_all(args.patterns, args.output_dir, args.workers, args.compress)
+    except ValueError as e:
+        parser.error(str(e))
+    print_summary(summary)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+    sys.exit(1 if summary["failed"] else 0)
@@ -0,0 +1,90 @@
+import json
+import mmap
+import os
+import sys
+from array import array
+
+###
+# Column files: a JSON header and flat array columns, memory-mappable.
+#
+#   magic                  8 bytes, names the kind of file
+#   header length          8 bytes, little endian
+#   header                 JSON; the writer adds "byteorder" and
+#                          "columns": {name: {type, itemsize, count, offset}}
+#   columns                raw array bytes in the writer's byte order,
+#                          each 8-byte aligned
+#
+# Used by topology files (topology_file.py) and scenario index files
+# (scenario_index.py). Reading puts every column straight into an array
+# with one readinto(), or with use_mmap=True hands out read-only
+# memoryviews over the mapped file, so loading costs the header parse.
+###
+
+_ALIGN = 8
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def write_columns(path, magic, header, columns):
+    # columns: {name: array}; written to a temporary name and renamed
+    header = dict(header, byteorder=sys.byteorder, columns={})
+    offset = 0
+    for name, column in columns.items():
+        header["columns"][name] = {"type": column.typecode, "itemsize": column.itemsize,
+                                   "count": len(column), "offset": offset}
+        offset = _aligned(offset + len(column) * column.itemsize)
+
+    text = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(magic + len(text).to_bytes(8, "little") + text)
+        f.write(bytes(_aligned(f.tell()) - f.tell()))
+        for column in columns.values():
+            f.write(column)
+            f.write(bytes(_aligned(f.tell()) - f.tell()))
+    os.replace(tmp_path, path)
+
+
+##
+# Returns (header, {name: column}, mapping). Columns are arrays, or with
+# use_mmap=True memoryviews over `mapping`, which the caller closes once
+# it has dropped them (mapping is None otherwise, and for files of the
+# other byte order, which are always read and swapped).
+##
+def read_columns(path, magic, kind, use_mmap=False):
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f"{path} is not a {kind} file")
+        length = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(length))
+
+        start = _aligned(f.tell())
+        swap = header["byteorder"] != sys.byteorder
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap and not swap else None
+
+        columns = {}
+        for name, spec in header["columns"].items():
+            typecode = spec["type"]
+            if array(typecode).itemsize != spec["itemsize"]:
+                raise ValueError(f"{path}: column {name} has {spec['itemsize']}-byte items, "
+                                 f"array('{typecode}') here has {array(typecode).itemsize}")
+            offset = start + spec["offset"]
+            size = spec["count"] * spec["itemsize"]
+            if mapping is not None:
+                if offset + size > len(mapping):
+                    raise ValueError(f"{path}: column {name} is truncated")
+                with memoryview(mapping) as data:
+                    columns[name] = data[offset:offset + size].cast(typecode)
+                continue
+
+            column = array(typecode, [0]) * spec["count"]
+            f.seek(offset)
+            if f.readinto(memoryview(column).cast("B")) != size:
+                raise ValueError(f"{path}: column {name} is truncated")
+            if swap:
+                column.byteswap()
+            columns[name] = column
+
+    return header, columns, mapping
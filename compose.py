@@ -0,0 +1,325 @@
+import argparse
+import json
+import xml.etree.ElementTree as ET
+from array import array
+from bisect import bisect_right
+from basic_core_structure import (
+    add_session_origin,
+    add_session_options,
+    add_session_metadata,
+    add_default_services,
+    add_mobility_configurations
+)
+from builder_state import load_state
+from createXmlV2 import SCENARIO_ATTRIB
+from device_registry import DeviceRegistry, REMOVED
+from emitters import EMITTERS, make_emitter
+from link_index import LinkIndex
+from network_builder import NetworkBuilder
+from scenario_writer import open_scenario_writer, open_section, close_section
+from scenario_io import open_input
+
+###
+# Composing one scenario from several regional ones.
+#
+# Every region is a scenario XML or a builder state (*.state.json) saved by
+# createXmlV2. compose() registers the nodes of each region in one new
+# NetworkBuilder, region after region, so IDs are offset by the size of the
+# regions before them. Each region's old IDs map to new ones through an
+# array indexed by (old ID - its first ID); connections are remapped with
+# one lookup per end and no tree is searched.
+#
+# All records are then written fresh by the composed builder: links get
+# subnets from one allocator, so no two regions share an address, and
+# interfaces are numbered per node again. Every region is laid out in its
+# own rectangle of the canvas with its usual router clusters, and routers
+# of different regions are connected according to `inter_region`:
+#
+#   none    no links between regions
+#   chain   region 1 - 2 - 3 ...
+#   ring    chain plus last - first
+#   mesh    every pair of regions
+#   "0-1,1-3"  explicit pairs of region indexes
+#
+# with links_per_pair router links per connected pair, taking each
+# region's routers round-robin. Node types are kept; config services come
+# from the node types, as in a fresh build.
+#
+#   python compose.py east.xml west.xml.state.json -o merged.xml --inter-region ring --links-per-pair 2
+###
+
+INTER_REGION_MODES = ["none", "chain", "ring", "mesh"]
+
+ROUTER_TYPE_NAMES = ("router", "mdr")
+
+# Types NetworkBuilder writes as <network> (its network_prefixes)
+NETWORK_TYPE_NAMES = {"SWITCH", "HUB", "WIRELESS_LAN"}
+
+
+class Region:
+    # One sub-topology: its nodes in a DeviceRegistry (gaps are REMOVED)
+    # and its connections as (node1, node2) pairs of its own IDs
+
+    def __init__(self, source, registry, connections, network_types):
+        self.source = source
+        self.registry = registry
+        self.connections = connections
+        self.network_types = network_types
+
+
+def _region_from_state(path):
+    state = load_state(path)
+    if state is None:
+        raise ValueError(f"{path} is not a builder state")
+    _, snapshot = state
+    registry = DeviceRegistry.restore(snapshot["registry"])
+    return Region(path, registry, list(snapshot["links"]), NETWORK_TYPE_NAMES)
+
+
+def _region_from_xml(path):
+    # One iterparse pass; every record is removed from its section as soon
+    # as it is read (and every section from the root), so the parsed tree
+    # never grows with the region. The file may be compressed (see
+    # scenario_io)
+    nodes = {}          # id -> (type, prefix)
+    network_types = set()
+    connections = []
+    with open_input(path) as f:
+        parents = []    # open elements: root, section, record, ...
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                parents.append(elem)
+                continue
+            parents.pop()
+            if len(parents) == 1:
+                parents[0].remove(elem)  # a section, already emptied
+                continue
+            if len(parents) != 2:
+                continue
+
+            tag = elem.tag
+            if tag == "network" or tag == "device":
+                node_id = int(elem.get("id"))
+                name = elem.get("name", "")
+                prefix = name[:-len(str(node_id))] if name.endswith(str(node_id)) else "n"
+                nodes[node_id] = (elem.get("type"), prefix)
+                if tag == "network":
+                    network_types.add(elem.get("type"))
+            elif tag == "link":
+                connections.append((int(elem.get("node1")), int(elem.get("node2"))))
+            parents[1].remove(elem)
+
+    registry = DeviceRegistry(min(nodes, default=1))
+    for node_id in range(registry.start_id, max(nodes, default=0) + 1):
+        if node_id in nodes:
+            type_name, prefix = nodes[node_id]
+            registry.add(type_name, 1, prefix)
+        else:
+            registry.type_codes.append(REMOVED)
+            registry.interfaces.append(0)
+            registry.next_id += 1
+            registry.removed += 1
+    return Region(path, registry, connections, network_types)
+
+
+def load_region(path):
+    if path.endswith(".json"):
+        return _region_from_state(path)
+    return _region_from_xml(path)
+
+
+def _add_region(builder, region):
+    # Registers the region's nodes in ID order, one block per run of equal
+    # types, and returns the old -> new ID array (0 for missing IDs)
+    source = region.registry
+    registry = builder.device_registry
+    remap = array("I", [0]) * len(source.type_codes)
+
+    new_id = registry.next_id
+    run_code = None
+    run_length = 0
+    for index, code in enumerate(source.type_codes):
+        if code == REMOVED:
+            continue
+        if code != run_code:
+            if run_length:
+                registry.add(source.type_names[run_code], run_length, source.prefixes[run_code])
+            run_code, run_length = code, 0
+        remap[index] = new_id
+        new_id += 1
+        run_length += 1
+    if run_length:
+        registry.add(source.type_names[run_code], run_length, source.prefixes[run_code])
+    builder.current_id = registry.next_id
+
+    for type_name in region.network_types:
+        builder.network_prefixes.setdefault(type_name, "n")
+    return remap
+
+
+def region_pairs(count, inter_region):
+    # Pairs of region indexes to connect
+    if inter_region == "none" or count < 2:
+        return []
+    if inter_region == "chain":
+        return [(i, i + 1) for i in range(count - 1)]
+    if inter_region == "ring":
+        pairs = [(i, i + 1) for i in range(count - 1)]
+        return pairs + [(count - 1, 0)] if count > 2 else pairs
+    if inter_region == "mesh":
+        return [(i, j) for i in range(count) for j in range(i + 1, count)]
+
+    pairs = []
+    for part in inter_region.split(","):
+        try:
+            a, b = (int(side) for side in part.split("-"))
+        except ValueError:
+            raise ValueError(f"Bad region pair {part!r}; use e.g. \"0-1,1-2\" or one of {', '.join(INTER_REGION_MODES)}")
+        if not (0 <= a < count and 0 <= b < count) or a == b:
+            raise ValueError(f"Region pair {part!r} does not name two of the {count} regions")
+        pairs.append((a, b))
+    return pairs
+
+
+def inter_region_links(gateways, pairs, links_per_pair=1):
+    # Router links between regions; gateways[i] are region i's routers,
+    # used round-robin so consecutive pairs leave through different routers.
+    # Returns (links, skipped pairs): a pair is skipped when one of its
+    # regions has no router or MDR
+    link_index = LinkIndex()
+    skipped = []
+    turn = [0] * len(gateways)
+    for a, b in pairs:
+        if not gateways[a] or not gateways[b]:
+            skipped.append((a, b))
+            continue
+        for _ in range(links_per_pair):
+            router_a = gateways[a][turn[a] % len(gateways[a])]
+            router_b = gateways[b][turn[b] % len(gateways[b])]
+            turn[a] += 1
+            turn[b] += 1
+            link_index.add(router_a, router_b)
+    return link_index.links, skipped
+
+
+##
+# Merges the regions (paths or Region objects) into one scenario at
+# output_path. Returns a report: per region its source, new ID range, node
+# count and canvas rectangle in pixels, plus the inter-region links and the
+# region pairs left unlinked for lack of routers. Explicitly requested
+# pairs ("0-1,1-3") that cannot be linked raise ValueError instead.
+##
+def compose(regions, output_path, inter_region="ring", links_per_pair=1, ip4_base="192.168.5.0",
+            ip6_base="2001::0", ip4_prefix=24, backend="template", gap=1):
+    regions = [load_region(region) if isinstance(region, str) else region for region in regions]
+
+    builder = NetworkBuilder(1, ip4_base, ip6_base, ip4_prefix, emitter=make_emitter(backend))
+    registry = builder.device_registry
+
+    connections = []
+    ranges = []
+    for region in regions:
+        first = registry.next_id
+        remap = _add_region(builder, region)
+        start = region.registry.start_id
+        ranges.append((first, registry.next_id))
+
+        region_connections = []
+        for node1, node2 in region.connections:
+            new1, new2 = remap[node1 - start], remap[node2 - start]
+            if new1 and new2:
+                region_connections.append((new1, new2))
+        connections.extend(region_connections)
+
+    # Region of an ID: regions hold consecutive ID ranges
+    firsts = [first for first, _ in ranges]
+
+    def region_of(node_id):
+        return bisect_right(firsts, node_id) - 1
+
+    gateways = [[] for _ in regions]
+    for node_id in registry.ids_of(*ROUTER_TYPE_NAMES):
+        gateways[region_of(node_id)].append(node_id)
+
+    # Clusters of the whole graph never cross regions yet (no inter-region
+    # links); only the cluster of loose nodes is split between them
+    by_region = [[] for _ in regions]
+    for cluster in builder.clusters(connections):
+        parts = {}
+        for node_id in cluster:
+            parts.setdefault(region_of(node_id), []).append(node_id)
+        for index, part in parts.items():
+            by_region[index].append(part)
+    rectangles = builder.layout.plan_regions(by_region, gap)
+
+    bridges, skipped = inter_region_links(gateways, region_pairs(len(regions), inter_region), links_per_pair)
+    if skipped and inter_region not in INTER_REGION_MODES:
+        a, b = skipped[0]
+        raise ValueError(f"Cannot link regions {a} and {b}: no router or MDR in one of them")
+    connections.extend(bridges)
+
+    network_ids = registry.ids_of(*builder.network_prefixes)
+    device_ids = registry.ids_of(*[name for name in registry.type_names if name not in builder.network_prefixes])
+
+    with open_scenario_writer(output_path, SCENARIO_ATTRIB) as writer:
+        networks = open_section(writer, "networks")
+        builder.add_networks(networks, network_ids)
+        close_section(networks)
+
+        devices = open_section(writer, "devices")
+        builder.add_devices(devices, device_ids)
+        close_section(devices)
+
+        links = open_section(writer, "links")
+        builder.generate_links(links, connections)
+        close_section(links)
+
+        builder.add_configservice_configurations(writer)
+        add_mobility_configurations(writer, registry)
+
+        add_session_origin(writer)
+        add_session_options(writer)
+        add_session_metadata(writer, builder.canvas_dimensions())
+        add_default_services(writer)
+
+    layout = builder.layout
+    return {
+        "regions": [
+            {
+                "source": region.source,
+                "ids": [first, end - 1],
+                "nodes": end - first,
+                "area": [layout.min_x + col * layout.x_step, layout.min_y + row * layout.y_step,
+                         columns * layout.x_step, rows * layout.y_step]
+            }
+            for region, (first, end), (col, row, columns, rows) in zip(regions, ranges, rectangles)
+        ],
+        "inter_region_links": [list(pair) for pair in bridges],
+        "skipped_region_pairs": [list(pair) for pair in skipped],
+        "nodes": len(registry),
+        "links": len(builder.links)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge regional CORE scenarios into one")
+    parser.add_argument("regions", nargs="+", help="scenario XML files or builder states (*.state.json)")
+    parser.add_argument("-o", "--output", default="composed_scenario.xml")
+    parser.add_argument("--inter-region", default="ring",
+                        help=f"{', '.join(INTER_REGION_MODES)}, or region index pairs like \"0-1,1-2\"")
+    parser.add_argument("--links-per-pair", type=int, default=1, help="router links per connected pair of regions")
+    parser.add_argument("--ip4-base", default="192.168.5.0")
+    parser.add_argument("--ip4-prefix", type=int, default=24)
+    parser.add_argument("--backend", choices=list(EMITTERS), default="template")
+    parser.add_argument("--report", help="write the composition report here as JSON")
+    args = parser.parse_args()
+
+    report = compose(args.regions, args.output, args.inter_region, args.links_per_pair,
+                     args.ip4_base, ip4_prefix=args.ip4_prefix, backend=args.backend)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    for a, b in report["skipped_region_pairs"]:
+        print(f"[Notice] Could not link regions {a} and {b} — no router or MDR in one of them.")
+    print(f"Composed {len(report['regions'])} regions into {args.output}: {report['nodes']} nodes, "
+          f"{report['links']} links ({len(report['inter_region_links'])} between regions)")
@@ -1,84 +1,446 @@
 import xml.etree.ElementTree as ET
-from network_builder import NetworkBuilder
-import json 
+from network_builder import NetworkBuilder, DEVICE_SERVICES
+import argparse
+import json
+import os
+import sys
+from itertools import islice
 from basic_core_structure import (
     add_session_origin,
     add_session_options,
     add_session_metadata,
     add_default_services,
-    add_mobility_configurations
+    add_mobility_configurations,
+    canvas_value,
+    mobility_configuration
 )
+from scenario_writer import open_scenario_writer, open_section, close_section, write_tree
+from emitters import EMITTERS, TemplateEmitter, make_emitter
+from builder_state import default_state_path, save_state, load_state
+from scenario_patch import ScenarioPatch
+from scenario_cache import DEFAULT_MAX_BYTES, ScenarioCache
+from validation import TopologyError, check_addresses
+from instrumentation import Instrumentation, NO_INSTRUMENTATION
+from scenario_io import STDIO, map_input, open_output, output_codec, temporary_path
+from topology_file import save_topology
 
 
+SCENARIO_ATTRIB = {"name": "/tmp/tmpxwrcvn1n"} #will need to be dynamic but ok for now
 
+# Part of every scenario cache key; bump it whenever the same config would
+# produce different XML
+GENERATOR_VERSION = "2.0"
 
-# Start scenario
-scenario = ET.Element("scenario", {"name": "/tmp/tmpxwrcvn1n"}) #will need to be dynamic but ok for now 
 
-# Load config
-with open("scenario_config.json") as f:
-    config = json.load(f)
+def populate_scenario(scenario, config, emitter=None, validate=False, instrumentation=None):
+    # scenario is either the <scenario> Element or a ScenarioWriter; every
+    # section is opened, filled and closed in document order so both work.
+    # emitter picks the serialization backend (see emitters.py). validate
+    # checks the topology before any record is written and the addresses
+    # after; errors raise TopologyError, the report is builder.validation.
+    # instrumentation collects stage timings (see instrumentation.py)
+    instrumentation = instrumentation or NO_INSTRUMENTATION
+    device_config = config["devices"]
 
-device_config = config["devices"]
+    autogenerate = config.get("autogenerate_links", False)
 
+    custom_ips = config.get("custom_ipv4s")
 
-autogenerate = config.get("autogenerate_links", False)
+    deterministic_links = config.get("deterministic_links")
 
-custom_ips = config.get("custom_ipv4s")
+    # Size of each link / LAN subnet (/24 leaves room for 253 hosts per LAN)
+    ip4_prefix = config.get("ip4_subnet_prefix", 24)
 
-deterministic_links = config.get("deterministic_links")
-
-# Handle static CORE XML sections 
-networks = ET.SubElement(scenario, "networks")
-
-if not custom_ips:
-    builder = NetworkBuilder(start_id=1, ip4_base="192.168.5.0", ip6_base="2001::0")
-else:
-    builder = NetworkBuilder(1, custom_ips, "2001::0")
-
-
-builder.add_user_networks(networks, device_config)
-
-
-devices = ET.SubElement(scenario, "devices")
-
-builder.add_user_devices(devices, device_config)
-
-#connections
-
-if autogenerate or "links" not in config:
-    if deterministic_links:
-        connections = builder.generate_random_links()
+    if not custom_ips:
+        builder = NetworkBuilder(start_id=1, ip4_base="192.168.5.0", ip6_base="2001::0", ip4_prefix=ip4_prefix, emitter=emitter,
+                                 instrumentation=instrumentation)
     else:
-        connections = builder.generate_non_deterministic_links()
-else:
-    connections = config["links"]
-
-links = ET.SubElement(scenario, "links")
-builder.generate_links(links, connections)
-
-builder.add_configservice_configurations(scenario)
-
-add_mobility_configurations(scenario, builder.device_registry)
-
-
-
-
-
-
-# Add static sections using helper methods
-add_session_origin(scenario)
-add_session_options(scenario)
-add_session_metadata(scenario)
-add_default_services(scenario)
-
-
-tree = ET.ElementTree(scenario)
-
-# Indent
-ET.indent(tree, space="  ") 
-
-# Save to file
-tree.write("scenario_with_static.xml", encoding="UTF-8", xml_declaration=True)
-
-
+        builder = NetworkBuilder(1, custom_ips, "2001::0", ip4_prefix, emitter=emitter, instrumentation=instrumentation)
+
+    # IDs first, so the links (and the layout that clusters nodes around
+    # them) are known before any node is written
+    builder.register_devices(device_config)
+
+    #connections
+
+    started = instrumentation.start()
+    if autogenerate or "links" not in config:
+        topology = config.get("topology")
+        if topology:
+            # Router backbone model from topologies.py; reproducible with a
+            # "seed", and always for deterministic_links
+            connections = builder.generate_topology_links(
+                topology, config.get("seed", 0 if deterministic_links else None),
+                config.get("switches_per_router", 1), bool(deterministic_links)
+            )
+        elif deterministic_links:
+            connections = builder.generate_random_links()
+        else:
+            # "seed" makes the random topology reproducible
+            connections = builder.generate_non_deterministic_links(
+                config.get("seed"), config.get("switches_per_router", 1)
+            )
+    else:
+        connections = config["links"]
+    instrumentation.stop("link_generation", started)
+
+    if validate:
+        # Optional "max_interfaces" caps the interfaces of any one node
+        report = builder.validate(connections, config.get("max_interfaces"))
+        if not report["valid"]:
+            raise TopologyError(report)
+
+    builder.plan_layout(connections)
+
+    # Handle static CORE XML sections
+    networks = open_section(scenario, "networks")
+    builder.add_user_networks(networks, device_config)
+    close_section(networks)
+
+
+    devices = open_section(scenario, "devices")
+
+    builder.add_user_devices(devices, device_config)
+    close_section(devices)
+
+    links = open_section(scenario, "links")
+    builder.generate_links(links, connections)
+    close_section(links)
+
+    if validate:
+        addresses = check_addresses(builder)
+        builder.validation["diagnostics"].extend(addresses["diagnostics"])
+        if not addresses["valid"]:
+            builder.validation["valid"] = False
+            raise TopologyError(builder.validation)
+
+    builder.add_configservice_configurations(scenario)
+
+    started = instrumentation.start()
+    add_mobility_configurations(scenario, builder.device_registry)
+
+
+
+    # Add static sections using helper methods
+    add_session_origin(scenario)
+    add_session_options(scenario)
+    add_session_metadata(scenario, builder.canvas_dimensions())
+    add_default_services(scenario)
+    instrumentation.stop("static_sections", started)
+
+    return builder
+
+
+def build_scenario(config, output_path, streaming=False, backend="etree", state_path=None, cache=None,
+                   validate=False, instrumentation=None, compact=False, export_path=None):
+    # backend "template" formats records as text, so it always streams.
+    # state_path saves the builder for later update_scenario() calls.
+    # cache is a ScenarioCache; on a hit the stored XML is put at
+    # output_path and None is returned instead of a builder. Validated
+    # builds never use it: a stored file carries no diagnostics and may
+    # come from a build that was never checked.
+    # validate, instrumentation: see populate_scenario.
+    # compact writes no indentation, for tools rather than people; such
+    # files cannot be patched by update_scenario, which rebuilds them.
+    # output_path ending in .gz / .zst is compressed while it is written,
+    # "-" is stdout (see scenario_io); stdout output is never cached.
+    # export_path also saves the topology as a columnar file the XML can be
+    # rendered from again (see topology_file.py).
+    key = None
+    if cache is not None and not validate and state_path is None and export_path is None and output_path != STDIO:
+        # Compact / indented and compressed / plain output of one config
+        # are different files
+        codec = output_codec(output_path)
+        key = cache.key(config, GENERATOR_VERSION + ("+compact" if compact else "") + (f"+{codec}" if codec else ""))
+        if key is not None and cache.fetch(key, output_path):
+            return None
+        if cache.link and os.path.lexists(output_path):
+            os.remove(output_path)  # may be a hard link into the cache
+
+    instrumentation = instrumentation or NO_INSTRUMENTATION
+    builder = _build_scenario(config, output_path, streaming, backend, state_path, validate,
+                              instrumentation, None if compact else "  ")
+    if export_path:
+        started = instrumentation.start()
+        save_topology(export_path, builder, SCENARIO_ATTRIB)
+        instrumentation.stop("export_topology", started)
+    if key is not None:
+        cache.store(key, output_path)
+    return builder
+
+
+def _build_scenario(config, output_path, streaming, backend, state_path, validate, instrumentation, space):
+    # The scenario is written under a temporary name and renamed once it is
+    # complete, so a build that fails half way never leaves a truncated file
+    # at output_path
+    tmp_path = temporary_path(output_path) if output_path != STDIO else None
+    try:
+        builder = _write_scenario(config, tmp_path or STDIO, streaming, backend, validate, instrumentation, space)
+    except BaseException:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if tmp_path:
+        os.replace(tmp_path, output_path)
+
+    if state_path:
+        started = instrumentation.start()
+        save_state(state_path, builder, config)
+        instrumentation.stop("save_state", started)
+    return builder
+
+
+def _write_scenario(config, output_path, streaming, backend, validate, instrumentation, space):
+    emitter = make_emitter(backend, space)
+    if streaming or backend == "template":
+        # Elements are written as they are produced; memory stays flat
+        with open_scenario_writer(output_path, SCENARIO_ATTRIB, space) as writer:
+            builder = populate_scenario(writer, config, emitter, validate, instrumentation)
+            started = instrumentation.start()
+        instrumentation.stop("write", started)  # the rest of the buffered file
+        return builder
+
+    # Start scenario
+    scenario = ET.Element("scenario", SCENARIO_ATTRIB)
+    builder = populate_scenario(scenario, config, emitter, validate, instrumentation)
+
+    # Save to file, indented while it is serialized (no ET.indent pass)
+    started = instrumentation.start()
+    write_tree(output_path, scenario, space)
+    instrumentation.stop("write", started)
+    return builder
+
+
+# Config keys that change addressing or how links are made; any change
+# to them needs a full rebuild
+REBUILD_KEYS = ["custom_ipv4s", "ip4_subnet_prefix", "autogenerate_links", "deterministic_links", "topology"]
+
+
+def _uses_config_links(config):
+    return not config.get("autogenerate_links", False) and "links" in config
+
+
+def _link_key(node1, node2):
+    return (node1, node2) if node1 < node2 else (node2, node1)
+
+
+##
+# Incremental regeneration.
+#
+# Diffs `config` against the config saved with the builder state and
+# patches the existing scenario: devices removed from the counts (the
+# highest IDs of their type) are dropped with their links, new devices get
+# fresh IDs, positions and links from the same generator rules, and
+# nothing else is touched. Switches, hubs and PCs whose parent was removed
+# are attached again by the same rules. IDs, interfaces and addresses of
+# unchanged nodes stay the same. The file is mapped and streamed through,
+# so memory use is that of the edits, not of the file. Falls back to build_scenario when there is no
+# usable state, a REBUILD_KEYS setting changed or links come from a
+# "topology" model.
+#
+# Returns the change set: added / removed / reattached node IDs and links. It can be
+# saved with delta_path to patch a running CORE session instead of
+# restarting it.
+##
+def update_scenario(config, output_path, state_path=None, delta_path=None):
+    if output_path == STDIO:
+        raise ValueError("incremental updates need an output file, not stdout")
+    state_path = state_path or default_state_path(output_path)
+    state = load_state(state_path) if os.path.exists(output_path) else None
+
+    if state is not None:
+        old_config, snapshot = state
+        if any(old_config.get(key) != config.get(key) for key in REBUILD_KEYS) or \
+                _uses_config_links(old_config) != _uses_config_links(config):
+            state = None
+        elif config.get("topology") and not _uses_config_links(config):
+            state = None  # backbone models are not extended node by node
+
+    if state is not None:
+        # The file is mapped, not read: the patch only holds its edits
+        try:
+            mapping = map_input(output_path)
+        except ValueError:
+            state = None  # empty file
+        else:
+            patch = ScenarioPatch(mapping)
+            if not all(patch.has_section(tag) for tag in ["networks", "devices", "links"]):
+                mapping.close()
+                state = None  # not laid out the way this tool writes scenarios
+
+    if state is None:
+        print("[Notice] No matching builder state; rebuilding the whole scenario.")
+        builder = build_scenario(config, output_path, state_path=state_path)
+        delta = {"rebuilt": True, "added_nodes": list(builder.device_registry)}
+        if delta_path:
+            with open(delta_path, "w") as f:
+                json.dump(delta, f)
+        return delta
+
+    # New records are formatted from templates straight into the patch
+    builder = NetworkBuilder.restore(snapshot, TemplateEmitter())
+    registry = builder.device_registry
+    old_counts = old_config["devices"]
+    new_counts = config["devices"]
+    builder._check_topology(new_counts)
+
+    # Removed devices: the newest IDs of each shrunk type
+    removed = []
+    added_counts = {}
+    for device_type in list(builder.network_prefixes) + list(DEVICE_SERVICES):
+        change = new_counts.get(device_type, 0) - old_counts.get(device_type, 0)
+        if change < 0:
+            removed.extend(registry.ids_of(device_type)[change:])
+        else:
+            added_counts[device_type] = change
+
+    removed_ids, removed_links, orphaned_ids = builder.remove_devices(removed)
+
+    first_new = registry.next_id
+    builder.register_devices(added_counts, validate=False)
+    added_ids = list(range(first_new, registry.next_id))
+
+    # Connections of the new nodes, or the edited part of the config's own list
+    if _uses_config_links(config):
+        old_links = {_link_key(*pair) for pair in old_config["links"]}
+        new_links = {_link_key(*pair) for pair in config["links"]}
+        removed_set = set(removed_ids)
+        removed_links += builder.remove_connections(
+            pair for pair in old_links - new_links if pair[0] not in removed_set and pair[1] not in removed_set
+        )
+        connections = [pair for pair in config["links"] if _link_key(*pair) not in old_links]
+    elif config.get("deterministic_links"):
+        # Nodes that lost their parent are attached again like new ones
+        connections = builder.extend_random_links(added_ids + orphaned_ids)
+    else:
+        connections = builder.extend_non_deterministic_links(
+            added_ids + orphaned_ids, config.get("seed"), config.get("switches_per_router", 1)
+        )
+
+    # Patch the scenario file: only removed / added records are touched
+    gone = {str(node_id).encode() for node_id in removed_ids}
+    gone_links = {(str(node1).encode(), str(node2).encode()) for node1, node2 in removed_links}
+    if gone:
+        patch.remove_records("networks", rb'<network id="(\d+)"', lambda m: m.group(1) in gone)
+        patch.remove_records("devices", rb'<device id="(\d+)"', lambda m: m.group(1) in gone)
+        patch.remove_records("configservice_configurations", rb'<service name="[^"]*" node="(\d+)"',
+                             lambda m: m.group(1) in gone)
+        patch.remove_records("mobility_configurations", rb'<mobility_configuration node="(\d+)"',
+                             lambda m: m.group(1) in gone)
+    if gone_links:
+        patch.remove_records("links", rb'<link node1="(\d+)" node2="(\d+)"',
+                             lambda m: m.groups() in gone_links or m.groups()[::-1] in gone_links)
+
+    links_before = len(builder.links)
+    builder.add_user_networks(patch.section("networks"), added_counts)
+    builder.add_user_devices(patch.section("devices"), added_counts)
+    builder.generate_links(patch.section("links"), connections)
+    builder.add_configservices(patch.section("configservice_configurations"), added_ids)
+    patch.section("mobility_configurations").extend(
+        mobility_configuration(node_id) for node_id in added_ids if registry.type_name(node_id) == "WIRELESS_LAN"
+    )
+    patch.set_canvas(canvas_value(builder.canvas_dimensions()))
+
+    # Unchanged byte ranges are copied from the mapping around the edits
+    tmp_path = temporary_path(output_path)
+    try:
+        with open_output(tmp_path) as f:
+            patch.write(f)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        mapping.close()
+    os.replace(tmp_path, output_path)
+    save_state(state_path, builder, config)
+
+    delta = {
+        "rebuilt": False,
+        "added_nodes": added_ids,
+        "removed_nodes": removed_ids,
+        "reattached_nodes": orphaned_ids,
+        "added_links": [list(pair) for pair in islice(builder.links, links_before, None)],
+        "removed_links": [list(pair) for pair in removed_links]
+    }
+    if delta_path:
+        with open(delta_path, "w") as f:
+            json.dump(delta, f)
+    return delta
+
+
+def print_diagnostics(report):
+    for entry in report["diagnostics"]:
+        print(f"[{entry['severity']}] {entry['code']}: {entry['message']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a CORE scenario XML from a topology config")
+    parser.add_argument("--config", default="scenario_config.json")
+    parser.add_argument("--output", default="scenario_with_static.xml",
+                        help="ending in .gz or .zst compresses the XML; \"-\" writes it to stdout")
+    parser.add_argument("--seed", type=int, help="seed for non-deterministic links (overrides the config)")
+    parser.add_argument("--stream", action="store_true",
+                        help="write elements incrementally instead of building the whole tree in memory")
+    parser.add_argument("--backend", choices=list(EMITTERS), default="etree",
+                        help="serialize records with ElementTree or with string templates (implies --stream)")
+    parser.add_argument("--state", help="save the builder state here for --incremental "
+                                        "(default with --incremental: OUTPUT.state.json)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="patch the existing OUTPUT with the config changes instead of rebuilding it")
+    parser.add_argument("--delta", help="with --incremental, write the added/removed nodes and links here as JSON")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="reuse scenarios generated earlier from the same config (not with --validate)")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES >> 20, metavar="MB",
+                        help="evict least recently used scenarios beyond this size")
+    parser.add_argument("--cache-link", action="store_true",
+                        help="hard-link cache hits instead of copying them (do not edit the output in place)")
+    parser.add_argument("--validate", action="store_true",
+                        help="check connectivity, links and addressing; refuse to write an invalid topology")
+    parser.add_argument("--compact", action="store_true",
+                        help="write the XML without indentation (smaller, faster; not patchable by --incremental)")
+    parser.add_argument("--export-topology", metavar="PATH",
+                        help="also save the topology as a columnar file (see topology_file.py)")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="write per-stage timings and counters here as JSON (\"-\" prints them)")
+    args = parser.parse_args()
+    if args.output == STDIO:
+        if args.incremental:
+            parser.error("--incremental needs an output file, not stdout")
+        sys.stdout = sys.stderr  # the XML goes to stdout; messages must not
+
+    # Load config
+    with open(args.config) as f:
+        config = json.load(f)
+
+    if args.seed is not None:
+        config["seed"] = args.seed
+
+    if args.incremental:
+        try:
+            delta = update_scenario(config, args.output, args.state, args.delta)
+        except TopologyError as e:
+            print_diagnostics(e.report)
+            raise SystemExit(1)
+        if not delta["rebuilt"]:
+            print(f"Updated {args.output}: +{len(delta['added_nodes'])}/-{len(delta['removed_nodes'])} nodes, "
+                  f"+{len(delta['added_links'])}/-{len(delta['removed_links'])} links")
+    else:
+        cache = ScenarioCache(args.cache, args.cache_size << 20, args.cache_link) if args.cache else None
+        instrumentation = Instrumentation() if args.profile else None
+        try:
+            builder = build_scenario(config, args.output, streaming=args.stream, backend=args.backend,
+                                     state_path=args.state, cache=cache, validate=args.validate,
+                                     instrumentation=instrumentation, compact=args.compact,
+                                     export_path=args.export_topology)
+        except TopologyError as e:
+            print_diagnostics(e.report)
+            raise SystemExit(1)
+        if builder is not None and builder.validation is not None:
+            print_diagnostics(builder.validation)
+        if instrumentation is not None:
+            instrumentation.write(args.profile)
+        if cache is not None:
+            stats = cache.stats()
+            print(f"{'Cache hit' if builder is None else 'Generated'} {args.output} "
+                  f"(cache: {stats['hit']} hits, {stats['miss']} misses, {stats['objects']} scenarios)")
@@ -0,0 +1,192 @@
+from array import array
+from heapq import merge
+
+###
+# Columnar registry of every node a NetworkBuilder creates.
+#
+# Node IDs are handed out contiguously, so each per-node column is an array
+# indexed by (node_id - start_id):
+#   type_codes  interned device type, one byte per node
+#   interfaces  next free interface number, four bytes per node
+# Names are not stored; they are formatted on demand from the per-type
+# prefix ("n", "wlan") and the ID. The IDs of every type are also kept in
+# their own array, so "all routers" is a lookup instead of a scan.
+#
+# Removed nodes keep their ID (IDs are never reused) and get the REMOVED
+# type code; they drop out of every lookup and iteration.
+###
+
+# Device types in registration order; codes are their positions
+TYPE_NAMES = ["SWITCH", "HUB", "WIRELESS_LAN", "PC", "router", "mdr"]
+
+SWITCH, HUB, WIRELESS_LAN, PC, ROUTER, MDR = range(len(TYPE_NAMES))
+
+# Type code of removed nodes; never handed out by intern()
+REMOVED = 255
+
+
+class DeviceRecord:
+    # Read/write view of one node; supports record["type"] like the old dict entries
+    __slots__ = ("registry", "id")
+
+    def __init__(self, registry, node_id):
+        self.registry = registry
+        self.id = node_id
+
+    @property
+    def name(self):
+        return self.registry.name(self.id)
+
+    @property
+    def type(self):
+        return self.registry.type_name(self.id)
+
+    @property
+    def type_code(self):
+        return self.registry.type_code(self.id)
+
+    @property
+    def interfaces(self):
+        return self.registry.interfaces[self.id - self.registry.start_id]
+
+    @interfaces.setter
+    def interfaces(self, value):
+        self.registry.interfaces[self.id - self.registry.start_id] = value
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"DeviceRecord(id={self.id}, name={self.name!r}, type={self.type!r}, interfaces={self.interfaces})"
+
+
+class DeviceRegistry:
+
+    def __init__(self, start_id=1):
+        self.start_id = start_id
+        self.next_id = start_id
+
+        self.type_codes = array("B")
+        self.interfaces = array("I")
+
+        self.type_names = list(TYPE_NAMES)
+        self.codes = {name.lower(): code for code, name in enumerate(self.type_names)}
+        self.prefixes = ["n"] * len(self.type_names)
+        self.ids_by_type = [array("I") for _ in self.type_names]
+        self.removed = 0
+
+    def intern(self, type_name):
+        # Returns the code for a device type, adding unknown types on first use
+        code = self.codes.get(type_name.lower())
+        if code is None:
+            code = len(self.type_names)
+            if code >= REMOVED:
+                raise ValueError("Too many distinct device types")
+            self.type_names.append(type_name)
+            self.codes[type_name.lower()] = code
+            self.prefixes.append("n")
+            self.ids_by_type.append(array("I"))
+        return code
+
+    def add(self, type_name, count, prefix="n"):
+        # Registers `count` nodes of one type and returns their IDs
+        code = self.intern(type_name)
+        self.prefixes[code] = prefix
+
+        ids = range(self.next_id, self.next_id + count)
+        self.type_codes.extend(bytes([code]) * count)
+        self.interfaces.extend(array("I", [0]) * count)
+        self.ids_by_type[code].extend(ids)
+        self.next_id += count
+        return ids
+
+    def remove(self, node_ids):
+        # Marks nodes as removed; returns the IDs that were present
+        removed = [node_id for node_id in dict.fromkeys(node_ids) if node_id in self]
+        by_code = {}
+        for node_id in removed:
+            index = node_id - self.start_id
+            by_code.setdefault(self.type_codes[index], set()).add(node_id)
+            self.type_codes[index] = REMOVED
+
+        for code, ids in by_code.items():
+            self.ids_by_type[code] = array("I", [node_id for node_id in self.ids_by_type[code] if node_id not in ids])
+        self.removed += len(removed)
+        return removed
+
+    def snapshot(self):
+        # Plain-data copy of the registry (see builder_state.py)
+        return {
+            "start_id": self.start_id,
+            "type_names": self.type_names,
+            "prefixes": self.prefixes,
+            "type_codes": self.type_codes.tobytes(),
+            "interfaces": self.interfaces.tolist()
+        }
+
+    @classmethod
+    def restore(cls, snapshot):
+        registry = cls(snapshot["start_id"])
+        registry.type_names = list(snapshot["type_names"])
+        registry.codes = {name.lower(): code for code, name in enumerate(registry.type_names)}
+        registry.prefixes = list(snapshot["prefixes"])
+        registry.type_codes = array("B", snapshot["type_codes"])
+        registry.interfaces = array("I", snapshot["interfaces"])
+        registry.next_id = registry.start_id + len(registry.type_codes)
+
+        registry.ids_by_type = [array("I") for _ in registry.type_names]
+        for node_id, code in enumerate(registry.type_codes, registry.start_id):
+            if code == REMOVED:
+                registry.removed += 1
+            else:
+                registry.ids_by_type[code].append(node_id)
+        return registry
+
+    def type_code(self, node_id):
+        return self.type_codes[node_id - self.start_id]
+
+    def type_name(self, node_id):
+        return self.type_names[self.type_codes[node_id - self.start_id]]
+
+    def name(self, node_id):
+        return f"{self.prefixes[self.type_codes[node_id - self.start_id]]}{node_id}"
+
+    def take_interface(self, node_id):
+        # Returns the next interface number of a node and advances its counter
+        index = node_id - self.start_id
+        iface_id = self.interfaces[index]
+        self.interfaces[index] = iface_id + 1
+        return iface_id
+
+    def ids_of(self, *type_names):
+        # IDs of the given types in ID order, e.g. ids_of("SWITCH", "HUB")
+        arrays = [self.ids_by_type[self.codes[name.lower()]] for name in type_names if name.lower() in self.codes]
+        if not arrays:
+            return []
+        if len(arrays) == 1:
+            return list(arrays[0])
+        return list(merge(*arrays))
+
+    def count_of(self, type_name):
+        code = self.codes.get(type_name.lower())
+        return 0 if code is None else len(self.ids_by_type[code])
+
+    def __len__(self):
+        return len(self.type_codes) - self.removed
+
+    def __contains__(self, node_id):
+        return self.start_id <= node_id < self.next_id and self.type_codes[node_id - self.start_id] != REMOVED
+
+    def __iter__(self):
+        if not self.removed:
+            return iter(range(self.start_id, self.next_id))
+        return (node_id for node_id, code in enumerate(self.type_codes, self.start_id) if code != REMOVED)
+
+    def __getitem__(self, node_id):
+        if node_id not in self:
+            raise KeyError(node_id)
+        return DeviceRecord(self, node_id)
+
+    def items(self):
+        for node_id in self:
+            yield node_id, DeviceRecord(self, node_id)
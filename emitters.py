@@ -0,0 +1,231 @@
+import re
+import xml.etree.ElementTree as ET
+
+###
+# Serialization backends for the per-node and per-link records that
+# NetworkBuilder writes (<network>, <device>, <link> and configservice
+# <service> entries).
+#
+#   ElementEmitter   builds ElementTree elements; works with an in-memory
+#                    <scenario> Element or a ScenarioWriter (default)
+#   TemplateEmitter  formats each record straight from string templates
+#                    compiled for its indentation depth (or none at all,
+#                    space=None) and splices the text into a ScenarioWriter
+#                    section. No Element objects are created; only fields
+#                    that can come from the config (names, types, services)
+#                    are escaped.
+#
+# Both produce the same bytes once written. An iface is a tuple of
+# (id, name) or (id, name, ip4, ip4_mask, ip6, ip6_mask) strings.
+###
+
+# Every link has the same <options>
+LINK_OPTIONS = {
+    "delay": "0",
+    "bandwidth": "0",
+    "loss": "0.0",
+    "dup": "0",
+    "jitter": "0",
+    "unidirectional": "0",
+    "buffer": "0"
+}
+
+IFACE_ATTRIBUTES = ("id", "name", "ip4", "ip4_mask", "ip6", "ip6_mask")
+
+# Same replacements as ElementTree's attribute escaping
+_ATTRIB_ESCAPES = str.maketrans({
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    "\"": "&quot;",
+    "\r": "&#13;",
+    "\n": "&#10;",
+    "\t": "&#09;"
+})
+
+
+needs_escape = re.compile('[&<>"\r\n\t]').search
+
+
+def escape_attrib(text):
+    # Most values (IDs, addresses, numbers) need no escaping; the search
+    # is several times cheaper than translate() on those
+    return text.translate(_ATTRIB_ESCAPES) if needs_escape(text) else text
+
+
+class ElementEmitter:
+
+    def sink(self, section):
+        # Returns the function that adds one record to `section`
+        return section.append
+
+    def network(self, node_id, name, net_type, x, y, lat, lon):
+        network = ET.Element("network", {
+            "id": str(node_id),
+            "name": name,
+            "icon": "",
+            "canvas": "1",
+            "type": net_type
+        })
+        ET.SubElement(network, "position", {
+            "x": x,
+            "y": y,
+            "lat": lat,
+            "lon": lon,
+            "alt": "2.0"
+        })
+        return network
+
+    def device(self, node_id, name, device_type, services, x, y, lat, lon):
+        device = ET.Element("device", {
+            "id": str(node_id),
+            "name": name,
+            "icon": "",
+            "canvas": "1",
+            "type": device_type,
+            "class": "",
+            "image": ""
+        })
+
+        # Add position info
+        ET.SubElement(device, "position", {
+            "x": x,
+            "y": y,
+            "lat": lat,
+            "lon": lon,
+            "alt": "2.0"
+        })
+
+        # Add config services like routing protocols
+        configservices = ET.SubElement(device, "configservices")
+        for svc in services:
+            ET.SubElement(configservices, "service", {"name": svc})
+        return device
+
+    def link(self, node1, node2, iface1=None, iface2=None, options=True):
+        link = ET.Element("link", {
+            "node1": str(node1),
+            "node2": str(node2)
+        })
+        if iface1 is not None:
+            ET.SubElement(link, "iface1", dict(zip(IFACE_ATTRIBUTES, iface1)))
+        if iface2 is not None:
+            ET.SubElement(link, "iface2", dict(zip(IFACE_ATTRIBUTES, iface2)))
+        if options:
+            ET.SubElement(link, "options", LINK_OPTIONS)
+        return link
+
+    def service(self, name, node_id):
+        return ET.Element("service", {
+            "name": name,
+            "node": str(node_id)
+        })
+
+
+class TemplateEmitter:
+
+    def __init__(self, space="  ", level=2):
+        # level is the depth of the records: 2 for children of <networks>,
+        # <devices>, <links> and <configservice_configurations>. space=None
+        # writes compact records without any whitespace between tags
+        self.space = space
+        self.level = level
+
+        outer = "" if space is None else "\n" + space * level
+        inner = "" if space is None else outer + space
+        self._deeper = "" if space is None else inner + space
+
+        self._network = (
+            outer + '<network id="{}" name="{}" icon="" canvas="1" type="{}">'
+            + inner + '<position x="{}" y="{}" lat="{}" lon="{}" alt="2.0" />'
+            + outer + "</network>"
+        ).format
+
+        self._device_head = (
+            outer + '<device id="{}" name="{}" icon="" canvas="1" type="{}" class="" image="">'
+            + inner + '<position x="{}" y="{}" lat="{}" lon="{}" alt="2.0" />'
+        ).format
+        self._device_tail = outer + "</device>"
+        self._inner = inner
+
+        options = " ".join(f'{name}="{value}"' for name, value in LINK_OPTIONS.items())
+        self._link_head = (outer + '<link node1="{}" node2="{}">').format
+        self._link_tail = outer + "</link>"
+        self._options = inner + f"<options {options} />"
+        self._iface_full = (inner + '<{} id="{}" name="{}" ip4="{}" ip4_mask="{}" ip6="{}" ip6_mask="{}" />').format
+        self._iface_short = (inner + '<{} id="{}" name="{}" />').format
+        self._empty_link = (outer + '<link node1="{}" node2="{}" />').format
+
+        self._service = (outer + '<service name="{}" node="{}" />').format
+
+        # Escaped type names and rendered <configservices> blocks, per type / service list
+        self._escaped = {}
+        self._configservices = {}
+
+    def sink(self, section):
+        if not hasattr(section, "splice"):
+            raise TypeError("TemplateEmitter writes text and needs a ScenarioWriter section")
+        return section.splice
+
+    def _escape(self, text):
+        escaped = self._escaped.get(text)
+        if escaped is None:
+            escaped = self._escaped[text] = escape_attrib(text)
+        return escaped
+
+    def network(self, node_id, name, net_type, x, y, lat, lon):
+        return self._network(node_id, escape_attrib(name), self._escape(net_type), x, y, lat, lon)
+
+    def device(self, node_id, name, device_type, services, x, y, lat, lon):
+        key = tuple(services)
+        block = self._configservices.get(key)
+        if block is None:
+            deeper = self._deeper
+            if services:
+                block = (
+                    self._inner + "<configservices>"
+                    + "".join(f'{deeper}<service name="{escape_attrib(svc)}" />' for svc in services)
+                    + self._inner + "</configservices>"
+                )
+            else:
+                block = self._inner + "<configservices />"
+            self._configservices[key] = block
+
+        head = self._device_head(node_id, escape_attrib(name), self._escape(device_type), x, y, lat, lon)
+        return head + block + self._device_tail
+
+    def _iface(self, tag, iface):
+        if len(iface) == 2:
+            return self._iface_short(tag, *iface)
+        return self._iface_full(tag, *iface)
+
+    def link(self, node1, node2, iface1=None, iface2=None, options=True):
+        if iface1 is None and iface2 is None and not options:
+            return self._empty_link(node1, node2)
+
+        parts = [self._link_head(node1, node2)]
+        if iface1 is not None:
+            parts.append(self._iface("iface1", iface1))
+        if iface2 is not None:
+            parts.append(self._iface("iface2", iface2))
+        if options:
+            parts.append(self._options)
+        parts.append(self._link_tail)
+        return "".join(parts)
+
+    def service(self, name, node_id):
+        return self._service(self._escape(name), node_id)
+
+
+EMITTERS = {
+    "etree": ElementEmitter,
+    "template": TemplateEmitter
+}
+
+
+def make_emitter(backend="etree", space="  "):
+    if backend not in EMITTERS:
+        raise ValueError(f"Unknown backend {backend!r}; choose from {', '.join(EMITTERS)}")
+    if backend == "template":
+        return TemplateEmitter(space)
+    return ElementEmitter()
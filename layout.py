@@ -0,0 +1,228 @@
+import math
+
+###
+# Canvas layout for NetworkBuilder.
+#
+# Nodes sit on a grid of slots X_STEP x Y_STEP apart. The grid grows with the
+# node count instead of wrapping around, so no two nodes ever share a slot
+# and the canvas written to <session_metadata> grows with it.
+#
+# Without a plan, node IDs fill the grid in the usual snake pattern. Once
+# plan() is given the router clusters, each cluster (router, then its
+# switches/hubs, then their PCs) is packed into its own square block of
+# slots and filled in a spiral from the router outwards, so attached nodes
+# land next to each other. Packing is a single pass over the clusters.
+#
+# x / y / lat / lon strings are formatted once per column and per row and
+# shared by every node in it.
+###
+
+LAT_START = 47.57889
+LAT_STEP = 0.00135
+
+LON_START = -122.13188
+LON_STEP = 0.00265
+
+# Canvas height / width in slots that keeps the default 1000 x 750 canvas shape
+ROWS_PER_COLUMN = (750 / 1000) * (160 / 140)
+
+MIN_CANVAS_WIDTH = 1000
+MIN_CANVAS_HEIGHT = 750
+
+
+class LayoutBatch:
+    # Parallel lists of attribute-ready strings, one entry per node ID
+    __slots__ = ("ids", "x", "y", "lat", "lon")
+
+    def __init__(self, ids, x, y, lat, lon):
+        self.ids = ids
+        self.x = x
+        self.y = y
+        self.lat = lat
+        self.lon = lon
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _spiral_cells(side, count):
+    # First `count` cells of a side x side block, in rings around its centre
+    center = (side - 1) // 2
+    cells = [(center, center)]
+    radius = 1
+    while len(cells) < count:
+        low, high = center - radius, center + radius
+        ring = (
+            [(col, low) for col in range(low, high + 1)] +
+            [(high, row) for row in range(low + 1, high + 1)] +
+            [(col, high) for col in range(high - 1, low - 1, -1)] +
+            [(low, row) for row in range(high - 1, low, -1)]
+        )
+        cells.extend((col, row) for col, row in ring if 0 <= col < side and 0 <= row < side)
+        radius += 1
+    return cells[:count]
+
+
+class CanvasLayout:
+
+    def __init__(self, min_x, min_y, x_step, y_step, min_columns, min_rows):
+        self.min_x = min_x
+        self.min_y = min_y
+        self.x_step = x_step
+        self.y_step = y_step
+        self.min_columns = min_columns
+        self.min_rows = min_rows
+
+        self.columns = min_columns
+        self.rows = min_rows
+
+        # node_id -> (col, row) once plan() has run
+        self.planned = {}
+        self.next_free = None   # first slot after the planned blocks
+
+        # Per-column / per-row attribute strings, grown on demand
+        self._x = []
+        self._lon = []
+        self._y = []
+        self._lat = []
+
+    def fit(self, node_count):
+        # Widens the default snake grid so node_count IDs fit without wrapping
+        if self.next_free is not None:
+            return  # a planned layout already has its final width
+        columns = math.ceil(math.sqrt(node_count / ROWS_PER_COLUMN))
+        self.columns = max(self.min_columns, columns, self.columns)
+        self.rows = max(self.rows, math.ceil(node_count / self.columns))
+
+    def plan(self, clusters):
+        # clusters: lists of node IDs, each ordered router first, then its
+        # switches/hubs and PCs. Every cluster gets its own square block.
+        sides = [math.ceil(math.sqrt(len(cluster))) for cluster in clusters]
+        area = sum(side * side for side in sides)
+        width = max([self.min_columns, math.ceil(math.sqrt(area / ROWS_PER_COLUMN))] + sides)
+
+        planned = {}
+        block_col = block_row = shelf_height = 0
+        for cluster, side in zip(clusters, sides):
+            if block_col + side > width:
+                block_row += shelf_height
+                block_col = shelf_height = 0
+
+            for node_id, (col, row) in zip(cluster, _spiral_cells(side, len(cluster))):
+                planned[node_id] = (block_col + col, block_row + row)
+
+            block_col += side
+            shelf_height = max(shelf_height, side)
+
+        self.planned = planned
+        self.columns = width
+        self.rows = max(self.min_rows, block_row + shelf_height)
+        self.next_free = self.rows * width
+
+    def snapshot(self):
+        # Grid size and the next overflow slot. Planned cells are not kept:
+        # their nodes are already written, and nodes added later go below them.
+        return {"columns": self.columns, "rows": self.rows, "next_free": self.next_free}
+
+    def restore(self, snapshot):
+        self.columns = snapshot["columns"]
+        self.rows = snapshot["rows"]
+        self.next_free = snapshot["next_free"]
+        self.planned = {}
+
+    def cell(self, idx):
+        if idx in self.planned:
+            return self.planned[idx]
+
+        if self.next_free is not None:
+            # Nodes added after planning go below the planned blocks
+            slot = self.next_free
+            self.next_free += 1
+            row, col = divmod(slot, self.columns)
+            self.planned[idx] = (col, row)
+            self.rows = max(self.rows, row + 1)
+            return col, row
+
+        row, col = divmod(idx, self.columns)
+        if row % 2 == 1:
+            col = self.columns - 1 - col  # snake pattern
+        self.rows = max(self.rows, row + 1)
+        return col, row
+
+    def _grow(self, col, row):
+        while len(self._x) <= col:
+            c = len(self._x)
+            self._x.append(str(float(self.min_x + c * self.x_step)))
+            self._lon.append(f"{LON_START + (c * LON_STEP):.12f}")
+        while len(self._y) <= row:
+            r = len(self._y)
+            self._y.append(str(float(self.min_y + r * self.y_step)))
+            self._lat.append(f"{LAT_START - (r * LAT_STEP):.12f}")
+
+    def plan_regions(self, regions, gap=1):
+        # regions: one list of clusters (as for plan()) per region. Every
+        # region is planned on its own and gets its own rectangle of the
+        # canvas, `gap` empty slots away from the others; rectangles are
+        # packed in shelves like the cluster blocks. Returns each region's
+        # (column, row, columns, rows) rectangle.
+        areas = []
+        for clusters in regions:
+            area = CanvasLayout(self.min_x, self.min_y, self.x_step, self.y_step, 1, 1)
+            area.plan(clusters)
+            areas.append(area)
+
+        total = sum((area.columns + gap) * (area.rows + gap) for area in areas)
+        width = max([self.min_columns, math.ceil(math.sqrt(total / ROWS_PER_COLUMN))] + [area.columns for area in areas])
+
+        planned = {}
+        rectangles = []
+        area_col = area_row = shelf_height = 0
+        for area in areas:
+            if area_col and area_col + area.columns > width:
+                area_row += shelf_height + gap
+                area_col = shelf_height = 0
+
+            for node_id, (col, row) in area.planned.items():
+                planned[node_id] = (area_col + col, area_row + row)
+            rectangles.append((area_col, area_row, area.columns, area.rows))
+
+            area_col += area.columns + gap
+            shelf_height = max(shelf_height, area.rows)
+
+        self.planned = planned
+        self.columns = width
+        self.rows = max(self.min_rows, area_row + shelf_height)
+        self.next_free = self.rows * width
+        return rectangles
+
+    def position(self, idx):
+        col, row = self.cell(idx)
+        return float(self.min_x + col * self.x_step), float(self.min_y + row * self.y_step)
+
+    def lat_lon(self, idx):
+        col, row = self.cell(idx)
+        self._grow(col, row)
+        return self._lat[row], self._lon[col]
+
+    def batch(self, ids):
+        # Lays out every ID in one pass and returns a LayoutBatch
+        ids = list(ids)
+        cells = [self.cell(idx) for idx in ids]
+        if cells:
+            self._grow(max(col for col, _ in cells), max(row for _, row in cells))
+
+        x, y, lat, lon = self._x, self._y, self._lat, self._lon
+        return LayoutBatch(
+            ids,
+            [x[col] for col, _ in cells],
+            [y[row] for _, row in cells],
+            [lat[row] for _, row in cells],
+            [lon[col] for col, _ in cells]
+        )
+
+    def dimensions(self):
+        # Canvas size in pixels, never smaller than CORE's default 1000 x 750
+        return [
+            max(MIN_CANVAS_WIDTH, 2 * self.min_x + self.columns * self.x_step),
+            max(MIN_CANVAS_HEIGHT, 2 * self.min_y + self.rows * self.y_step)
+        ]
@@ -0,0 +1,42 @@
+###
+# Hashed, insertion-ordered store of undirected links.
+#
+# Replaces the "link not in seen_links" list scans in the link generators:
+# membership and insertion are O(1), the emitted order is preserved in
+# `links`, and the degree of every node is kept up to date as links are added.
+###
+
+
+class LinkIndex:
+
+    def __init__(self):
+        self.links = []      # (low_id, high_id) tuples in the order they were added
+        self.seen = set()
+        self.degree = {}
+
+    @staticmethod
+    def key(node1, node2):
+        return (node1, node2) if node1 < node2 else (node2, node1)
+
+    def add(self, node1, node2):
+        # Returns True if the link is new, False if it was already present
+        link = (node1, node2) if node1 < node2 else (node2, node1)
+        if link in self.seen:
+            return False
+        self.seen.add(link)
+        self.links.append(link)
+        self.degree[node1] = self.degree.get(node1, 0) + 1
+        self.degree[node2] = self.degree.get(node2, 0) + 1
+        return True
+
+    def degree_of(self, node_id):
+        return self.degree.get(node_id, 0)
+
+    def __contains__(self, pair):
+        return self.key(*pair) in self.seen
+
+    def __len__(self):
+        return len(self.links)
+
+    def __iter__(self):
+        return iter(self.links)
@@ -0,0 +1,73 @@
+from array import array
+
+###
+# Columnar record of every link a NetworkBuilder has written.
+#
+# One row per <link>, in document order, of ROW_SIZE unsigned ints:
+#
+#   kind      DIRECT_LINK, LAN_LINK, WIRELESS_LINK or BRIDGE_LINK (WLAN to
+#             switch / hub); REMOVED_LINK once the link is removed
+#   node1     IDs as written: node1 is the router / switch / hub / WLAN end
+#   node2
+#   iface1    interface IDs; NO_IFACE where the link has no such interface
+#   iface2
+#   subnet    subnet index (see SubnetAllocator)
+#   host      host number of iface2's address; iface1 of a direct link is
+#             always host 1
+#
+# Everything a <link> holds follows from its row and the builder's
+# addressing (NetworkBuilder.format_link), so the XML can be written again
+# without rerunning the link generators. Rows live in one flat array, so
+# recording a link is a single extend(); columns() cuts it into one array
+# per field for topology files (see topology_file.py).
+###
+
+DIRECT_LINK, LAN_LINK, WIRELESS_LINK, BRIDGE_LINK = range(4)
+REMOVED_LINK = 255
+
+NO_IFACE = 0xFFFFFFFF
+
+FIELDS = ["kind", "node1", "node2", "iface1", "iface2", "subnet", "host"]
+ROW_SIZE = len(FIELDS)
+
+
+class LinkTable:
+
+    def __init__(self):
+        self.rows = array("I")
+
+    def append(self, row):
+        self.rows.extend(row)
+
+    def remove(self, pairs):
+        # Marks the links between the given (low, high) pairs as removed
+        pairs = set(pairs)
+        rows = self.rows
+        for start in range(0, len(rows), ROW_SIZE):
+            node1, node2 = rows[start + 1], rows[start + 2]
+            if ((node1, node2) if node1 < node2 else (node2, node1)) in pairs:
+                rows[start] = REMOVED_LINK
+
+    def columns(self):
+        # One array per field, in FIELDS order
+        return {name: self.rows[i::ROW_SIZE] for i, name in enumerate(FIELDS)}
+
+    @classmethod
+    def from_columns(cls, columns):
+        # Inverse of columns(); the columns may be arrays or memoryviews
+        table = cls()
+        count = len(columns["kind"])
+        rows = table.rows = array("I", bytes(4 * ROW_SIZE * count))
+        for i, name in enumerate(FIELDS):
+            rows[i::ROW_SIZE] = array("I", columns[name])
+        return table
+
+    def __iter__(self):
+        # Rows of the links that are still there, as tuples
+        rows = self.rows
+        for row in zip(*(rows[i::ROW_SIZE] for i in range(ROW_SIZE))):
+            if row[0] != REMOVED_LINK:
+                yield row
+
+    def __len__(self):
+        return len(self.rows) // ROW_SIZE
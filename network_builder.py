@@ -1,16 +1,58 @@
 
 import xml.etree.ElementTree as ET
 import random
-import sys
+from itertools import compress
+from scenario_writer import open_section, close_section
+from link_index import LinkIndex
+from link_table import LinkTable, DIRECT_LINK, LAN_LINK, WIRELESS_LINK, BRIDGE_LINK, NO_IFACE
+from attachment import CapacityPool, attach
+from subnet_allocator import SubnetAllocator
+from layout import CanvasLayout
+from device_registry import DeviceRegistry, REMOVED, SWITCH, HUB, WIRELESS_LAN, PC, ROUTER, MDR
+from emitters import ElementEmitter
+from instrumentation import NO_INSTRUMENTATION
+from topologies import TOPOLOGIES
+from validation import TopologyError, check_device_counts, make_report, orphaned_lan, validate_topology
+
+# Config services for each device type added by add_user_devices
+DEVICE_SERVICES = {
+    "PC": ["DefaultRoute"],
+    "router": ["OSPFv3", "OSPFv2", "IPForward", "zebra"],
+    "mdr":["zebra", "IPForward", "OSPFv3MDR"]
+}
+
+# Type-code groups used when classifying links
+ROUTER_TYPES = {ROUTER, MDR}
+DIRECT_TYPES = {ROUTER, PC, MDR}
+LAN_TYPES = {SWITCH, HUB}
+
+# b"0"/b"1" -> 0/1, to turn a bit string into compress() selectors
+_BIT_VALUES = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def _ignore(row):
+    pass
+
+
+def _unknown_node(registry, node1, node2):
+    missing = [node_id for node_id in (node1, node2) if node_id not in registry]
+    raise ValueError(f"Link ({node1}, {node2}) names node {missing[0]}, which does not exist")
+
 
 class NetworkBuilder:
 
-    def __init__(self, start_id=1, ip4_base="10.0.0.0", ip6_base="2001::"):
+    def __init__(self, start_id=1, ip4_base="10.0.0.0", ip6_base="2001::", ip4_prefix=24, ip6_prefix=64, emitter=None,
+                 instrumentation=None):
         #Begin counting devices from this value
         self.current_id = start_id
         self.ip4_base = ip4_base
         self.ip6_base = ip6_base
 
+        # Hands out one IPv4 + IPv6 subnet per link / LAN. Block 0 is the
+        # base network itself, so link subnets start right after it.
+        self.subnets = SubnetAllocator(ip4_base, ip6_base, ip4_prefix, ip6_prefix)
+        self.subnets.reserve(0)
+
         # Prefix used for naming different types of networks 
         self.network_prefixes = {
             "SWITCH": "n",
@@ -25,15 +67,51 @@ class NetworkBuilder:
 
         self.X_STEP = 160 
         self.Y_STEP = 140  
+
+        # Slot grid that grows with the node count; the default bounds give
+        # the minimum number of columns and rows
+        self.layout = CanvasLayout(
+            self.MIN_X, self.MIN_Y, self.X_STEP, self.Y_STEP,
+            (self.MAX_X - self.MIN_X) // self.X_STEP,
+            (self.MAX_Y - self.MIN_Y) // self.Y_STEP
+        )
  
         # Tracks all devices created with their properties
-        self.device_registry = {}
-
-    def generate_network_tag(self, name, net_type, x, y, lat, lon):
+        self.device_registry = DeviceRegistry(start_id)
+
+        # Blocks of IDs assigned by register_devices that have not been written yet
+        self._pending_blocks = {}
+
+        # Serialization backend for networks, devices, links and services
+        # (see emitters.py); ElementTree unless a TemplateEmitter is given
+        self.emitter = emitter or ElementEmitter()
+
+        # Stage timing and counters (see instrumentation.py); off unless an
+        # Instrumentation is given
+        self.instrumentation = instrumentation or NO_INSTRUMENTATION
+
+        # Link state kept by generate_links, so later calls (and incremental
+        # updates, see remove_devices) only add what is new:
+        #   adjacency  node ID -> IDs connected to it
+        #   links      (low, high) pair of every emitted link -> its subnet index
+        #   lans       switch/hub ID -> [LAN subnet index, next free host]
+        #   link_table every emitted link as a row of numbers (see
+        #              link_table.py), for topology files; None for builders
+        #              restored from a state file, which does not keep it
+        self.adjacency = {}
+        self.links = {}
+        self.lans = {}
+        self.link_table = LinkTable()
+
+        # Report of the last validate() call (see validation.py); without
+        # one, generate_links still records the LANs it had to drop here
+        self.validation = None
+
+    def generate_network_tag(self, name, net_type, x, y, lat, lon, node_id=None):
 
         # Creates a <network> XML element with a <position> subelement
         network = ET.Element("network", {
-            "id": str(self.current_id),
+            "id": str(self.current_id if node_id is None else node_id),
             "name": name,
             "icon": "",
             "canvas": "1",
@@ -48,529 +126,649 @@ class NetworkBuilder:
         })
         return network
 
-    def add_user_networks(self, networks_element, device_counts):
+    def _check_topology(self, device_counts):
+        diagnostics = check_device_counts(device_counts)
+        if diagnostics:
+            raise TopologyError(make_report(diagnostics))
+
+    def validate(self, connections, max_interfaces=None):
+        # Checks connections against the registered nodes and the address
+        # space before generate_links uses them (see validation.py); the
+        # report is also kept in self.validation
+        started = self.instrumentation.start()
+        self.validation = validate_topology(self.device_registry, connections, self.subnets,
+                                            max_interfaces, self.lans)
+        self.instrumentation.stop("validate", started)
+        return self.validation
+
+    def _register_block(self, device_type, count, prefix):
+        # Assigns the next `count` IDs to one device type and saves them to the registry
+        ids = self.device_registry.add(device_type, count, prefix)
+        self.current_id = self.device_registry.next_id
+        return ids
+
+    def _take_block(self, device_type, count, prefix):
+        # IDs reserved earlier by register_devices, otherwise fresh ones
+        ids = self._pending_blocks.pop(device_type, None)
+        if ids is None:
+            ids = self._register_block(device_type, count, prefix)
+        return ids
+
+    def register_devices(self, device_counts, validate=True):
+        # Assigns IDs to every network and device up front (in the same order
+        # add_user_networks and add_user_devices would) so links and the
+        # layout can be planned before any XML is written. Incremental
+        # updates validate the full config themselves and pass only the
+        # added counts with validate=False.
+        if validate:
+            self._check_topology(device_counts)
+
+        started = self.instrumentation.start()
+        for net_type, prefix in self.network_prefixes.items():
+            self._pending_blocks[net_type] = self._register_block(net_type, device_counts.get(net_type, 0), prefix)
+        for device_type in DEVICE_SERVICES:
+            self._pending_blocks[device_type] = self._register_block(device_type, device_counts.get(device_type, 0), "n")
+
+        self.layout.fit(self.current_id)
+        self.instrumentation.stop("register_devices", started)
+
+    def plan_layout(self, connections):
+        # Clusters every router / mdr with the switches, hubs and WLANs
+        # attached to it, followed by their PCs, and gives each cluster its
+        # own block of the canvas. Linear in nodes + connections.
+        started = self.instrumentation.start()
+        self.layout.plan(self.clusters(connections))
+        self.instrumentation.stop("plan_layout", started)
+
+    def clusters(self, connections):
+        # The clusters plan_layout lays out: lists of node IDs, router first,
+        # then its switches / hubs / WLANs and their PCs; nodes attached to
+        # nothing come last
+        adjacency = {}
+        for node1, node2 in connections:
+            adjacency.setdefault(node1, []).append(node2)
+            adjacency.setdefault(node2, []).append(node1)
 
-        switches = device_counts.get("SWITCH", 0)
-        routers = device_counts.get("router", 0)
+        roots = {}       # cluster root -> its second-tier nodes
+        owner = {}       # second-tier node -> cluster root
+        leaves = {}      # root or second-tier node -> PCs hanging off it
 
-        if switches > routers:
-            # raise ValueError("Invalid topology: number of switches exceeds number of routers.")
-            print("Invalid topology: number of switches exceeds number of routers.")
-            sys.exit()
+        for node_id in self.device_registry.ids_of("router", "mdr"):
+            roots[node_id] = []
+        routers = set(roots)
 
-        # Adds network nodes like switches, routers, etc to the scenario
-        for net_type in self.network_prefixes:
-            count = device_counts.get(net_type, 0)
-            prefix = self.network_prefixes[net_type]
-            
+        for node_id in self.device_registry.ids_of("SWITCH", "HUB", "WIRELESS_LAN"):
+            root = next((n for n in adjacency.get(node_id, ()) if n in routers), None)
+            if root is None:
+                roots[node_id] = []    # switch without a router heads its own cluster
+            else:
+                roots[root].append(node_id)
+                owner[node_id] = root
 
-            for _ in range(count):
-                name = f"{prefix}{self.current_id}"
+        placed = set(roots) | set(owner)
+        unattached = []
+        for node_id in self.device_registry:
+            if node_id in placed:
+                continue
+            neighbors = adjacency.get(node_id, ())
+            parent = next((n for n in neighbors if n in owner), None)
+            if parent is None:
+                parent = next((n for n in neighbors if n in roots), None)
+            if parent is None:
+                unattached.append(node_id)
+            else:
+                leaves.setdefault(parent, []).append(node_id)
+
+        clusters = []
+        for root, second_tier in roots.items():
+            cluster = [root]
+            for node_id in second_tier:
+                cluster.append(node_id)
+                cluster.extend(leaves.get(node_id, ()))
+            cluster.extend(leaves.get(root, ()))
+            clusters.append(cluster)
+        if unattached:
+            clusters.append(unattached)
+        return clusters
+
+    def canvas_dimensions(self):
+        return self.layout.dimensions()
 
-                x, y = self._get_bounded_position(self.current_id)
-                
-                lat, lon = self.get_lat_lon(self.current_id)
+    def add_user_networks(self, networks_element, device_counts):
+        started = self.instrumentation.start()
 
-                # Create and append <network> element
-                tag = self.generate_network_tag(name, net_type, x, y, lat, lon)
-                networks_element.append(tag)
+        if not self._pending_blocks:
+            # register_devices validated the counts already otherwise
+            self._check_topology(device_counts)
+            self.layout.fit(self.current_id + sum(device_counts.values()))
 
-                # Save info to the registry
-                self.device_registry[self.current_id] = {
-                    "name": name,
-                    "type": net_type,
-                    "interfaces": 0
-                }
-                self.current_id += 1
+        # Adds network nodes like switches, routers, etc to the scenario
+        for net_type in self.network_prefixes:
+            count = device_counts.get(net_type, 0)
+            prefix = self.network_prefixes[net_type]
+            self.add_networks(networks_element, self._take_block(net_type, count, prefix))
+        self.instrumentation.stop("add_user_networks", started)
 
     def add_user_devices(self, devices_element, device_counts):
 
         # Adds PC and router devices, and assigns services to them
-        device_types = {
-            "PC": ["DefaultRoute"],
-            "router": ["OSPFv3", "OSPFv2", "IPForward", "zebra"],
-            "mdr":["zebra", "IPForward", "OSPFv3MDR"]
-        }
-
-        for device_type, services in device_types.items():
+        started = self.instrumentation.start()
+        for device_type in DEVICE_SERVICES:
             count = device_counts.get(device_type, 0)
-
-            for _ in range(count):
-                name = f"n{self.current_id}"
-
-                device = ET.Element("device", {
-                    "id": str(self.current_id),
-                    "name": name,
-                    "icon": "",
-                    "canvas": "1",
-                    "type": device_type,
-                    "class": "",
-                    "image": ""
-                })
-
-                x, y = self._get_bounded_position(self.current_id)
-                lat, lon = self.get_lat_lon(self.current_id)
-
-                # Add position info
-                ET.SubElement(device, "position", {
-                    "x": str(x),
-                    "y": str(y),
-                    "lat": str(lat),
-                    "lon": str(lon),
-                    "alt": "2.0"
-                })
-
-                # Add config services like routing protocols
-                configservices = ET.SubElement(device, "configservices")
-                for svc in services:
-                    ET.SubElement(configservices, "service", {"name": svc})
-
-                devices_element.append(device)
-
-                # Save info to the registry
-                self.device_registry[self.current_id] = {
-                    "name": name,
-                    "type": device_type,
-                    "interfaces": 0
-                }
-
-                self.current_id += 1
+            self.add_devices(devices_element, self._take_block(device_type, count, "n"))
+        self.instrumentation.stop("add_user_devices", started)
+
+    def add_networks(self, networks_element, node_ids):
+        # <network> records for registered IDs of any network type
+        registry = self.device_registry
+        # Positions for the whole block of IDs in one pass
+        layout = self.layout.batch(node_ids)
+        emit = self.emitter.sink(networks_element)
+
+        for i, node_id in enumerate(layout.ids):
+            name = registry.name(node_id)
+
+            # Create and append <network> element
+            emit(self.emitter.network(node_id, name, registry.type_name(node_id),
+                                      layout.x[i], layout.y[i], layout.lat[i], layout.lon[i]))
+        self.instrumentation.count("networks", len(layout.ids))
+
+    def add_devices(self, devices_element, node_ids):
+        # <device> records for registered IDs of any device type
+        registry = self.device_registry
+        services_by_code = self._services_by_code()
+        layout = self.layout.batch(node_ids)
+        emit = self.emitter.sink(devices_element)
+
+        for i, node_id in enumerate(layout.ids):
+            name = registry.name(node_id)
+            code = registry.type_code(node_id)
+
+            # <device> with its position and config services like routing protocols
+            emit(self.emitter.device(node_id, name, registry.type_names[code], services_by_code[code] or (),
+                                     layout.x[i], layout.y[i], layout.lat[i], layout.lon[i]))
+        self.instrumentation.count("devices", len(layout.ids))
 # ///////////
-    def _get_subnet_prefix(self, subnet_counter):
-        ip4_parts = self.ip4_base.split(".")
-        ip4_prefix = f"{ip4_parts[0]}.{ip4_parts[1]}.{int(ip4_parts[2]) + subnet_counter}."
-
-        ip6_prefix = f"{self.ip6_base.rstrip(':')}:{subnet_counter}"
-        return ip4_prefix, ip6_prefix
-
     def generate_links(self, links_element, connections):
-        subnet_counter = 1
-        adjacency = {}
-        deferred_lans = []  # To retry lans later
-
+        # Classifies every connection once by type code: wireless and direct
+        # links are emitted straight away, switch/hub LANs are then resolved
+        # from the adjacency index built in the same pass. Connections from
+        # earlier calls are kept, so a LAN that already exists only gets
+        # links for its new neighbors, on its next free host addresses.
+        registry = self.device_registry
+        type_codes = registry.type_codes
+        start_id = registry.start_id
+        node_count = len(type_codes)
+
+        adjacency = {}     # this call's connections only
+        linked = self.links
+        emit = self.emitter.sink(links_element)
+        format_link = self.format_link
+        record = self.link_table.append if self.link_table is not None else _ignore
+
+        instrumentation = self.instrumentation
+        started = instrumentation.start()
+        links_before = len(linked)
+        subnets_before = self.subnets.allocated
+
+        # First pass: adjacency + wireless and direct links
         for node1, node2 in connections:
+            index1 = node1 - start_id
+            index2 = node2 - start_id
+            if not (0 <= index1 < node_count and 0 <= index2 < node_count):
+                _unknown_node(registry, node1, node2)
+            type1 = type_codes[index1]
+            type2 = type_codes[index2]
+            if type1 == REMOVED or type2 == REMOVED:
+                _unknown_node(registry, node1, node2)
+
             adjacency.setdefault(node1, []).append(node2)
             adjacency.setdefault(node2, []).append(node1)
 
-        self.adjacency = adjacency
-        linked_pairs = set()
+            if type1 == WIRELESS_LAN or type2 == WIRELESS_LAN:
+                subnet = self.subnets.allocate()
+                row = self._wireless_link(node1, node2, subnet)
 
-        # First pass: Wireless and direct links
-        for node1, node2 in connections:
-            type1 = self.device_registry[node1]["type"].lower()
-            type2 = self.device_registry[node2]["type"].lower()
-            pair_key = tuple(sorted((node1, node2)))
-
-            if "wireless_lan" in (type1, type2):
-                link = self._create_wireless_link(node1, node2, subnet_counter)
-                links_element.append(link)
-                linked_pairs.add(pair_key)
-                subnet_counter += 1
-
-            elif self._is_direct_link(type1, type2):
-                if type2 in {"router", "mdr"} and type1 not in {"router", "mdr"}:
+            elif type1 in DIRECT_TYPES and type2 in DIRECT_TYPES:
+                if type2 in ROUTER_TYPES and type1 not in ROUTER_TYPES:
                     node1, node2 = node2, node1
-                    type1, type2 = type2, type1
-                link = self._create_direct_link(node1, node2, subnet_counter)
-                links_element.append(link)
-                linked_pairs.add(pair_key)
-                subnet_counter += 1
-
-        # First pass: LAN links (switch/hub)
-        for device_id, info in self.device_registry.items():
-            device_type = info["type"].lower()
-            if device_type in {"switch", "hub"} and device_id in adjacency:
-                neighbors = adjacency[device_id]
-                if neighbors:
-                    link_group = self._create_lan_links(device_id, neighbors, subnet_counter)
-                    if link_group:
-                        for link in link_group:
-                            node1 = int(link.attrib["node1"])
-                            node2 = int(link.attrib["node2"])
-                            pair_key = tuple(sorted((node1, node2)))
-                            if pair_key not in linked_pairs:
-                                links_element.append(link)
-                                linked_pairs.add(pair_key)
-                        subnet_counter += 1
-                    else:
-                        deferred_lans.append((device_id, neighbors))
-
-        # Second pass: Retry deferred LANs
-        for center_id, neighbors in deferred_lans:
-            link_group = self._create_lan_links(center_id, neighbors, subnet_counter)
-            if link_group:
-                for link in link_group:
-                    node1 = int(link.attrib["node1"])
-                    node2 = int(link.attrib["node2"])
-                    pair_key = tuple(sorted((node1, node2)))
-                    if pair_key not in linked_pairs:
-                        links_element.append(link)
-                        linked_pairs.add(pair_key)
-                subnet_counter += 1
-            else:
-                print(f"[Notice] Could not link switch/hub {center_id} to {neighbors} — no router or MDR available.")
-
-
-    def _is_direct_link(self, type1, type2):
-        # Checks PCs and routers for direct links
-        valid = {"router", "pc", "mdr"}
-        return type1 in valid and type2 in valid
-    
-    def _create_direct_link(self, node1, node2, subnet_counter):
-        # Create a link element between two devices, with IP interfaces
-        # ip4_prefix = f"10.0.{subnet_counter}." #TODO Change to be dynamic 
-        # ip6_prefix = f"2001::{subnet_counter}"
-
-        ip4_prefix, ip6_prefix = self._get_subnet_prefix(subnet_counter)
-
-        iface1_id = self.device_registry[node1]["interfaces"]
-        iface2_id = self.device_registry[node2]["interfaces"]
-
-        # Build XML element
-        link = ET.Element("link", {
-            "node1": str(node1),
-            "node2": str(node2)
-        })
-
-        iface1 = ET.Element("iface1", {
-            "id": str(iface1_id),
-            "name": f"eth{iface1_id}",
-            "ip4": ip4_prefix + "1",
-            "ip4_mask": "24",
-            "ip6": ip6_prefix + "1",
-            "ip6_mask": "64"
-        })
+                subnet = self.subnets.allocate()
+                row = self._direct_link(node1, node2, subnet)
 
-        iface2 = ET.Element("iface2", {
-            "id": str(iface2_id),
-            "name": f"eth{iface2_id}",
-            "ip4": ip4_prefix + "2",
-            "ip4_mask": "24",
-            "ip6": ip6_prefix + "2",
-            "ip6_mask": "64"
-        })
-
-        options = ET.Element("options", {
-            "delay": "0",
-            "bandwidth": "0",
-            "loss": "0.0",
-            "dup": "0",
-            "jitter": "0",
-            "unidirectional": "0",
-            "buffer": "0"
-        })
+            else:
+                continue
 
-        link.extend([iface1, iface2, options])
+            emit(format_link(*row))
+            record(row)
+            linked[(node1, node2) if node1 < node2 else (node2, node1)] = subnet
 
-        # Increment interface counters for both devices
-        self.device_registry[node1]["interfaces"] += 1
-        self.device_registry[node2]["interfaces"] += 1
+        first_pass_links = len(linked)
+        instrumentation.stop("generate_links.first_pass", started)
+        lans_started = instrumentation.start()
 
-        return link
-    
-    def _create_lan_links(self, center_id, neighbors, subnet_counter):
-        # Creates links between a switch/hub and all its neighbors using a shared subnet
-        links = []
-        # ip4_prefix = f"10.0.{subnet_counter}."
-        # ip6_prefix = f"2001::{subnet_counter}"
-        ip4_prefix, ip6_prefix = self._get_subnet_prefix(subnet_counter)
-
-        ip_host = 1  # Host counter for IP assignments
-
-        # Find the router if any to use as reference
-       
-        router_id = None
-        for neighbor_id in neighbors:
-            neighbor_type = self.device_registry[neighbor_id]["type"].lower()
-            if neighbor_type in {"router", "mdr"}:
-                router_id = neighbor_id
-                break
-
-        if not router_id:
-            return links  # skip if no router to base IPs on
-
-        # Assign IP to router first
-        for node_id in neighbors:
-            if node_id == router_id:
-                iface_id = self.device_registry[node_id]["interfaces"]
-                link = ET.Element("link", {
-                    "node1": str(center_id),
-                    "node2": str(node_id)
-                })
-
-                iface = ET.Element("iface2", {
-                    "id": str(iface_id),
-                    "name": f"eth{iface_id}",
-                    "ip4": ip4_prefix + str(ip_host),
-                    "ip4_mask": "24",
-                    "ip6": ip6_prefix + f":{ip_host}",
-                    "ip6_mask": "64"
-                })
-
-                link.append(iface)
-                link.append(ET.Element("options", {
-                    "delay": "0", "bandwidth": "0", "loss": "0.0",
-                    "dup": "0", "jitter": "0", "unidirectional": "0", "buffer": "0"
-                }))
-                links.append(link)
-                self.device_registry[node_id]["interfaces"] += 1
-                ip_host += 1
-
-        # Connect remaining devices
-        for node_id in neighbors:
-            if node_id == router_id:
+        if not self.adjacency:
+            self.adjacency = adjacency
+        else:
+            for node_id, neighbors in adjacency.items():
+                self.adjacency.setdefault(node_id, []).extend(neighbors)
+
+        # Second pass: one LAN per switch/hub, addressed from its router
+        dropped_lans = []
+        lan_count = 0
+        for center_id in registry.ids_of("SWITCH", "HUB"):
+            neighbors = adjacency.get(center_id)
+            if not neighbors:
                 continue
 
-            iface_id = self.device_registry[node_id]["interfaces"]
-            link = ET.Element("link", {
-                "node1": str(center_id),
-                "node2": str(node_id)
-            })
-
-            iface = ET.Element("iface2", {
-                "id": str(iface_id),
-                "name": f"eth{iface_id}",
-                "ip4": ip4_prefix + str(ip_host),
-                "ip4_mask": "24",
-                "ip6": ip6_prefix + f":{ip_host}",
-                "ip6_mask": "64"
-            })
-
-            link.append(iface)
-            link.append(ET.Element("options", {
-                "delay": "0", "bandwidth": "0", "loss": "0.0",
-                "dup": "0", "jitter": "0", "unidirectional": "0", "buffer": "0"
-            }))
-            links.append(link)
-            self.device_registry[node_id]["interfaces"] += 1
-            ip_host += 1
-
-        return links
-    
-
-    def _create_wireless_link(self, node1, node2, subnet_counter):
+            lan = self.lans.get(center_id)
+            router_id = None
+            if lan is None:
+                neighbors = self.adjacency[center_id]
+                router_id = next((n for n in neighbors if type_codes[n - start_id] in ROUTER_TYPES), None)
+                if router_id is None:
+                    dropped_lans.append(center_id)  # no router to base IPs on
+                    continue
+                lan = self.lans[center_id] = [self.subnets.allocate(), 1]
+
+            lan_count += 1
+            subnet, first_host = lan
+            for node_id, row in self._lan_links(center_id, neighbors, router_id, subnet, first_host):
+                pair_key = (center_id, node_id) if center_id < node_id else (node_id, center_id)
+                if pair_key not in linked:
+                    emit(format_link(*row))
+                    record(row)
+                    linked[pair_key] = subnet
+            lan[1] = first_host + len(neighbors)
+
+        if dropped_lans:
+            if self.validation is None:
+                self.validation = make_report([])
+            diagnostics = self.validation["diagnostics"]
+            if not any(entry["code"] == "orphaned_lan" for entry in diagnostics):
+                diagnostics.append(orphaned_lan(dropped_lans))
+
+        instrumentation.stop("generate_links.lans", lans_started)
+        instrumentation.stop("generate_links", started)
+        if instrumentation.enabled:
+            instrumentation.count("connections", len(connections))
+            instrumentation.count("links", len(linked) - links_before)
+            instrumentation.count("lan_links", len(linked) - first_pass_links)
+            instrumentation.count("subnets", self.subnets.allocated - subnets_before)
+            instrumentation.count("lans", lan_count)
+            instrumentation.count("dropped_lans", len(dropped_lans))
+
+    def remove_connections(self, pairs):
+        # Forgets links between the given node pairs and releases their
+        # point-to-point subnets. Returns the (low, high) pairs that had a link.
+        removed = []
+        for node1, node2 in pairs:
+            pair_key = (node1, node2) if node1 < node2 else (node2, node1)
+            for a, b in (pair_key, pair_key[::-1]):
+                neighbors = self.adjacency.get(a)
+                if neighbors and b in neighbors:
+                    neighbors.remove(b)
+
+            subnet = self.links.pop(pair_key, None)
+            if subnet is None:
+                continue
+            removed.append(pair_key)
+            if not any(self.lans.get(n, (None,))[0] == subnet for n in pair_key):
+                self.subnets.release(subnet)
+        if removed and self.link_table is not None:
+            self.link_table.remove(removed)
+        return removed
+
+    def remove_devices(self, node_ids):
+        # Removes nodes, every link touching them and any LAN they were the
+        # switch/hub of. IDs, interfaces and addresses of all other nodes stay
+        # as they are. Returns (removed IDs, removed link pairs, orphaned
+        # IDs): the switches / hubs left without a router and the PCs left
+        # without any link, which the extend_* generators can attach again.
+        removed_ids = self.device_registry.remove(node_ids)
+
+        pairs = []
+        for node_id in removed_ids:
+            pairs.extend((node_id, other) for other in self.adjacency.get(node_id, ()))
+        removed_links = self.remove_connections(pairs)
+
+        for node_id in removed_ids:
+            self.adjacency.pop(node_id, None)
+            lan = self.lans.pop(node_id, None)
+            if lan is not None:
+                self.subnets.release(lan[0])
+
+        type_code = self.device_registry.type_code
+        neighbors = {node_id for pair in removed_links for node_id in pair} - set(removed_ids)
+        orphaned_ids = sorted(
+            node_id for node_id in neighbors
+            if (type_code(node_id) in LAN_TYPES and not self._has_router(node_id))
+            or (type_code(node_id) == PC and not self.adjacency.get(node_id))
+        )
+        return removed_ids, removed_links, orphaned_ids
+
+
+    def _direct_link(self, node1, node2, subnet):
+        # Link table row (see link_table.py) of a link between two devices,
+        # with IP interfaces on the given subnet index (see SubnetAllocator)
+        take_interface = self.device_registry.take_interface
+        return (DIRECT_LINK, node1, node2, take_interface(node1), take_interface(node2), subnet, 2)
+
+    def _lan_links(self, center_id, neighbors, router_id, subnet, first_host=1):
+        # Rows of the links between a switch/hub and all its neighbors on a
+        # shared subnet. The router gets the first host address. Returns
+        # (neighbor_id, row) pairs so callers never re-read the attributes.
+        ordered = [n for n in neighbors if n == router_id] + [n for n in neighbors if n != router_id]
+        take_interface = self.device_registry.take_interface
+        return [
+            (node_id, (LAN_LINK, center_id, node_id, NO_IFACE, take_interface(node_id), subnet, ip_host))
+            for ip_host, node_id in enumerate(ordered, first_host)
+        ]
+
+    def _wireless_link(self, node1, node2, subnet):
         # Ensure node1 is the wireless LAN node
-        if self.device_registry[node1]["type"].upper() != "WIRELESS_LAN":
+        if self.device_registry.type_code(node1) != WIRELESS_LAN:
             node1, node2 = node2, node1
 
-        iface_id = self.device_registry[node2]["interfaces"]
-
-        link = ET.Element("link", {
-            "node1": str(node1),
-            "node2": str(node2)
-        })
+        iface_id = self.device_registry.take_interface(node2)
 
-        # Check if node2 is a switch
-        if self.device_registry[node2]["type"].lower() == "switch" or  self.device_registry[node2]["type"].lower() == "hub":
-            # iface2 for switch + WLAN connection
-            iface2 = ET.Element("iface2", {
-                "id": str(iface_id),
-                "name": f"veth{node1}.{node2}.1"
-            })
-        else:
-            # iface2 for other connections
-            # ip4_prefix = f"10.0.{subnet_counter}."
-            # ip6_prefix = f"2001:0:0:{subnet_counter}::"
-            ip4_prefix, ip6_prefix = self._get_subnet_prefix(subnet_counter)
+        # A switch gets a veth to the WLAN, other nodes an address
+        if self.device_registry.type_code(node2) in LAN_TYPES:
+            return (BRIDGE_LINK, node1, node2, NO_IFACE, iface_id, subnet, 0)
+        return (WIRELESS_LINK, node1, node2, NO_IFACE, iface_id, subnet, 1)
 
+    def format_link(self, kind, node1, node2, iface1_id, iface2_id, subnet, host):
+        # The <link> record of one link table row
+        subnets = self.subnets
+        iface2_id = str(iface2_id)
 
-            iface2 = ET.Element("iface2", {
-                "id": str(iface_id),
-                "name": f"eth{iface_id}",
-                "ip4": ip4_prefix + "1",
-                "ip4_mask": "32",
-                "ip6": f"{ip6_prefix}1",
-                "ip6_mask": "128"
-            })
-
-        link.append(iface2)
+        if kind == BRIDGE_LINK:
+            # iface2 for switch + WLAN connection
+            return self.emitter.link(node1, node2, iface2=(iface2_id, f"veth{node1}.{node2}.1"), options=False)
+
+        if kind == WIRELESS_LINK:
+            # iface2 for other WLAN connections
+            iface2 = (
+                iface2_id, f"eth{iface2_id}",
+                subnets.ip4_address(subnet, host), "32",
+                subnets.ip6_address(subnet, host), "128"
+            )
+            return self.emitter.link(node1, node2, iface2=iface2, options=False)
+
+        iface2 = (
+            iface2_id, f"eth{iface2_id}",
+            subnets.ip4_address(subnet, host), subnets.ip4_mask,
+            subnets.ip6_address(subnet, host), subnets.ip6_mask
+        )
+        if kind == LAN_LINK:
+            return self.emitter.link(node1, node2, iface2=iface2)
+
+        iface1_id = str(iface1_id)
+        iface1 = (
+            iface1_id, f"eth{iface1_id}",
+            subnets.ip4_address(subnet, 1), subnets.ip4_mask,
+            subnets.ip6_address(subnet, 1), subnets.ip6_mask
+        )
+        return self.emitter.link(node1, node2, iface1, iface2)
 
-        self.device_registry[node2]["interfaces"] += 1
 
-        return link
+    def add_configservice_configurations(self, parent_element):
+        # parent_element is the <scenario> Element or a ScenarioWriter
+        started = self.instrumentation.start()
+        config_elem = open_section(parent_element, "configservice_configurations")
 
+        registry = self.device_registry
+        services_by_code = self._services_by_code()
+        emit = self.emitter.sink(config_elem)
+        service = self.emitter.service
 
-    def add_configservice_configurations(self, parent_element):
-        config_elem = ET.SubElement(parent_element, "configservice_configurations")
-
-        for node_id, info in self.device_registry.items():
-            device_type = info["type"].lower()
-            
-            # Map device types to their services (same as add_user_devices)
-            if device_type == "router":
-                services = ["OSPFv3", "OSPFv2", "IPForward", "zebra"]
-            elif device_type == "mdr":
-                services = ["zebra", "IPForward", "OSPFv3MDR"]
-            elif device_type == "pc":
-                services = ["DefaultRoute"]
-            else:
-                continue  # skip other types
+        for node_id, code in enumerate(registry.type_codes, registry.start_id):
+            services = services_by_code[code]
+            if services is None:
+                continue  # skip other types and removed nodes
 
             for svc in services:
-                ET.SubElement(config_elem, "service", {
-                    "name": svc,
-                    "node": str(node_id)
-                })
+                emit(service(svc, node_id))
+
+        close_section(config_elem)
+        self.instrumentation.stop("add_configservice_configurations", started)
+        if self.instrumentation.enabled:
+            self.instrumentation.count("services", sum(
+                registry.count_of(device_type) * len(services) for device_type, services in DEVICE_SERVICES.items()
+            ))
+
+    def add_configservices(self, config_elem, node_ids):
+        # Service entries for just the given nodes, into an existing
+        # <configservice_configurations> section
+        services_by_code = self._services_by_code()
+        emit = self.emitter.sink(config_elem)
+        for node_id in node_ids:
+            for svc in services_by_code[self.device_registry.type_code(node_id)] or ():
+                emit(self.emitter.service(svc, node_id))
+
+    def _services_by_code(self):
+        # Map device type codes to their services (same as add_user_devices);
+        # one slot per possible code, so REMOVED maps to None as well
+        registry = self.device_registry
+        services_by_code = [None] * 256
+        for device_type, services in DEVICE_SERVICES.items():
+            services_by_code[registry.intern(device_type)] = services
+        return services_by_code
 
 
     def _get_bounded_position(self, idx):
-        max_columns = (self.MAX_X - self.MIN_X) // self.X_STEP
-        max_rows = (self.MAX_Y - self.MIN_Y) // self.Y_STEP
-        total_slots = max_columns * max_rows
-
-        idx = idx % total_slots  # wrap around
-
-        row = idx // max_columns
-        col = idx % max_columns
-
-        if row % 2 == 1:
-            col = max_columns - 1 - col  # snake pattern
-
-        x = self.MIN_X + col * self.X_STEP
-        y = self.MIN_Y + row * self.Y_STEP
-
-        return float(x), float(y)
+        return self.layout.position(idx)
     
     def get_lat_lon(self, idx):
-        max_columns = (self.MAX_X - self.MIN_X) // self.X_STEP
-        max_rows = (self.MAX_Y - self.MIN_Y) // self.Y_STEP
-        total_slots = max_columns * max_rows
-
-        idx = idx % total_slots  # wrap around 
-
-        row = idx // max_columns
-        col = idx % max_columns
-
-        if row % 2 == 1:
-            col = max_columns - 1 - col
-
-        LAT_START = 47.57889
-        LAT_STEP = 0.00135
-
-        LON_START = -122.13188
-        LON_STEP = 0.00265
-
-        latitude = LAT_START - (row * LAT_STEP)
-        longitude = LON_START + (col * LON_STEP)
-
-        return f"{latitude:.12f}", f"{longitude:.12f}"
+        return self.layout.lat_lon(idx)
     
 
     #deterministic
     def generate_random_links(self):
-        links = []
-        seen_links = []
+        # Every link goes through a LinkIndex, so the duplicate check is O(1)
+        # and the whole pass is linear in the number of emitted links
+        link_index = LinkIndex()
 
         # Group devices by type
-        routers = []
-        switch_and_hubs = []
-        pcs = []
-
-        for device_id, info in self.device_registry.items():
-            dtype = info["type"].lower()
-            if dtype == "router":
-                routers.append(device_id)
-            elif dtype in {"switch", "hub"}:
-                switch_and_hubs.append(device_id)
-            elif dtype == "pc":
-                pcs.append(device_id)
+        routers = self.device_registry.ids_of("router")
+        switch_and_hubs = self.device_registry.ids_of("SWITCH", "HUB")
+        pcs = self.device_registry.ids_of("PC")
 
         # Link routers to each other
-        for i in range(len(routers)):
-            for j in range(i + 1, len(routers)):
-                r1, r2 = routers[i], routers[j]
-                link = (min(r1, r2), max(r1, r2))
-                if link not in seen_links:
-                    links.append(link)
-                    seen_links.append(link)
-
-        # Attach each switch to a router (record which switches got a router)
-        router_index = 0
+        for i, r1 in enumerate(routers):
+            for r2 in routers[i + 1:]:
+                link_index.add(r1, r2)
+
+        # Attach each switch to a router, round-robin (record which switches got a router)
         switches_connected_to_routers = set()
-        for switch_id in switch_and_hubs:
-            if routers:
-                router_id = routers[router_index % len(routers)]
-                link = (min(switch_id, router_id), max(switch_id, router_id))
-                if link not in seen_links:
-                    links.append(link)
-                    seen_links.append(link)
-                    switches_connected_to_routers.add(switch_id)
-                    router_index += 1
+        for switch_id in attach(switch_and_hubs, CapacityPool(routers, capacity=None), link_index):
+            switches_connected_to_routers.add(switch_id)
 
         # Now connect PCs to a switch that has a router connected
         preferred_parents = list(switches_connected_to_routers) or routers  # fallback to router if no such switch
 
-        parent_index = 0
-        for pc in pcs:
-            for _ in range(len(preferred_parents)):
-                parent = preferred_parents[parent_index % len(preferred_parents)]
-                link = (min(pc, parent), max(pc, parent))
-                if link not in seen_links:
-                    links.append(link)
-                    seen_links.append(link)
-                    parent_index += 1
-                    break
-                parent_index += 1
-
-        return links
-
-
-    def generate_non_deterministic_links(self):
-        links = []
-        seen_links = set()
-
-        routers = []
-        switch_and_hubs = []
-        pcs = []
-
-        for device_id, info in self.device_registry.items():
-            dtype = info["type"].lower()
-            if dtype == "router":
-                routers.append(device_id)
-            elif dtype in {"switch", "hub"}:
-                switch_and_hubs.append(device_id)
-            elif dtype == "pc":
-                pcs.append(device_id)
+        attach(pcs, CapacityPool(preferred_parents, capacity=None), link_index)
+
+        return link_index.links
+
+
+    def generate_non_deterministic_links(self, rng=None, switches_per_router=1):
+        # rng: a seed or a random.Random. Every draw comes from it, so the
+        # same seed always gives the same links and parallel workers never
+        # share state. Without one a fresh, OS-seeded generator is used.
+        # switches_per_router caps how many switches/hubs share a router.
+        if not isinstance(rng, random.Random):
+            rng = random.Random(rng)
+
+        link_index = LinkIndex()
+
+        routers = self.device_registry.ids_of("router")
+        switch_and_hubs = self.device_registry.ids_of("SWITCH", "HUB")
+        pcs = self.device_registry.ids_of("PC")
 
         # Shuffle to introduce randomness
-        random.shuffle(routers)
-        random.shuffle(switch_and_hubs)
-        random.shuffle(pcs)
-
-        # Optional: randomly link some routers to each other
-        for i in range(len(routers)):
-            for j in range(i + 1, len(routers)):
-                if random.random() < 0.5:
-                    r1, r2 = routers[i], routers[j]
-                    link = (min(r1, r2), max(r1, r2))
-                    if link not in seen_links:
-                        links.append(link)
-                        seen_links.add(link)
-
-        # Constraint: No router can have more than one switch
-        router_switch_count = {r: 0 for r in routers}
-
-        for switch in switch_and_hubs:
-            available_routers = [r for r, count in router_switch_count.items() if count < 1]
-            if available_routers:
-                chosen_router = random.choice(available_routers)
-                link = (min(switch, chosen_router), max(switch, chosen_router))
-                if link not in seen_links:
-                    links.append(link)
-                    seen_links.add(link)
-                    router_switch_count[chosen_router] += 1
+        rng.shuffle(routers)
+        rng.shuffle(switch_and_hubs)
+        rng.shuffle(pcs)
+
+        # Optional: randomly link some routers to each other. All the 50%
+        # coin flips are drawn as one batch of random bits, one per pair.
+        pair_count = len(routers) * (len(routers) - 1) // 2
+        flips = b""
+        if pair_count:
+            flips = format(rng.getrandbits(pair_count), f"0{pair_count}b").encode().translate(_BIT_VALUES)
+
+        offset = 0
+        for i, r1 in enumerate(routers):
+            others = routers[i + 1:]
+            for r2 in compress(others, flips[offset:offset + len(others)]):
+                link_index.add(r1, r2)
+            offset += len(others)
+
+        # Constraint: No router can have more than switches_per_router switches
+        attach(switch_and_hubs, CapacityPool(routers, switches_per_router), link_index, rng)
 
         # PCs connect to any available switch (or router if no switches)
         preferred_parents = switch_and_hubs or routers
-        for pc in pcs:
-            if preferred_parents:
-                parent = random.choice(preferred_parents)
-                link = (min(pc, parent), max(pc, parent))
-                if link not in seen_links:
-                    links.append(link)
-                    seen_links.add(link)
-
-        return links
-
+        attach(pcs, CapacityPool(preferred_parents, capacity=None), link_index, rng)
+
+        return link_index.links
+
+
+    def generate_topology_links(self, topology, rng=None, switches_per_router=1, deterministic=False):
+        # Router backbone from a registered model (see topologies.py), then
+        # switches / hubs and PCs attached as by the generators above:
+        # round-robin without a cap when deterministic, otherwise at random
+        # with at most switches_per_router switches per router.
+        # topology is a model name or {"model": name, <model parameters>}.
+        if isinstance(topology, str):
+            topology = {"model": topology}
+        params = dict(topology)
+        name = params.pop("model", None)
+        model = TOPOLOGIES.get(name)
+        if model is None:
+            raise ValueError(f"Unknown topology {name!r}; choose from {', '.join(TOPOLOGIES)}")
+        if not isinstance(rng, random.Random):
+            rng = random.Random(rng)
+
+        link_index = LinkIndex()
+        routers = self.device_registry.ids_of("router")
+        switch_and_hubs = self.device_registry.ids_of("SWITCH", "HUB")
+        pcs = self.device_registry.ids_of("PC")
+
+        try:
+            access = model(routers, rng, link_index, **params)
+        except TypeError as e:
+            raise ValueError(f"Bad parameters for topology {name!r}: {e}")
+        access = routers if access is None else access
+
+        if deterministic:
+            attached = attach(switch_and_hubs, CapacityPool(access, capacity=None), link_index)
+            attach(pcs, CapacityPool(attached or access, capacity=None), link_index)
+        else:
+            rng.shuffle(switch_and_hubs)
+            rng.shuffle(pcs)
+            attach(switch_and_hubs, CapacityPool(access, switches_per_router), link_index, rng)
+            attach(pcs, CapacityPool(switch_and_hubs or access, capacity=None), link_index, rng)
+
+        return link_index.links
+
+
+    ##
+    # Link generators for nodes added to an existing topology (see
+    # createXmlV2.update_scenario). They follow the same rules as the full
+    # generators above, only for the new IDs (and the IDs remove_devices
+    # orphaned, which are attached as if they were new), and return just
+    # the new connections; every new link touches at least one of them.
+    ##
+    def _split_new(self, new_ids):
+        codes = self.device_registry.codes
+        by_type = {code: [] for code in (codes["router"], SWITCH, HUB, PC)}
+        for node_id in new_ids:
+            code = self.device_registry.type_code(node_id)
+            if code in by_type:
+                by_type[code].append(node_id)
+        return by_type[codes["router"]], by_type[SWITCH] + by_type[HUB], by_type[PC]
+
+    def _has_router(self, node_id):
+        type_code = self.device_registry.type_code
+        return any(type_code(n) in ROUTER_TYPES for n in self.adjacency.get(node_id, ()))
+
+    def extend_random_links(self, new_ids):
+        link_index = LinkIndex()
+        new_routers, new_switches, new_pcs = self._split_new(new_ids)
+        routers = self.device_registry.ids_of("router")
+
+        # New routers join the full mesh
+        for r1 in new_routers:
+            for r2 in routers:
+                if r1 != r2:
+                    link_index.add(r1, r2)
+
+        # New switches go round-robin to the routers
+        attached = attach(new_switches, CapacityPool(routers, capacity=None), link_index)
+
+        # New PCs go to switches that have a router
+        preferred_parents = [n for n in self.device_registry.ids_of("SWITCH", "HUB") if self._has_router(n)]
+        preferred_parents = sorted(set(preferred_parents) | set(attached)) or routers
+        attach(new_pcs, CapacityPool(preferred_parents, capacity=None), link_index)
+
+        return link_index.links
+
+    def extend_non_deterministic_links(self, new_ids, rng=None, switches_per_router=1):
+        if not isinstance(rng, random.Random):
+            rng = random.Random(rng)
+
+        link_index = LinkIndex()
+        new_routers, new_switches, new_pcs = self._split_new(new_ids)
+        routers = self.device_registry.ids_of("router")
+        switch_and_hubs = self.device_registry.ids_of("SWITCH", "HUB")
+
+        # Each new router flips a coin for every other router
+        new_set = set(new_routers)
+        for r1 in new_routers:
+            for r2 in routers:
+                if r1 != r2 and (r2 not in new_set or r1 < r2) and rng.getrandbits(1):
+                    link_index.add(r1, r2)
+
+        # Routers keep their switches_per_router limit, counting existing switches
+        type_code = self.device_registry.type_code
+        load = {r: sum(1 for n in self.adjacency.get(r, ()) if type_code(n) in LAN_TYPES) for r in routers}
+        pool = CapacityPool(routers, switches_per_router, used=load)
+        rng.shuffle(new_switches)
+        attach(new_switches, pool, link_index, rng)
+
+        rng.shuffle(new_pcs)
+        attach(new_pcs, CapacityPool(switch_and_hubs or routers, capacity=None), link_index, rng)
+
+        return link_index.links
+
+    def snapshot(self):
+        # Everything an incremental update needs to continue from this
+        # builder (see builder_state.py); connections are kept as adjacency
+        return {
+            "start_id": self.device_registry.start_id,
+            "ip4_base": self.ip4_base,
+            "ip6_base": self.ip6_base,
+            "ip4_prefix": self.subnets.ip4_prefix,
+            "ip6_prefix": self.subnets.ip6_prefix,
+            "registry": self.device_registry.snapshot(),
+            "subnets": self.subnets.snapshot(),
+            "layout": self.layout.snapshot(),
+            "adjacency": self.adjacency,
+            "links": self.links,
+            "lans": self.lans
+        }
 
-   
\ No newline at end of file
+    @classmethod
+    def restore(cls, snapshot, emitter=None):
+        builder = cls(snapshot["start_id"], snapshot["ip4_base"], snapshot["ip6_base"],
+                      snapshot["ip4_prefix"], snapshot["ip6_prefix"], emitter)
+        builder.device_registry = DeviceRegistry.restore(snapshot["registry"])
+        builder.current_id = builder.device_registry.next_id
+        builder.subnets.restore(snapshot["subnets"])
+        builder.layout.restore(snapshot["layout"])
+        builder.adjacency = snapshot["adjacency"]
+        builder.links = snapshot["links"]
+        builder.lans = snapshot["lans"]
+        builder.link_table = None  # not part of the state
+        return builder
@@ -0,0 +1,341 @@
+import xml.etree.ElementTree as ET
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from basic_core_structure import (
+    add_session_origin,
+    add_session_options,
+    add_session_metadata,
+    add_default_services,
+    add_mobility_configurations
+)
+from createXmlV2 import SCENARIO_ATTRIB
+from emitters import EMITTERS, make_emitter
+from network_builder import NetworkBuilder
+from scenario_writer import open_scenario_writer, open_section, close_section, write_tree
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+###
+# Stage-by-stage benchmark of the whole generation pipeline.
+#
+#   python pipeline_benchmark.py run -o results.json
+#   python pipeline_benchmark.py run --sizes 1000,100000,250000 --mix routers --backend template
+#   python pipeline_benchmark.py compare baseline.json results.json
+#
+# Every case (device mix x node count x backend) runs the stages of
+# createXmlV2.populate_scenario one by one, in a fresh process so peak RSS
+# belongs to that case alone:
+#
+#   register_devices, generate_random_links, generate_non_deterministic_links,
+#   plan_layout, add_user_networks, add_user_devices, generate_links,
+#   add_configservice_configurations, static_sections, serialize
+#
+# Both link generators are timed; generate_links uses the deterministic
+# links. With the etree backend "serialize" writes the finished tree; the
+# template backend streams every section while it is built, so there it is
+# only closing the file.
+#
+# Per stage the JSON holds:
+#   seconds          wall time (the best of --repeat runs)
+#   peak_rss         process high-water RSS in bytes when the stage ended
+#   rss_growth       how far the stage raised that high-water mark
+#   blocks           change in allocated memory blocks (sys.getallocatedblocks)
+#   alloc_bytes      bytes still allocated by the stage when it ended  } second run
+#   alloc_peak       peak bytes allocated during the stage             } under tracemalloc
+#
+# compare matches cases by mix, size and backend and exits 1 if any stage
+# got slower, or any case needs more memory, than the tolerance allows.
+###
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def campus_mix(size):
+    # Routers in a full mesh (about sqrt(size) of them), a switch LAN for
+    # every second router, the rest PCs; WLANs with MDRs from 100 nodes up
+    routers = max(1, round(math.sqrt(size)))
+    switches = max(1, routers // 2)
+    wireless = size // 1000 if size >= 100 else 0
+    mdrs = wireless * 2
+    pcs = max(0, size - routers - switches - wireless - mdrs)
+    return {"SWITCH": switches, "router": routers, "PC": pcs, "WIRELESS_LAN": wireless, "mdr": mdrs}
+
+
+def routers_mix(size):
+    # Router-heavy: twice as many routers, so the router mesh dominates
+    routers = max(1, round(2 * math.sqrt(size)))
+    switches = routers
+    pcs = max(0, size - routers - switches)
+    return {"SWITCH": switches, "router": routers, "PC": pcs}
+
+
+MIXES = {"campus": campus_mix, "routers": routers_mix}
+
+# /20 subnets: room for 4094 hosts per LAN at the largest sizes
+IP4_PREFIX = 20
+
+
+def _rss_bytes():
+    # High-water resident set size of this process
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageRecorder:
+    # Measures consecutive stages; trace=True adds tracemalloc figures
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.stages = {}
+
+    def run(self, name, func, *args):
+        rss_before = _rss_bytes()
+        blocks_before = sys.getallocatedblocks()
+        if self.trace:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+
+        stage = {"seconds": seconds, "blocks": sys.getallocatedblocks() - blocks_before}
+        if self.trace:
+            current, peak = tracemalloc.get_traced_memory()
+            stage["alloc_bytes"] = current - traced_before
+            stage["alloc_peak"] = peak - traced_before
+        rss_after = _rss_bytes()
+        if rss_after is not None:
+            stage["peak_rss"] = rss_after
+            stage["rss_growth"] = rss_after - rss_before
+        self.stages[name] = stage
+        return result
+
+
+def run_pipeline(devices, backend, output_path, trace=False):
+    # The stages of populate_scenario, timed one by one. Returns
+    # (stages, node count, link count).
+    recorder = StageRecorder(trace)
+    builder = NetworkBuilder(1, "192.168.5.0", "2001::0", IP4_PREFIX, emitter=make_emitter(backend))
+
+    streaming = backend == "template"
+    if streaming:
+        scenario = open_scenario_writer(output_path, SCENARIO_ATTRIB)
+    else:
+        scenario = ET.Element("scenario", SCENARIO_ATTRIB)
+
+    def sections(tag, func, *args):
+        section = open_section(scenario, tag)
+        func(section, *args)
+        close_section(section)
+
+    def static_sections():
+        add_mobility_configurations(scenario, builder.device_registry)
+        add_session_origin(scenario)
+        add_session_options(scenario)
+        add_session_metadata(scenario, builder.canvas_dimensions())
+        add_default_services(scenario)
+
+    def serialize():
+        if streaming:
+            scenario.close()
+        else:
+            write_tree(output_path, scenario)
+
+    recorder.run("register_devices", builder.register_devices, devices)
+    connections = recorder.run("generate_random_links", builder.generate_random_links)
+    recorder.run("generate_non_deterministic_links", builder.generate_non_deterministic_links, 0)
+    recorder.run("plan_layout", builder.plan_layout, connections)
+    recorder.run("add_user_networks", sections, "networks", builder.add_user_networks, devices)
+    recorder.run("add_user_devices", sections, "devices", builder.add_user_devices, devices)
+    recorder.run("generate_links", sections, "links", builder.generate_links, connections)
+    recorder.run("add_configservice_configurations", builder.add_configservice_configurations, scenario)
+    recorder.run("static_sections", static_sections)
+    recorder.run("serialize", serialize)
+    return recorder.stages, len(builder.device_registry), len(builder.links)
+
+
+def _run_case(case):
+    # Runs in a fresh worker process: timed runs, then one traced run
+    mix, size, backend, repeat, allocations = case
+    devices = MIXES[mix](size)
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, "scenario.xml")
+        stages = None
+        for _ in range(repeat):
+            run, nodes, links = run_pipeline(devices, backend, output_path)
+            if stages is None:
+                stages = run  # memory figures of the first, cold run
+            else:
+                for name, stage in run.items():
+                    stages[name]["seconds"] = min(stages[name]["seconds"], stage["seconds"])
+        output_bytes = os.path.getsize(output_path)
+
+        if allocations:
+            tracemalloc.start()
+            traced, _, _ = run_pipeline(devices, backend, output_path, trace=True)
+            tracemalloc.stop()
+            for name, stage in traced.items():
+                stages[name]["alloc_bytes"] = stage["alloc_bytes"]
+                stages[name]["alloc_peak"] = stage["alloc_peak"]
+
+    for stage in stages.values():
+        stage["seconds"] = round(stage["seconds"], 6)
+    return {
+        "mix": mix,
+        "size": size,
+        "backend": backend,
+        "devices": devices,
+        "nodes": nodes,
+        "links": links,
+        "output_bytes": output_bytes,
+        "seconds": round(sum(stage["seconds"] for stage in stages.values()), 6),
+        "peak_rss": max((stage.get("peak_rss") or 0 for stage in stages.values()), default=0) or None,
+        "stages": stages
+    }
+
+
+def run_benchmarks(mixes, sizes, backends, repeat=1, allocations=True, progress=print):
+    cases = [(mix, size, backend, repeat, allocations) for mix in mixes for size in sizes for backend in backends]
+    results = []
+    for case in cases:
+        # One process per case, started fresh (not forked) so its RSS
+        # high-water mark starts from a bare interpreter
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(_run_case, case).result()
+        results.append(result)
+        if progress:
+            rss = f"{result['peak_rss'] / 2 ** 20:.0f} MB" if result["peak_rss"] else "n/a"
+            progress(f"{result['mix']:>8} {result['size']:>8} {result['backend']:>8} {result['nodes']:>8} nodes "
+                     f"{result['links']:>8} links {result['seconds']:>9.3f}s  peak RSS {rss}")
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": repeat,
+        "cases": results
+    }
+
+
+##
+# Compares two result files. A stage regresses when it is slower than the
+# baseline by more than `tolerance` (a fraction) and by more than
+# min_seconds; a case regresses when its peak RSS or a stage's peak
+# allocation grew by more than `tolerance` and more than min_bytes.
+# Returns a list of {"case", "stage", "metric", "baseline", "current", "change"}
+# for every regression.
+##
+def compare_results(baseline, current, tolerance=0.25, min_seconds=0.005, min_bytes=1 << 20):
+    def case_key(case):
+        return (case["mix"], case["size"], case["backend"])
+
+    baseline_cases = {case_key(case): case for case in baseline["cases"]}
+    regressions = []
+
+    def check(case, stage, metric, old, new, floor):
+        if old is None or new is None:
+            return
+        if new > old * (1 + tolerance) and new - old > floor:
+            regressions.append({
+                "case": "/".join(str(part) for part in case_key(case)),
+                "stage": stage,
+                "metric": metric,
+                "baseline": old,
+                "current": new,
+                "change": round(new / old - 1, 4) if old else None
+            })
+
+    for case in current["cases"]:
+        old_case = baseline_cases.get(case_key(case))
+        if old_case is None:
+            continue
+        check(case, None, "peak_rss", old_case.get("peak_rss"), case.get("peak_rss"), min_bytes)
+        for name, stage in case["stages"].items():
+            old_stage = old_case["stages"].get(name)
+            if old_stage is None:
+                continue
+            check(case, name, "seconds", old_stage["seconds"], stage["seconds"], min_seconds)
+            check(case, name, "alloc_peak", old_stage.get("alloc_peak"), stage.get("alloc_peak"), min_bytes)
+    return regressions
+
+
+def print_comparison(baseline, current):
+    # Per-case totals side by side
+    baseline_cases = {(c["mix"], c["size"], c["backend"]): c for c in baseline["cases"]}
+    print(f"{'mix':>8} {'size':>8} {'backend':>8} {'baseline s':>11} {'current s':>10} {'change':>8}")
+    for case in current["cases"]:
+        old_case = baseline_cases.get((case["mix"], case["size"], case["backend"]))
+        if old_case is None:
+            continue
+        change = case["seconds"] / old_case["seconds"] - 1 if old_case["seconds"] else 0.0
+        print(f"{case['mix']:>8} {case['size']:>8} {case['backend']:>8} "
+              f"{old_case['seconds']:>11.3f} {case['seconds']:>10.3f} {change:>+8.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every stage of scenario generation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark and save the results as JSON")
+    run_parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                            help="comma-separated node counts")
+    run_parser.add_argument("--mix", action="append", choices=list(MIXES),
+                            help="device mix (repeatable; default campus)")
+    run_parser.add_argument("--backend", action="append", choices=list(EMITTERS),
+                            help="serialization backend (repeatable; default all)")
+    run_parser.add_argument("--repeat", type=int, default=1, help="timed runs per case; the best is kept")
+    run_parser.add_argument("--no-allocations", action="store_true",
+                            help="skip the tracemalloc run (it roughly doubles the time per case)")
+    run_parser.add_argument("-o", "--output", default="pipeline_benchmark.json")
+    run_parser.add_argument("--baseline", help="compare against this result file when done")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions against a baseline result file")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+
+    for sub in (run_parser, compare_parser):
+        sub.add_argument("--tolerance", type=float, default=0.25,
+                         help="allowed slowdown / memory growth as a fraction (default 0.25)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        sizes = [int(size) for size in args.sizes.split(",")]
+        current = run_benchmarks(args.mix or ["campus"], sizes, args.backend or list(EMITTERS),
+                                 args.repeat, not args.no_allocations)
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results saved to {args.output}")
+        if not args.baseline:
+            sys.exit(0)
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    print_comparison(baseline, current)
+    regressions = compare_results(baseline, current, args.tolerance)
+    for regression in regressions:
+        stage = f" {regression['stage']}" if regression["stage"] else ""
+        change = f"{regression['change']:+.1%}" if regression["change"] is not None else "new"
+        print(f"REGRESSION {regression['case']}{stage} {regression['metric']}: "
+              f"{regression['baseline']} -> {regression['current']} ({change})")
+    if not regressions:
+        print(f"No regressions beyond {args.tolerance:.0%}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,229 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+###
+# Content-addressed cache of generated scenarios.
+#
+# A scenario is fully determined by its normalized config (devices, links,
+# addressing, link mode and seed) and the generator version, so the
+# SHA-256 of those is the cache key and the XML is stored under it:
+#
+#   <cache>/objects/ab/ab12...ef.xml
+#   <cache>/events.log      one "hit" / "miss" / "store" / "evict" per line
+#
+# A hit copies (or hard-links, with link=True) the stored file to the
+# output path and refreshes its mtime; the least recently used objects are
+# evicted once the cache grows past max_bytes. Objects are written to a
+# temporary name and renamed, and events are single O_APPEND writes, so
+# several processes (CI jobs, batch workers) can share one cache.
+#
+# Hard links share the file: anything that rewrites the output in place
+# (update_scenario, the XML fixer) would change the cached copy as well,
+# which is why copying is the default.
+#
+#   python scenario_cache.py .scenario_cache            # show statistics
+#   python scenario_cache.py .scenario_cache --clear
+###
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+# Eviction goes down to this fraction of max_bytes, so a full cache is
+# not scanned again on the very next store
+LOW_WATER = 0.9
+
+# Bytes in each cache directory as this process counts them: seeded by
+# one scan of objects/, then kept up to date by store() and evict(), so
+# storing does not scan the whole cache every time. Module level, so batch
+# workers keep the count across tasks. Objects stored by other processes
+# are counted at the next scan, which happens once this count passes
+# max_bytes.
+_SIZES = {}
+
+EVENTS = ["hit", "miss", "store", "evict"]
+
+
+def normalize_config(config):
+    # The parts of a config that decide the output, in a canonical form.
+    # Returns None for configs whose output is random (no seed).
+    normalized = {
+        "devices": {device_type: count for device_type, count in sorted(config["devices"].items()) if count},
+        "custom_ipv4s": config.get("custom_ipv4s") or None,
+        "ip4_subnet_prefix": config.get("ip4_subnet_prefix", 24)
+    }
+
+    if config.get("autogenerate_links", False) or "links" not in config:
+        normalized["deterministic_links"] = bool(config.get("deterministic_links"))
+        if config.get("topology"):
+            # Backbone models draw from the seed even when deterministic
+            normalized["topology"] = config["topology"]
+            seed = config.get("seed", 0 if normalized["deterministic_links"] else None)
+            if seed is None:
+                return None
+            normalized["seed"] = seed
+            if not normalized["deterministic_links"]:
+                normalized["switches_per_router"] = config.get("switches_per_router", 1)
+        elif not normalized["deterministic_links"]:
+            if config.get("seed") is None:
+                return None
+            normalized["seed"] = config["seed"]
+            normalized["switches_per_router"] = config.get("switches_per_router", 1)
+    else:
+        normalized["links"] = [list(pair) for pair in config["links"]]
+
+    return normalized
+
+
+class ScenarioCache:
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, link=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.link = link
+        self.objects = os.path.join(directory, "objects")
+        os.makedirs(self.objects, exist_ok=True)
+
+    def key(self, config, version):
+        # Hex digest for config + generator version, or None if uncacheable
+        normalized = normalize_config(config)
+        if normalized is None:
+            return None
+        text = json.dumps({"version": version, "config": normalized}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.objects, key[:2], key + ".xml")
+
+    def _record(self, event, count=1):
+        fd = os.open(os.path.join(self.directory, "events.log"), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, (event + "\n").encode() * count)
+        finally:
+            os.close(fd)
+
+    def fetch(self, key, output_path):
+        # Puts the cached scenario at output_path; False on a miss
+        source = self.path(key)
+        try:
+            os.utime(source)  # most recently used
+        except FileNotFoundError:
+            self._record("miss")
+            return False
+
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+        try:
+            if self.link:
+                os.link(source, output_path)
+            else:
+                shutil.copyfile(source, output_path)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            self._record("miss")
+            return False
+        except OSError:
+            shutil.copyfile(source, output_path)  # e.g. hard link across filesystems
+
+        self._record("hit")
+        return True
+
+    def _size(self):
+        # Running total of the cached bytes (see _SIZES)
+        directory = os.path.abspath(self.objects)
+        if directory not in _SIZES:
+            _SIZES[directory] = sum(size for _, size, _ in self._entries())
+        return _SIZES[directory]
+
+    def store(self, key, generated_path):
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        total = self._size()
+        try:
+            total -= os.path.getsize(target)  # stored again
+        except FileNotFoundError:
+            pass
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        shutil.copyfile(generated_path, tmp_path)
+        total += os.path.getsize(tmp_path)
+        os.replace(tmp_path, target)
+        self._record("store")
+        _SIZES[os.path.abspath(self.objects)] = total
+        if total > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        # (mtime, size, path) of every cached object
+        entries = []
+        for bucket in os.scandir(self.objects):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith(".xml"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        # Drops least recently used objects until the cache fits max_bytes
+        # (down to LOW_WATER of it if it did not fit)
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_bytes if total <= self.max_bytes else int(self.max_bytes * LOW_WATER)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        _SIZES[os.path.abspath(self.objects)] = total
+        if evicted:
+            self._record("evict", evicted)
+        return evicted
+
+    def stats(self):
+        counts = dict.fromkeys(EVENTS, 0)
+        try:
+            with open(os.path.join(self.directory, "events.log")) as f:
+                for line in f:
+                    event = line.strip()
+                    if event in counts:
+                        counts[event] += 1
+        except FileNotFoundError:
+            pass
+
+        entries = self._entries()
+        lookups = counts["hit"] + counts["miss"]
+        return dict(
+            counts,
+            hit_rate=round(counts["hit"] / lookups, 4) if lookups else 0.0,
+            objects=len(entries),
+            bytes=sum(size for _, size, _ in entries),
+            max_bytes=self.max_bytes
+        )
+
+    def clear(self):
+        shutil.rmtree(self.objects, ignore_errors=True)
+        os.makedirs(self.objects, exist_ok=True)
+        _SIZES[os.path.abspath(self.objects)] = 0
+        try:
+            os.remove(os.path.join(self.directory, "events.log"))
+        except FileNotFoundError:
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clear a scenario cache")
+    parser.add_argument("directory")
+    parser.add_argument("--clear", action="store_true", help="delete every cached scenario and the statistics")
+    args = parser.parse_args()
+
+    cache = ScenarioCache(args.directory)
+    if args.clear:
+        cache.clear()
+    print(json.dumps(cache.stats(), indent=2))
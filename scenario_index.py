@@ -0,0 +1,465 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ET
+from array import array
+from bisect import bisect_left, bisect_right
+from column_file import read_columns, write_columns
+from scenario_io import is_compressed, open_output, temporary_path
+from scenario_patch import SECTION_ORDER
+from scenario_writer import serialize
+
+###
+# Memory-mapped, lazily indexed view of an existing scenario file.
+#
+#   with ScenarioIndex("huge.xml") as scenario:
+#       scenario.sections              {"networks": (start, end), ...}
+#       scenario.node(1234)            that <device> / <network> as an Element
+#       for link in scenario.links():  <link> Elements, one at a time
+#       scenario.links_of(1234)        the <link>s of one node
+#       scenario.rewrite_section("session_metadata", element, "fixed.xml")
+#
+# Opening maps the file and walks its top level only: the start tag of
+# every section, then a find() of its closing tag, so the cost is one
+# memchr-speed scan and no parsing. Record indexes are built the first
+# time they are needed, with one regex pass over their section straight
+# on the mapping:
+#
+#   nodes  ids + byte offsets of every <network> / <device>, in arrays;
+#          looked up by bisection (by a sorted permutation for files whose
+#          IDs are out of order)
+#   links  byte offsets + node1 / node2 of every <link>, in arrays
+#   ends   for links_of: the link slots of node1 and node2 together,
+#          grouped by node ID (CSR order), next to the sorted IDs that
+#          bisection finds a node's run in
+#
+# A record is parsed on its own from its bytes (up to the next record of
+# its section), so RSS stays at the index arrays -- about 20 bytes per
+# node and 32 per link -- plus whatever pages of the file were touched. Records are
+# assumed not to nest records of their own tag, and <link> to name node1
+# before node2, as every CORE writer does. Compressed files cannot be
+# mapped; decompress them first (see scenario_io).
+#
+# save_index() keeps the indexes and the section offsets in a column
+# file (see column_file.py) next to the scenario; opened with index_path,
+# a ScenarioIndex maps that instead of scanning, as long as the scenario's
+# size and modification time still match it.
+#
+#   python scenario_index.py huge.xml --index huge.xml.idx --node 1234
+###
+
+INDEX_MAGIC = b"COREXIDX"
+
+INDEX_VERSION = 2
+
+_TAG_END_OR_QUOTE = re.compile(rb"[>\"']")
+
+_NODE_RECORD = re.compile(rb"<(?:network|device)\s[^>]*?\bid\s*=\s*[\"'](\d+)")
+_LINK_RECORD = re.compile(rb"<link\s[^>]*?\bnode1\s*=\s*[\"'](\d+)[\"'][^>]*?\bnode2\s*=\s*[\"'](\d+)")
+
+_NAME_END = b" \t\r\n/>"
+
+
+class ScenarioIndex:
+
+    def __init__(self, path, index_path=None):
+        if is_compressed(path):
+            raise ValueError(f"{path} is compressed; decompress it to index it")
+        self.path = path
+        self.index_path = index_path
+        self._open()
+
+    def _open(self):
+        with open(self.path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.root = None          # (name, start, end)
+        self._root_close = None   # start of the root's closing tag
+        self.sections = {}        # name -> (start, end) of the first section of that name
+        self.order = []           # (name, start, end) of every top-level element
+        self._nodes = None
+        self._links = None
+        self._ends = None
+        self._index_mapping = None
+        self.index_loaded = self.index_path is not None and self._load_index()
+        if not self.index_loaded:
+            self._index_top_level()
+
+    def close(self):
+        self._nodes = None
+        self._links = None
+        self._ends = None
+        if self._index_mapping is not None:
+            self._index_mapping.close()
+            self._index_mapping = None
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+    def _tag_end(self, start):
+        # End of the "<...>" tag at start; quoted values may contain ">"
+        data = self.data
+        pos = start
+        while True:
+            match = _TAG_END_OR_QUOTE.search(data, pos)
+            if match is None:
+                raise ValueError(f"unexpected end of file inside the tag at byte {start}")
+            if match.group() == b">":
+                return match.end()
+            close = data.find(match.group(), match.end())
+            if close == -1:
+                raise ValueError(f"unterminated attribute value in the tag at byte {start}")
+            pos = close + 1
+
+    def _name(self, start):
+        # Element name of the start or end tag at start
+        pos = start + (2 if self.data[start + 1:start + 2] == b"/" else 1)
+        end = pos
+        while self.data[end:end + 1] not in _NAME_END:
+            end += 1
+        return self.data[pos:end].decode("utf-8")
+
+    def _skip_markup(self, start):
+        # End of a comment / processing instruction / doctype at start, or None
+        data = self.data
+        for opener, closer in ((b"<!--", b"-->"), (b"<?", b"?>"), (b"<!", b">")):
+            if data[start:start + len(opener)] == opener:
+                end = data.find(closer, start)
+                if end == -1:
+                    raise ValueError(f"unterminated markup at byte {start}")
+                return end + len(closer)
+        return None
+
+    def _element_end(self, name, content_start):
+        # End of element `name` whose start tag ends at content_start
+        data = self.data
+        close = b"</" + name.encode("utf-8")
+        pos = content_start
+        while True:
+            found = data.find(close, pos)
+            if found == -1:
+                raise ValueError(f"<{name}> is not closed")
+            after = data[found + len(close):found + len(close) + 1]
+            if after == b">" or (after and after in b" \t\r\n"):
+                return data.find(b">", found) + 1
+            pos = found + len(close)
+
+    def _index_top_level(self):
+        data = self.data
+        pos = 0
+        while True:
+            start = data.find(b"<", pos)
+            if start == -1:
+                if self.root is None:
+                    raise ValueError(f"{self.path} has no root element")
+                raise ValueError(f"<{self.root[0]}> is not closed")
+            end = self._skip_markup(start)
+            if end is not None:
+                pos = end
+                continue
+
+            tag_end = self._tag_end(start)
+            name = self._name(start)
+            if self.root is None:
+                if data[tag_end - 2:tag_end] == b"/>":
+                    self.root = (name, start, tag_end)
+                    return
+                self.root = (name, start, None)
+                pos = tag_end
+                continue
+            if data[start + 1:start + 2] == b"/":
+                self.root = (self.root[0], self.root[1], tag_end)
+                self._root_close = start
+                return
+
+            end = tag_end if data[tag_end - 2:tag_end] == b"/>" else self._element_end(name, tag_end)
+            self.order.append((name, start, end))
+            self.sections.setdefault(name, (start, end))
+            pos = end
+
+    def _content(self, name):
+        # (content start, content end) of a section; empty for "<tag />"
+        start, end = self.sections[name]
+        tag_end = self._tag_end(start)
+        if self.data[tag_end - 2:tag_end] == b"/>":
+            return tag_end, tag_end
+        return tag_end, self.data.rfind(b"</", tag_end, end)
+
+    def section_bytes(self, name):
+        start, end = self.sections[name]
+        return self.data[start:end]
+
+    def section(self, name):
+        # One whole section as an Element; only sensible for small ones
+        return ET.fromstring(self.section_bytes(name))
+
+
+    def _node_index(self):
+        if self._nodes is None:
+            ids, starts, limits = array("I"), array("Q"), array("Q")
+            for name in ("networks", "devices"):
+                if name not in self.sections:
+                    continue
+                content_start, content_end = self._content(name)
+                first = len(starts)
+                for match in _NODE_RECORD.finditer(self.data, content_start, content_end):
+                    ids.append(int(match.group(1)))
+                    starts.append(match.start())
+                # A record runs to the next one of its section
+                limits.extend(starts[first + 1:])
+                if len(starts) > first:
+                    limits.append(content_end)
+
+            order = None
+            if any(ids[i] > ids[i + 1] for i in range(len(ids) - 1)):
+                order = array("Q", sorted(range(len(ids)), key=ids.__getitem__))
+                ids = array("I", [ids[i] for i in order])
+            self._nodes = (ids, starts, limits, order)
+        return self._nodes
+
+    def _node_slot(self, node_id):
+        ids, _, _, order = self._node_index()
+        i = bisect_left(ids, node_id)
+        if i == len(ids) or ids[i] != node_id:
+            return None
+        return order[i] if order is not None else i
+
+    def node_bytes(self, node_id):
+        slot = self._node_slot(node_id)
+        if slot is None:
+            return None
+        _, starts, limits, _ = self._nodes
+        return self.data[starts[slot]:limits[slot]]
+
+    def node(self, node_id):
+        # The <network> / <device> with this ID as an Element, or None
+        record = self.node_bytes(node_id)
+        return ET.fromstring(record) if record is not None else None
+
+    def __contains__(self, node_id):
+        return self._node_slot(node_id) is not None
+
+    def node_count(self):
+        return len(self._node_index()[0])
+
+
+    def _link_index(self):
+        if self._links is None:
+            starts, node1, node2 = array("Q"), array("I"), array("I")
+            if "links" in self.sections:
+                content_start, content_end = self._content("links")
+                for match in _LINK_RECORD.finditer(self.data, content_start, content_end):
+                    starts.append(match.start())
+                    node1.append(int(match.group(1)))
+                    node2.append(int(match.group(2)))
+                starts.append(content_end)
+            self._links = (starts, node1, node2)
+        return self._links
+
+    def link_pairs(self):
+        # (node1, node2) of every link, lazily, without an index
+        if "links" not in self.sections:
+            return
+        content_start, content_end = self._content("links")
+        for match in _LINK_RECORD.finditer(self.data, content_start, content_end):
+            yield int(match.group(1)), int(match.group(2))
+
+    def links(self):
+        # Every <link> as an Element, parsed one at a time, without an index
+        if "links" not in self.sections:
+            return
+        content_start, content_end = self._content("links")
+        previous = None
+        for match in _LINK_RECORD.finditer(self.data, content_start, content_end):
+            if previous is not None:
+                yield ET.fromstring(self.data[previous:match.start()])
+            previous = match.start()
+        if previous is not None:
+            yield ET.fromstring(self.data[previous:content_end])
+
+    def _end_index(self):
+        if self._ends is None:
+            _, node1, node2 = self._link_index()
+            ends = array("I", node1)
+            ends.extend(array("I", node2))
+            # Slot i < links is node1 of link i, slot links + i its node2
+            slots = array("I", sorted(range(len(ends)), key=ends.__getitem__))
+            self._ends = (array("I", map(ends.__getitem__, slots)), slots)
+        return self._ends
+
+    def links_of(self, node_id):
+        # The <link> Elements with node_id at either end, in file order
+        starts, node1, _ = self._link_index()
+        ids, slots = self._end_index()
+        count = len(node1)
+        found = sorted({slot % count for slot in slots[bisect_left(ids, node_id):bisect_right(ids, node_id)]})
+        return [ET.fromstring(self.data[starts[i]:starts[i + 1]]) for i in found]
+
+    def link_count(self):
+        return len(self._link_index()[1])
+
+
+    def _space(self, start):
+        # Indentation unit of the file, from the whitespace before a section
+        line = self.data.rfind(b"\n", 0, start)
+        if line == -1 or self.data[line + 1:start].strip():
+            return None
+        return self.data[line + 1:start].decode("ascii") or None
+
+    ##
+    # Writes the file with one top-level section replaced and everything
+    # else copied from the mapping as it is. replacement is an Element
+    # (indented like the file), pre-rendered str / bytes, or None to drop
+    # the section. A section the file does not have is added after the
+    # sections that come before it in SECTION_ORDER. output_path may be
+    # compressed (see scenario_io) or the indexed file itself, which is
+    # then replaced and mapped again.
+    ##
+    def rewrite_section(self, name, replacement, output_path):
+        data = self.data
+        if name in self.sections:
+            start, end = self.sections[name]
+            space = self._space(start)
+        elif self._root_close is None:
+            raise ValueError(f"<{self.root[0]} /> has no content to add <{name}> to")
+        else:
+            # After the last section that comes before it (or after the root's start tag)
+            later = set(SECTION_ORDER[SECTION_ORDER.index(name) + 1:]) if name in SECTION_ORDER else set()
+            start = end = max((section_end for section_name, _, section_end in self.order if section_name not in later),
+                              default=self._tag_end(self.root[1]))
+            space = self._space(self.order[0][1]) if self.order else "  "
+
+        if replacement is None:
+            text = b""
+            if name in self.sections:
+                # Drop the section with the whitespace in front of it
+                start = len(data[:start].rstrip(b" \t\r\n"))
+        else:
+            if isinstance(replacement, ET.Element):
+                replacement = serialize(replacement, space, 1)
+            if isinstance(replacement, str):
+                replacement = replacement.encode("utf-8", "xmlcharrefreplace")
+            text = replacement
+            if name not in self.sections:
+                text = (("\n" + space).encode() if space is not None else b"") + text
+
+        in_place = os.path.abspath(output_path) == os.path.abspath(self.path)
+        tmp_path = temporary_path(output_path)
+        try:
+            with open_output(tmp_path) as out, memoryview(data) as view:
+                out.write(view[:start])
+                out.write(text)
+                out.write(view[end:])
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if in_place:
+            self.close()
+            self._open()
+
+    def _stamp(self):
+        status = os.stat(self.path)
+        return {"size": status.st_size, "mtime_ns": status.st_mtime_ns}
+
+    def _load_index(self):
+        # Takes the offsets from index_path if it is there and up to date
+        if not os.path.exists(self.index_path):
+            return False
+        header, columns, mapping = read_columns(self.index_path, INDEX_MAGIC, "scenario index", use_mmap=True)
+        if header.get("version") != INDEX_VERSION or header.get("scenario") != self._stamp():
+            columns.clear()
+            if mapping is not None:
+                mapping.close()
+            return False
+
+        self.root = tuple(header["root"])
+        self._root_close = header["root_close"]
+        self.order = [tuple(section) for section in header["order"]]
+        for name, start, end in self.order:
+            self.sections.setdefault(name, (start, end))
+        order = columns["node_order"]
+        self._nodes = (columns["node_ids"], columns["node_starts"], columns["node_limits"], order if len(order) else None)
+        self._links = (columns["link_starts"], columns["link_node1"], columns["link_node2"])
+        self._ends = (columns["end_ids"], columns["end_slots"])
+        self._index_mapping = mapping
+        return True
+
+    ##
+    # Builds the node, link and end indexes, if they are not yet, and writes
+    # them with the section offsets to index_path (default: the one this
+    # index was opened with).
+    ##
+    def save_index(self, index_path=None):
+        index_path = index_path or self.index_path
+        if index_path is None:
+            raise ValueError("no index path to save to")
+        ids, starts, limits, order = self._node_index()
+        link_starts, node1, node2 = self._link_index()
+        end_ids, end_slots = self._end_index()
+        columns = {
+            "node_ids": array("I", ids),
+            "node_starts": array("Q", starts),
+            "node_limits": array("Q", limits),
+            "node_order": array("Q", order if order is not None else []),
+            "link_starts": array("Q", link_starts),
+            "link_node1": array("I", node1),
+            "link_node2": array("I", node2),
+            "end_ids": array("I", end_ids),
+            "end_slots": array("I", end_slots)
+        }
+        header = {
+            "format": "core-scenario-index",
+            "version": INDEX_VERSION,
+            "scenario": self._stamp(),
+            "root": list(self.root),
+            "root_close": self._root_close,
+            "order": [list(section) for section in self.order]
+        }
+        write_columns(index_path, INDEX_MAGIC, header, columns)
+
+    def summary(self):
+        return {
+            "path": self.path,
+            "bytes": len(self.data),
+            "root": self.root[0],
+            "sections": {name: end - start for name, start, end in self.order}
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect a large scenario file without parsing all of it")
+    parser.add_argument("path")
+    parser.add_argument("--node", type=int, action="append", default=[], help="print the record of this node ID")
+    parser.add_argument("--links-of", type=int, metavar="ID", help="print the links of this node ID")
+    parser.add_argument("--count", action="store_true", help="also count nodes and links (indexes them)")
+    parser.add_argument("--index", metavar="PATH",
+                        help="index file to use; written when it is missing or older than the scenario")
+    args = parser.parse_args()
+
+    with ScenarioIndex(args.path, args.index) as scenario:
+        if args.index is not None and not scenario.index_loaded:
+            scenario.save_index()
+        if not args.node and args.links_of is None:
+            summary = scenario.summary()
+            if args.count:
+                summary["nodes"] = scenario.node_count()
+                summary["links"] = scenario.link_count()
+            print(json.dumps(summary, indent=2))
+        for node_id in args.node:
+            record = scenario.node_bytes(node_id)
+            print(bytes(record).decode("utf-8").strip() if record is not None else f"no node {node_id}")
+        if args.links_of is not None:
+            for link in scenario.links_of(args.links_of):
+                print(serialize(link, None))
@@ -0,0 +1,299 @@
+import gzip
+import io
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    import zstandard
+except ImportError:  # optional; the zstd command is used instead if present
+    zstandard = None
+
+###
+# Compressed and piped scenario files.
+#
+# The codec of an output comes from its name, the codec of an input from
+# its first bytes (so a compressed file with a plain name still reads):
+#
+#   *.gz     gzip, stdlib; written without name and mtime so equal
+#            scenarios give equal files
+#   *.zst    Zstandard, through the optional `zstandard` package, or the
+#            `zstd` command when the package is not installed
+#   -        stdout / stdin
+#   else     plain file
+#
+# Scenario XML is a few record shapes repeated millions of times (every
+# link has the same <options>), so either codec shrinks it by well over
+# an order of magnitude. Everything streams: the compressor sees the
+# output as it is written and nothing is held in memory.
+#
+# "-" for output is the process's real stdout (sys.__stdout__). The CLIs
+# send their own messages to stderr while writing there, so the XML can be
+# piped straight into a loader.
+###
+
+STDIO = "-"
+
+SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+_MAGIC = [(b"\x1f\x8b", "gzip"), (b"\x28\xb5\x2f\xfd", "zstd")]
+
+# Default levels: fast settings that still compress scenario XML 15-30x
+DEFAULT_LEVELS = {"gzip": 1, "zstd": 3}
+
+_BUFFER_SIZE = 1 << 20
+
+
+def output_codec(path):
+    # "gzip", "zstd" or None (plain file or stdout), from the name
+    if path == STDIO:
+        return None
+    return SUFFIXES.get(os.path.splitext(path)[1].lower())
+
+
+def temporary_path(path):
+    # Name to write path under before renaming it, with the same codec:
+    # "a.xml.gz" -> "a.xml.<pid>.tmp.gz"
+    root, suffix = os.path.splitext(path)
+    if suffix.lower() not in SUFFIXES:
+        root, suffix = path, ""
+    return f"{root}.{os.getpid()}.tmp{suffix}"
+
+
+def sniff_codec(head):
+    # Codec of data starting with `head`, or None
+    for magic, codec in _MAGIC:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def _zstd_command():
+    command = shutil.which("zstd")
+    if command is None:
+        raise ValueError("zstd files need the zstandard package or the zstd command")
+    return command
+
+
+class _ProcessWriter(io.RawIOBase):
+    # Writes into the stdin of a compressor process; close() waits for it
+
+    def __init__(self, args, target):
+        self.target = target
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=target)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.process.stdin.write(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                raise OSError(f"{self.process.args[0]} exited with status {self.process.returncode}")
+        finally:
+            self.target.close()
+            super().close()
+
+
+class _ProcessReader(io.RawIOBase):
+    # Reads the stdout of a decompressor process
+
+    def __init__(self, args):
+        self.process = subprocess.Popen(args, stdout=subprocess.PIPE)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.process.stdout.readinto(buffer)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.process.stdout.close()
+            if self.process.wait() not in (0, -13):  # -13: SIGPIPE after an early close
+                raise OSError(f"{self.process.args[0]} exited with status {self.process.returncode}")
+        finally:
+            super().close()
+
+
+class _StdStream(io.RawIOBase):
+    # stdout / stdin that is flushed instead of closed
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def writable(self):
+        return self.stream.writable()
+
+    def readable(self):
+        return self.stream.readable()
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def readinto(self, buffer):
+        return self.stream.readinto(buffer)
+
+    def close(self):
+        if not self.closed:
+            if self.stream.writable():
+                self.stream.flush()
+            super().close()
+
+
+def _compress(raw, codec, level):
+    # Wraps the binary file `raw` in a streaming compressor
+    if codec == "gzip":
+        return gzip.GzipFile("", "wb", level, raw, mtime=0), raw
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).stream_writer(raw, closefd=True), None
+    return io.BufferedWriter(_ProcessWriter([_zstd_command(), "-q", "-c", f"-{level}"], raw), _BUFFER_SIZE), None
+
+
+##
+# Binary file object to write `path` through its codec (see output_codec).
+# Closing it finishes the compressed stream and closes the file; stdout is
+# only flushed. level overrides DEFAULT_LEVELS.
+##
+def open_output(path, level=None):
+    codec = output_codec(path)
+    if path == STDIO:
+        raw = _StdStream(sys.__stdout__.buffer)
+    else:
+        raw = open(path, "wb", buffering=_BUFFER_SIZE if codec is None else 0)
+    if codec is None:
+        return raw if path != STDIO else io.BufferedWriter(raw, _BUFFER_SIZE)
+
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    stream, owned = _compress(raw, codec, level)
+    if owned is not None:
+        # GzipFile never closes a file object it was given
+        return _Closing(stream, owned)
+    return stream
+
+
+class _Closing(io.BufferedIOBase):
+    # A compressor stream that also closes the file underneath it
+
+    def __init__(self, stream, raw):
+        self.stream = stream
+        self.raw = raw
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def flush(self):
+        if not self.stream.closed:
+            self.stream.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.stream.close()
+        finally:
+            self.raw.close()
+            super().close()
+
+
+def open_text_output(path, level=None):
+    # open_output() as UTF-8 text with the newline and error handling of
+    # ElementTree.write(path, encoding="UTF-8")
+    binary = open_output(path, level)
+    if not isinstance(binary, io.BufferedWriter):
+        # Compressors get large blocks, not the text layer's 8 KB ones
+        binary = io.BufferedWriter(binary, _BUFFER_SIZE)
+    return io.TextIOWrapper(binary, encoding="utf-8", errors="xmlcharrefreplace", newline="\n")
+
+
+##
+# Binary file object reading `path` ("-" for stdin), decompressed when its
+# first bytes are a gzip or Zstandard header.
+##
+def open_input(path):
+    if path == STDIO:
+        f = sys.stdin.buffer
+        codec = sniff_codec(f.peek(4)[:4])
+        raw = _StdStream(f)
+        if codec is None:
+            return io.BufferedReader(raw, _BUFFER_SIZE)
+    else:
+        f = open(path, "rb", buffering=_BUFFER_SIZE)
+        codec = sniff_codec(f.peek(4)[:4])
+        if codec is None:
+            return f
+        raw = f
+
+    if codec == "gzip":
+        return _ClosingReader(gzip.GzipFile(fileobj=raw, mode="rb"), raw)
+    if zstandard is not None:
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), _BUFFER_SIZE)
+    if path == STDIO:
+        raise ValueError("reading zstd from stdin needs the zstandard package")
+    raw.close()
+    return io.BufferedReader(_ProcessReader([_zstd_command(), "-q", "-d", "-c", path]), _BUFFER_SIZE)
+
+
+class _ClosingReader(io.BufferedIOBase):
+    # A decompressor stream that also closes the file underneath it
+
+    def __init__(self, stream, raw):
+        self.stream = stream
+        self.raw = raw
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def read1(self, size=-1):
+        return self.stream.read1(size)
+
+    def readinto(self, buffer):
+        return self.stream.readinto(buffer)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.stream.close()
+        finally:
+            self.raw.close()
+            super().close()
+
+
+def is_compressed(path):
+    # True if the file at path starts with a gzip or Zstandard header
+    if path == STDIO:
+        return False
+    with open(path, "rb") as f:
+        return sniff_codec(f.read(4)) is not None
+
+
+def map_input(path):
+    # Read-only mmap of a scenario file, for edits that copy most of it
+    # through; a compressed file is first decompressed into an unnamed
+    # temporary file next to it (on disk, not in memory). Raises
+    # ValueError for an empty file.
+    if not is_compressed(path):
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with open_input(path) as source, tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as copy:
+        shutil.copyfileobj(source, copy, _BUFFER_SIZE)
+        copy.flush()
+        return mmap.mmap(copy.fileno(), 0, access=mmap.ACCESS_READ)
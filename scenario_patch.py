@@ -0,0 +1,186 @@
+import io
+import re
+from itertools import chain
+from emitters import escape_attrib
+from scenario_writer import indentation, serialize
+
+###
+# In-place edits of a written scenario file, at the byte level.
+#
+# update_scenario in createXmlV2 removes and appends a handful of records
+# in sections that may hold millions. Parsing and re-serializing the whole
+# tree for that costs far more than the change itself, so ScenarioPatch
+# works on the file bytes instead: sections and records are found by their
+# indentation (every record of a section starts on its own line, two
+# levels deep, as ScenarioWriter and ET.indent lay them out), removed
+# records are cut out, and new records are spliced in before the closing
+# tag of their section. Everything else is copied through untouched:
+# data may be an mmap of the file (see scenario_io.map_input), and write()
+# streams the unchanged byte ranges from it between the edits, so a patch
+# costs memory for the edits only.
+###
+
+# Top-level sections in document order
+SECTION_ORDER = [
+    "networks", "devices", "links", "configservice_configurations", "mobility_configurations",
+    "session_origin", "session_options", "session_metadata", "default_services"
+]
+
+_CANVAS = re.compile(rb'(<configuration name="canvas" value=")[^"]*(")')
+
+
+class SectionBuffer:
+    # Collects the records appended to one section; accepts the same
+    # append() / splice() calls as a SectionWriter
+
+    def __init__(self, space, level):
+        self.space = space
+        self.level = level
+        self.parts = []
+
+    def append(self, elem):
+        self.parts.append(indentation(self.space, self.level) + serialize(elem, self.space, self.level))
+
+    def extend(self, elems):
+        for elem in elems:
+            self.append(elem)
+
+    def splice(self, fragment):
+        self.parts.append(fragment)
+
+    def __bool__(self):
+        return bool(self.parts)
+
+
+class ScenarioPatch:
+
+    def __init__(self, data, space="  "):
+        self.data = data
+        self.space = space
+        self.buffers = {}   # section tag -> SectionBuffer of new records
+        self.cuts = []      # (start, end) byte ranges to drop
+        self.emptied = set()  # sections that lost every record
+        self.canvas = None
+
+        indent = ("\n" + space * 2).encode()
+        self._record_start = re.compile(re.escape(indent) + rb"<(?!/)")
+
+    def _find_section(self, tag):
+        # (start, content_start, close_start, end) of a top-level section;
+        # content_start is None for an empty "<tag />"
+        indent = ("\n" + self.space).encode()
+        head = indent + b"<" + tag.encode()
+
+        start = self.data.find(head + b">")
+        if start != -1:
+            content_start = start + len(head) + 1
+            close = indent + b"</" + tag.encode() + b">"
+            close_start = self.data.find(close, content_start)
+            if close_start == -1:
+                raise ValueError(f"<{tag}> is not closed")
+            return start, content_start, close_start, close_start + len(close)
+
+        start = self.data.find(head + b" />")
+        if start != -1:
+            end = start + len(head) + 3
+            return start, None, end, end
+        return None
+
+    def has_section(self, tag):
+        return self._find_section(tag) is not None
+
+    def section(self, tag):
+        # Buffer for new records of a top-level section
+        if tag not in self.buffers:
+            self.buffers[tag] = SectionBuffer(self.space, 2)
+        return self.buffers[tag]
+
+    def remove_records(self, tag, header, drop):
+        # Cuts every record of section `tag` whose first line matches the
+        # regex `header` (bytes) and for which drop(match) is true
+        found = self._find_section(tag)
+        if found is None or found[1] is None:
+            return 0
+        _, content_start, close_start, _ = found
+
+        header = re.compile(header)
+        skip = 1 + 2 * len(self.space)
+        records = removed = 0
+        pos = None
+        # A record runs to the start of the next one (or the closing tag)
+        for end in chain((m.start() for m in self._record_start.finditer(self.data, content_start, close_start)),
+                         [close_start]):
+            if pos is not None:
+                records += 1
+                match = header.match(self.data, pos + skip, end)
+                if match and drop(match):
+                    self.cuts.append((pos, end))
+                    removed += 1
+            pos = end
+        if removed == records:
+            self.emptied.add(tag)
+        return removed
+
+    def set_canvas(self, value):
+        self.canvas = value
+
+    def _edits(self):
+        # (start, end, replacement bytes) of every change, in file order
+        edits = [(start, end, b"") for start, end in self.cuts]
+
+        for tag in self.emptied - {tag for tag, buffer in self.buffers.items() if buffer}:
+            # Same "<links />" a full build writes for an empty section
+            start, _, _, end = self._find_section(tag)
+            edits.append((start, end, f"\n{self.space}<{tag} />".encode()))
+
+        for tag, buffer in self.buffers.items():
+            if not buffer:
+                continue
+            text = "".join(buffer.parts).encode("utf-8", "xmlcharrefreplace")
+            found = self._find_section(tag)
+            indent = "\n" + self.space
+
+            if found is None:
+                # Missing section: goes after the last section that precedes it
+                at = self.data.rfind(b"\n</")
+                for earlier in reversed(SECTION_ORDER[:SECTION_ORDER.index(tag)]):
+                    earlier_found = self._find_section(earlier)
+                    if earlier_found is not None:
+                        at = earlier_found[3]
+                        break
+                edits.append((at, at, f"{indent}<{tag}>".encode() + text + f"{indent}</{tag}>".encode()))
+
+            elif found[1] is None:
+                # "<tag />" becomes a full section
+                edits.append((found[0], found[3], f"{indent}<{tag}>".encode() + text + f"{indent}</{tag}>".encode()))
+
+            else:
+                edits.append((found[2], found[2], text))
+
+        if self.canvas is not None:
+            metadata = self._find_section("session_metadata")
+            if metadata is not None and metadata[1] is not None:
+                match = _CANVAS.search(self.data, metadata[1], metadata[2])
+                if match:
+                    value = escape_attrib(self.canvas)
+                    edits.append((match.start(), match.end(),
+                                  match.group(1) + value.encode("utf-8") + match.group(2)))
+
+        edits.sort(key=lambda edit: (edit[0], edit[1]))
+        return edits
+
+    def write(self, out):
+        # Writes the patched file to the binary stream out
+        pos = 0
+        with memoryview(self.data) as view:
+            for start, end, text in self._edits():
+                out.write(view[pos:start])
+                out.write(text)
+                pos = max(pos, end)
+            out.write(view[pos:])
+
+    def render(self):
+        # The patched file as bytes
+        out = io.BytesIO()
+        self.write(out)
+        return out.getvalue()
@@ -0,0 +1,267 @@
+import xml.etree.ElementTree as ET
+from emitters import escape_attrib, needs_escape
+from scenario_io import open_text_output
+
+###
+# Incremental writer for CORE scenario XML.
+#
+# Produces the same bytes as building the whole <scenario> tree, running
+# ET.indent(tree, space="  ") over it and calling tree.write(...), but each
+# element is serialized and written as soon as it is appended, so the
+# scenario never has to exist in memory as a whole.
+#
+# Elements are serialized by serialize(), which writes the indentation
+# ET.indent would have put into text / tails as it goes instead of
+# mutating the tree first. space=None writes compact output: no
+# indentation at all, the same bytes as tree.write without ET.indent.
+###
+
+# Parts collected before write_tree hands them to the file
+_FLUSH_PARTS = 1 << 14
+
+
+def indentation(space, level):
+    # Whitespace in front of an element at depth `level`
+    return "" if space is None else "\n" + space * level
+
+
+def _escape_text(text):
+    # Same replacements as ElementTree's text escaping
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def _start(elem):
+    # "<tag a="b"", attribute values escaped. One search over all values
+    # finds the (rare) elements that need escaping at all.
+    attrib = elem.attrib
+    if not attrib:
+        return "<" + elem.tag
+    if needs_escape("".join(attrib.values())):
+        return "<" + elem.tag + "".join([f' {key}="{escape_attrib(value)}"' for key, value in attrib.items()])
+    return "<" + elem.tag + "".join([f' {key}="{value}"' for key, value in attrib.items()])
+
+
+def _serialize(elem, parts, indents, level, flush=None):
+    # Appends the text of elem (without its tail) to parts. Indentation
+    # follows ET.indent: whitespace-only text and tails of elements with
+    # children are replaced, anything else is kept. indents[level] is the
+    # whitespace in front of an element at that depth (None: compact).
+    head = _start(elem)
+    text = elem.text
+
+    if not len(elem):
+        if text:
+            parts.append(f"{head}>{_escape_text(text)}</{elem.tag}>")
+        else:
+            parts.append(head + " />")
+        return
+
+    if indents is None:
+        inner = outer = None
+        parts.append(head + ">" + _escape_text(text) if text else head + ">")
+    else:
+        if len(indents) <= level + 1:
+            indents.append(indents[-1] + indents[1][1:])
+        inner, outer = indents[level + 1], indents[level]
+        if not text or not text.strip():
+            parts.append(head + ">" + inner)
+        else:
+            parts.append(head + ">" + _escape_text(text))
+
+    remaining = len(elem)
+    for child in elem:
+        _serialize(child, parts, indents, level + 1)
+        remaining -= 1
+        tail = child.tail
+        if tail and (inner is None or tail.strip()):
+            parts.append(_escape_text(tail))
+        elif inner is not None:
+            parts.append(inner if remaining else outer)
+        if flush is not None and len(parts) >= _FLUSH_PARTS:
+            flush()
+    parts.append(f"</{elem.tag}>")
+
+
+def _indents(space, level):
+    # indents list for _serialize, long enough for level + 1
+    if space is None:
+        return None
+    return ["\n" + space * depth for depth in range(max(level + 2, 2))]
+
+
+def serialize(elem, space="  ", level=0):
+    # Text of one element as ET.indent(elem, space, level) followed by
+    # ET.tostring would give it (the element's own tail is left out).
+    # Plain elements only: no namespaces, comments or processing
+    # instructions, as everywhere in CORE scenarios.
+    parts = []
+    _serialize(elem, parts, _indents(space, level), level)
+    return "".join(parts)
+
+
+def write_tree(path, root, space="  "):
+    # Writes a whole in-memory tree; same bytes as ET.indent(tree, space)
+    # plus tree.write(path, encoding="UTF-8", xml_declaration=True), but
+    # in one pass and without touching the tree. path may be compressed or
+    # "-" (see scenario_io)
+    with open_text_output(path) as file:
+        file.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        parts = []
+
+        def flush():
+            file.write("".join(parts))
+            parts.clear()
+
+        _serialize(root, parts, _indents(space, 0), 0, flush)
+        flush()
+
+
+def start_tag(tag, attrib):
+    # Let ElementTree do the attribute escaping: "<tag a="b" />" -> "<tag a="b">"
+    empty = ET.tostring(ET.Element(tag, attrib or {}), encoding="unicode")
+    return empty[:-3] + ">"
+
+
+class ScenarioWriter:
+
+    def __init__(self, file, root_tag="scenario", root_attrib=None, space="  ", close_file=False):
+        # file is any text stream opened for writing (see open_scenario_writer);
+        # space=None writes compact output
+        self.file = file
+        self.close_file = close_file
+        self.space = space
+        self.root_tag = root_tag
+        self.root_attrib = root_attrib or {}
+        self.has_children = False
+        self.closed = False
+
+        self.file.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+
+    def _open_root(self):
+        if not self.has_children:
+            self.file.write(start_tag(self.root_tag, self.root_attrib))
+            self.has_children = True
+
+    def _write_element(self, elem, level):
+        # The (small) element subtree, indented for its final depth
+        self.file.write(indentation(self.space, level) + serialize(elem, self.space, level))
+
+    def append(self, elem):
+        # Writes a complete top-level element such as <session_origin>
+        self._open_root()
+        self._write_element(elem, 1)
+
+    def splice(self, fragment):
+        # Writes pre-rendered top-level text, e.g. basic_core_structure.static_fragment()
+        self._open_root()
+        self.file.write(fragment)
+
+    def section(self, tag, attrib=None):
+        # Opens a top-level section such as <networks> that children are streamed into
+        self._open_root()
+        return SectionWriter(self, tag, attrib, 1)
+
+    def close(self):
+        if self.closed:
+            return
+        if self.has_children:
+            self.file.write(f"{indentation(self.space, 0)}</{self.root_tag}>")
+        else:
+            self.file.write(start_tag(self.root_tag, self.root_attrib)[:-1] + " />")
+        self.closed = True
+        if self.close_file:
+            self.file.close()
+
+    def abort(self):
+        # Stops writing without closing the open elements: an unfinished
+        # document must not look like a complete (smaller) scenario
+        if self.closed:
+            return
+        self.closed = True
+        if self.close_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class SectionWriter:
+
+    def __init__(self, writer, tag, attrib, level):
+        self.writer = writer
+        self.tag = tag
+        self.attrib = attrib or {}
+        self.level = level
+        self.has_children = False
+        self.closed = False
+
+    def append(self, elem):
+        if not self.has_children:
+            self.writer.file.write(indentation(self.writer.space, self.level) + start_tag(self.tag, self.attrib))
+            self.has_children = True
+        self.writer._write_element(elem, self.level + 1)
+
+    def splice(self, fragment):
+        # Writes pre-rendered child records, e.g. from emitters.TemplateEmitter
+        if not self.has_children:
+            self.writer.file.write(indentation(self.writer.space, self.level) + start_tag(self.tag, self.attrib))
+            self.has_children = True
+        self.writer.file.write(fragment)
+
+    def extend(self, elems):
+        for elem in elems:
+            self.append(elem)
+
+    def close(self):
+        if self.closed:
+            return
+        indent = indentation(self.writer.space, self.level)
+        if self.has_children:
+            self.writer.file.write(f"{indent}</{self.tag}>")
+        else:
+            # Empty sections serialize as "<links />", same as ElementTree
+            self.writer.file.write(indent + start_tag(self.tag, self.attrib)[:-1] + " />")
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        return False
+
+
+def open_scenario_writer(path, root_attrib=None, space="  "):
+    # Same newline / encoding behaviour as ElementTree.write(path, encoding="UTF-8");
+    # path may be compressed or "-" (see scenario_io)
+    file = open_text_output(path)
+    return ScenarioWriter(file, root_attrib=root_attrib, space=space, close_file=True)
+
+
+##
+# Helpers so the same building code can target an in-memory Element
+# or a ScenarioWriter / SectionWriter.
+##
+def open_section(parent, tag, attrib=None):
+    if isinstance(parent, ET.Element):
+        return ET.SubElement(parent, tag, attrib or {})
+    return parent.section(tag, attrib)
+
+
+def close_section(section):
+    if not isinstance(section, ET.Element):
+        section.close()
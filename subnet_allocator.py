@@ -0,0 +1,167 @@
+import ipaddress
+
+###
+# Subnet allocator for link addressing.
+#
+# The IPv4 and IPv6 bases are parsed once into integers. Subnet index k is
+# the k-th IPv4 block (/24 by default) and the k-th IPv6 block (/64 by
+# default) after the base, so blocks spill across octets naturally instead
+# of producing addresses like 192.168.300.1.
+#
+# Allocation is O(1): released indices go on a free list, otherwise a
+# high-water mark advances past anything reserved in the bitmap.
+###
+
+
+def _ip6_text(value):
+    # Same text as str(ipaddress.IPv6Address(value)) without building the
+    # object: the longest run of two or more zero hextets (the leftmost on
+    # a tie) becomes "::"
+    hextets = [(value >> shift) & 0xFFFF for shift in range(112, -16, -16)]
+
+    best_start = best_len = 0
+    run_start = run_len = 0
+    for i, hextet in enumerate(hextets):
+        if hextet:
+            run_len = 0
+            continue
+        if not run_len:
+            run_start = i
+        run_len += 1
+        if run_len > best_len:
+            best_start, best_len = run_start, run_len
+
+    if best_len < 2:
+        return ":".join(f"{h:x}" for h in hextets)
+    head = ":".join(f"{h:x}" for h in hextets[:best_start])
+    tail = ":".join(f"{h:x}" for h in hextets[best_start + best_len:])
+    return f"{head}::{tail}"
+
+
+class SubnetAllocator:
+
+    def __init__(self, ip4_base, ip6_base, ip4_prefix=24, ip6_prefix=64):
+        ip4_network = ipaddress.IPv4Network(f"{ip4_base}/{ip4_prefix}", strict=False)
+        ip6_network = ipaddress.IPv6Network(f"{ip6_base}/{ip6_prefix}", strict=False)
+
+        self.ip4_prefix = ip4_prefix
+        self.ip6_prefix = ip6_prefix
+        self.ip4_mask = str(ip4_prefix)
+        self.ip6_mask = str(ip6_prefix)
+
+        self.ip4_start = int(ip4_network.network_address)
+        self.ip6_start = int(ip6_network.network_address)
+        self.ip4_size = ip4_network.num_addresses
+        self.ip6_size = ip6_network.num_addresses
+
+        # Number of whole blocks left in each address space after the base
+        self.capacity = min(
+            (2 ** 32 - self.ip4_start) // self.ip4_size,
+            (2 ** 128 - self.ip6_start) // self.ip6_size
+        )
+
+        self._used = bytearray()   # 1 = allocated or reserved, grown on demand
+        self._next = 0             # every index below this has been handed out once
+        self._free = []            # released indices, reused LIFO
+        self.allocated = 0
+
+        self._ip6_cached = None   # subnet index whose IPv6 prefix text is cached
+        self._ip6_prefix = ""
+
+    def _is_used(self, index):
+        return index < len(self._used) and self._used[index]
+
+    def _mark(self, index, value):
+        if index >= len(self._used):
+            self._used.extend(bytes(max(index + 1 - len(self._used), len(self._used))))
+        self._used[index] = value
+
+    def allocate(self):
+        # Returns the index of a free subnet
+        while self._free:
+            index = self._free.pop()
+            if not self._is_used(index):  # may have been reserved after release
+                self._mark(index, 1)
+                self.allocated += 1
+                return index
+
+        while self._is_used(self._next):
+            self._next += 1
+        if self._next >= self.capacity:
+            raise ValueError(f"Subnet space exhausted after {self.capacity} /{self.ip4_prefix} blocks")
+
+        index = self._next
+        self._next += 1
+        self._mark(index, 1)
+        self.allocated += 1
+        return index
+
+    def reserve(self, start, count=1):
+        # Marks subnet indices [start, start + count) as taken
+        if start < 0 or start + count > self.capacity:
+            raise ValueError(f"Subnet range {start}..{start + count - 1} is outside the address space")
+        for index in range(start, start + count):
+            if self._is_used(index):
+                raise ValueError(f"Subnet {index} is already allocated")
+        for index in range(start, start + count):
+            self._mark(index, 1)
+        self.allocated += count
+
+    def reserve_network(self, cidr):
+        # Reserves every block overlapping an IPv4 network such as "192.168.7.0/24"
+        network = ipaddress.IPv4Network(cidr, strict=False)
+        first = (int(network.network_address) - self.ip4_start) // self.ip4_size
+        last = (int(network.broadcast_address) - self.ip4_start) // self.ip4_size
+        self.reserve(first, last - first + 1)
+
+    def release(self, start, count=1):
+        for index in range(start, start + count):
+            if not self._is_used(index):
+                raise ValueError(f"Subnet {index} is not allocated")
+            self._used[index] = 0
+            self._free.append(index)
+        self.allocated -= count
+
+    def is_allocated(self, index):
+        return bool(self._is_used(index))
+
+    def snapshot(self):
+        # Plain-data copy of the allocation state (see builder_state.py)
+        return {
+            "used": bytes(self._used),
+            "next": self._next,
+            "free": list(self._free),
+            "allocated": self.allocated
+        }
+
+    def restore(self, snapshot):
+        self._used = bytearray(snapshot["used"])
+        self._next = snapshot["next"]
+        self._free = list(snapshot["free"])
+        self.allocated = snapshot["allocated"]
+
+    def ip4_address(self, index, host):
+        if not 0 < host < self.ip4_size - 1:
+            raise ValueError(f"Host {host} does not fit in a /{self.ip4_prefix} subnet")
+        n = self.ip4_start + index * self.ip4_size + host
+        return f"{n >> 24}.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+
+    def ip6_address(self, index, host):
+        if not 0 < host < 0x10000 or self.ip6_size < 0x10000:
+            return str(ipaddress.IPv6Address(self.ip6_start + index * self.ip6_size + host))
+
+        # Hosts 1..ffff only change the last hextet, and the zero run that
+        # "::" compresses is the same for all of them, so everything before
+        # that hextet is formatted once per subnet (links ask for one subnet
+        # several times in a row)
+        if self._ip6_cached != index:
+            first = _ip6_text(self.ip6_start + index * self.ip6_size + 1)
+            self._ip6_cached = index
+            self._ip6_prefix = first[:first.rindex(":") + 1]
+        return f"{self._ip6_prefix}{host:x}"
+
+    def ip4_network(self, index):
+        return ipaddress.IPv4Network((self.ip4_start + index * self.ip4_size, self.ip4_prefix))
+
+    def ip6_network(self, index):
+        return ipaddress.IPv6Network((self.ip6_start + index * self.ip6_size, self.ip6_prefix))
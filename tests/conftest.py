@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+
+import pytest
+
+###
+# The modules live at the top of the repository, next to this directory.
+#
+# data/ holds small scenario configs with the XML createXmlV2 writes for
+# them (<name>.json, <name>.xml). The XML is a snapshot of the current
+# output (subnet allocator addresses, clustered layout), not of the
+# original generator: it pins every backend and output path to the same
+# bytes, so regenerate it when the output is meant to change.
+###
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, "tests", "data")
+
+sys.path.insert(0, ROOT)
+
+SCENARIOS = sorted(name[:-5] for name in os.listdir(DATA) if name.endswith(".json"))
+
+
+def load_config(name):
+    with open(os.path.join(DATA, name + ".json")) as f:
+        return json.load(f)
+
+
+def expected_xml(name):
+    with open(os.path.join(DATA, name + ".xml"), "rb") as f:
+        return f.read()
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture(params=SCENARIOS)
+def scenario(request):
+    # (name, config) of every scenario in data/
+    return request.param, load_config(request.param)
@@ -0,0 +1,29 @@
+import json
+import os
+
+import pytest
+
+from conftest import load_config
+from batch_generate import load_tasks, run_batch
+
+
+@pytest.mark.parametrize("name", ["../x", "/abs", "a/b", "a\\b", "..", "", 5])
+def test_names_outside_the_output_directory_are_rejected(tmp_path, name):
+    source = tmp_path / "campaign.jsonl"
+    source.write_text(json.dumps(dict(load_config("mixed_deterministic"), name="fine")) + "\n" +
+                      json.dumps(dict(load_config("mixed_deterministic"), name=name)) + "\n")
+    with pytest.raises(ValueError, match="campaign.jsonl:2"):
+        load_tasks(str(source))
+    with pytest.raises(ValueError, match="not a plain file name"):
+        run_batch([(name, load_config("mixed_deterministic"), None)], str(tmp_path / "out"))
+    assert not os.path.exists(tmp_path / "out")
+
+
+def test_batches_write_one_file_per_task(tmp_path):
+    source = tmp_path / "campaign.jsonl"
+    source.write_text("".join(json.dumps(dict(load_config(name), name=name)) + "\n"
+                              for name in ("mixed_deterministic", "larger_deterministic")))
+    manifest = run_batch(load_tasks(str(source)), str(tmp_path / "out"), workers=2)
+    assert manifest["generated"] == 2 and manifest["failed"] == 0
+    assert sorted(os.listdir(tmp_path / "out")) == ["larger_deterministic.xml", "manifest.json",
+                                                     "mixed_deterministic.xml"]
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+import scenario_cache
+from createXmlV2 import build_scenario
+from scenario_cache import ScenarioCache
+from validation import TopologyError
+
+
+def store_all(cache, tmp_path, count, size):
+    generated = tmp_path / "generated.xml"
+    for i in range(count):
+        generated.write_bytes(bytes([i % 256]) * size)
+        cache.store(f"{i:064x}", str(generated))
+
+
+def test_stores_do_not_scan_the_cache(tmp_path, monkeypatch):
+    cache = ScenarioCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda: scans.append(1) or entries())
+
+    store_all(cache, tmp_path, 50, 100)
+    assert len(scans) == 1
+    assert cache.stats()["bytes"] == cache._size() == 5000
+
+
+def test_full_caches_evict_the_least_recently_used(tmp_path):
+    cache = ScenarioCache(str(tmp_path / "cache"), max_bytes=1000)
+    store_all(cache, tmp_path, 30, 100)
+
+    stats = cache.stats()
+    assert stats["bytes"] == cache._size() <= 1000
+    assert stats["evict"] == 30 - stats["objects"]
+    assert os.path.exists(cache.path(f"{29:064x}"))
+    assert not os.path.exists(cache.path(f"{0:064x}"))
+
+
+def test_other_processes_count_what_is_already_stored(tmp_path):
+    store_all(ScenarioCache(str(tmp_path / "cache")), tmp_path, 5, 100)
+    scenario_cache._SIZES.clear()  # as in a fresh process
+
+    cache = ScenarioCache(str(tmp_path / "cache"), max_bytes=550)
+    store_all(cache, tmp_path, 1, 100)  # the first object again
+    assert cache._size() == 500
+    (tmp_path / "new.xml").write_bytes(b"x" * 100)
+    cache.store("f" * 64, str(tmp_path / "new.xml"))
+    assert cache._size() == cache.stats()["bytes"] <= 550 * scenario_cache.LOW_WATER
+
+
+def test_validated_builds_do_not_use_the_cache(tmp_path):
+    cache = ScenarioCache(str(tmp_path / "cache"))
+    config = {"devices": {"router": 3}, "links": [[1, 2], [2, 2]]}
+    path = str(tmp_path / "out.xml")
+    assert build_scenario(config, path, cache=cache) is not None
+    assert build_scenario(config, path, cache=cache) is None  # a hit
+
+    with pytest.raises(TopologyError):
+        build_scenario(config, path, cache=cache, validate=True)
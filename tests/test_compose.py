@@ -0,0 +1,60 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import compose
+from conftest import DATA, load_config
+from createXmlV2 import build_scenario
+
+
+def region_file(tmp_path, name, devices):
+    path = str(tmp_path / f"{name}.xml")
+    build_scenario({"devices": devices, "autogenerate_links": True, "deterministic_links": True}, path)
+    return path
+
+
+def test_regions_are_read_without_keeping_the_records(monkeypatch, scenario):
+    name, _ = scenario
+    roots = []
+    iterparse = ET.iterparse
+
+    def recording_iterparse(source, events=None):
+        # The root is the last element to end
+        for event, elem in iterparse(source, events):
+            yield event, elem
+        roots.append(elem)
+
+    monkeypatch.setattr(compose.ET, "iterparse", recording_iterparse)
+    region = compose.load_region(f"{DATA}/{name}.xml")
+
+    root = ET.parse(f"{DATA}/{name}.xml").getroot()
+    records = [record for section in ("networks", "devices") for record in root.find(section)]
+    assert len(region.registry) == len(records)
+    assert region.connections == [(int(link.get("node1")), int(link.get("node2"))) for link in root.find("links")]
+    assert len(roots[0]) == 0
+
+
+def test_regions_without_routers_are_reported(tmp_path, capsys):
+    regions = [region_file(tmp_path, "a", {"router": 2, "PC": 2}), region_file(tmp_path, "b", {"PC": 3}),
+               region_file(tmp_path, "c", {"router": 1, "PC": 1})]
+    report = compose.compose(regions, str(tmp_path / "out.xml"), inter_region="ring")
+
+    assert report["skipped_region_pairs"] == [[0, 1], [1, 2]]
+    assert len(report["inter_region_links"]) == 1
+    assert capsys.readouterr().out == ""
+
+
+def test_requested_pairs_without_routers_raise(tmp_path):
+    regions = [region_file(tmp_path, "a", {"router": 2}), region_file(tmp_path, "b", {"PC": 3})]
+    with pytest.raises(ValueError, match="regions 0 and 1"):
+        compose.compose(regions, str(tmp_path / "out.xml"), inter_region="0-1")
+
+
+def test_composed_regions_keep_their_nodes(tmp_path):
+    regions = [f"{DATA}/mixed_deterministic.xml", f"{DATA}/larger_deterministic.xml"]
+    report = compose.compose(regions, str(tmp_path / "out.xml"), inter_region="chain")
+    expected = sum(sum(load_config(name)["devices"].values()) for name in ("mixed_deterministic", "larger_deterministic"))
+    assert report["nodes"] == expected
+    assert report["skipped_region_pairs"] == []
+    root = ET.parse(str(tmp_path / "out.xml")).getroot()
+    assert len(root.find("networks")) + len(root.find("devices")) == expected
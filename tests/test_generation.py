@@ -0,0 +1,115 @@
+import gzip
+import shutil
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from conftest import expected_xml, load_config, read_bytes
+from attachment import CapacityPool, attach
+from benchmark import _legacy_generate_random_links, make_builder
+from createXmlV2 import build_scenario
+from link_index import LinkIndex
+from network_builder import NetworkBuilder
+from scenario_io import open_input, zstandard
+from scenario_writer import open_scenario_writer
+
+# (streaming, backend) combinations createXmlV2 offers
+BACKENDS = [(False, "etree"), (True, "etree"), (True, "template")]
+
+
+@pytest.mark.parametrize("streaming, backend", BACKENDS)
+def test_backends_write_the_reference_bytes(tmp_path, scenario, streaming, backend):
+    name, config = scenario
+    path = str(tmp_path / "out.xml")
+    build_scenario(config, path, streaming=streaming, backend=backend)
+    assert read_bytes(path) == expected_xml(name)
+
+
+@pytest.mark.parametrize("streaming, backend", BACKENDS)
+def test_failed_builds_leave_the_previous_file(tmp_path, monkeypatch, streaming, backend):
+    path = str(tmp_path / "out.xml")
+    build_scenario(load_config("mixed_deterministic"), path)
+
+    def fail(self, parent):
+        raise RuntimeError("builder failed")
+
+    # After the links are written, before the root is closed
+    monkeypatch.setattr(NetworkBuilder, "add_configservice_configurations", fail)
+    with pytest.raises(RuntimeError):
+        build_scenario(load_config("larger_deterministic"), path, streaming=streaming, backend=backend)
+    assert read_bytes(path) == expected_xml("mixed_deterministic")
+    assert [entry.name for entry in tmp_path.iterdir()] == ["out.xml"]
+
+
+def test_aborted_writers_leave_the_document_open(tmp_path):
+    path = str(tmp_path / "out.xml")
+    with pytest.raises(RuntimeError):
+        with open_scenario_writer(path) as writer:
+            writer.section("links").append(ET.Element("link", {"node1": "1", "node2": "2"}))
+            raise RuntimeError
+    assert not read_bytes(path).endswith(b"</scenario>")
+
+
+@pytest.mark.parametrize("streaming, backend", BACKENDS)
+def test_compact_output_is_the_indented_tree_without_whitespace(tmp_path, scenario, streaming, backend):
+    _, config = scenario
+    indented, compact = str(tmp_path / "indented.xml"), str(tmp_path / "compact.xml")
+    build_scenario(config, indented, streaming=streaming, backend=backend)
+    build_scenario(config, compact, streaming=streaming, backend=backend, compact=True)
+
+    assert b"\n " not in read_bytes(compact)
+    assert ET.canonicalize(from_file=compact, strip_text=True) == ET.canonicalize(from_file=indented, strip_text=True)
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".zst"])
+def test_compressed_output_decompresses_to_the_reference(tmp_path, suffix):
+    if suffix == ".zst" and zstandard is None and shutil.which("zstd") is None:
+        pytest.skip("neither the zstandard package nor the zstd command is available")
+    path = str(tmp_path / ("out.xml" + suffix))
+    build_scenario(load_config("mixed_deterministic"), path, backend="template")
+
+    with open_input(path) as f:
+        assert f.read() == expected_xml("mixed_deterministic")
+    if suffix == ".gz":
+        assert gzip.open(path).read() == expected_xml("mixed_deterministic")
+
+
+@pytest.mark.parametrize("switches, routers, pcs", [(0, 0, 3), (0, 3, 5), (2, 2, 4), (3, 4, 10), (7, 9, 40)])
+def test_random_links_match_the_legacy_implementation(switches, routers, pcs):
+    builder = make_builder(switches, routers, pcs)
+    assert builder.generate_random_links() == _legacy_generate_random_links(builder.device_registry)
+
+
+def test_seeded_links_are_reproducible():
+    def links(seed):
+        builder = make_builder(3, 6, 20)
+        return builder.generate_non_deterministic_links(seed, 2)
+
+    assert links(11) == links(11)
+
+
+@pytest.mark.parametrize("bad_id", [0, -3, 99])
+def test_links_to_missing_nodes_are_rejected(bad_id):
+    builder = NetworkBuilder()
+    builder.register_devices({"router": 3})
+    with pytest.raises(ValueError, match=rf"Link \(1, {bad_id}\)"):
+        builder.generate_links(ET.Element("links"), [(1, bad_id)])
+
+
+def test_links_to_removed_nodes_are_rejected():
+    builder = NetworkBuilder()
+    builder.register_devices({"router": 3})
+    builder.device_registry.remove([2])
+    with pytest.raises(ValueError, match="node 2"):
+        builder.generate_links(ET.Element("links"), [(1, 2)])
+
+
+def test_zero_capacity_pool_attaches_nothing():
+    assert attach([1, 2], CapacityPool([10, 11], capacity=0), LinkIndex()) == []
+
+
+def test_pool_counts_existing_children():
+    pool = CapacityPool([10, 11, 12], capacity=2, used={10: 2, 11: 1})
+    assert 10 not in pool
+    assert attach([1, 2, 3, 4], pool, LinkIndex()) == [1, 2, 3]
+    assert not pool
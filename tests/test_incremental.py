@@ -0,0 +1,109 @@
+import collections
+import copy
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from conftest import load_config, read_bytes
+from createXmlV2 import build_scenario, update_scenario
+from scenario_io import open_input
+from validation import TopologyError
+
+
+def parse(path):
+    with open_input(path) as f:
+        return ET.parse(f).getroot()
+
+
+def check_scenario(root):
+    # Unique node IDs and addresses, every link between existing nodes;
+    # returns {node ID: type} and the IDs that have a link
+    nodes = {record.get("id"): record.get("type") for section in ("networks", "devices") for record in root.find(section)}
+    assert len(nodes) == sum(len(root.find(section)) for section in ("networks", "devices"))
+
+    linked = set()
+    addresses = collections.Counter()
+    for link in root.find("links"):
+        assert link.get("node1") in nodes and link.get("node2") in nodes
+        linked.update((link.get("node1"), link.get("node2")))
+        for iface in link:
+            if iface.get("ip4"):
+                addresses[iface.get("ip4")] += 1
+    assert [address for address, count in addresses.items() if count > 1] == []
+    return nodes, linked
+
+
+def parse_records(data):
+    # The <network> / <device> records of a scenario file, as bytes
+    return [line for line in data.split(b"\n") if line.lstrip().startswith((b"<network ", b"<device "))]
+
+
+@pytest.mark.parametrize("deterministic", [True, False])
+def test_added_nodes_leave_existing_records_alone(tmp_path, deterministic):
+    config = {"devices": {"SWITCH": 3, "PC": 12, "router": 4}, "autogenerate_links": True,
+              "deterministic_links": deterministic, "seed": 3}
+    path = str(tmp_path / "s.xml")
+    build_scenario(config, path, state_path=path + ".state")
+    before = read_bytes(path)
+
+    grown = copy.deepcopy(config)
+    grown["devices"]["PC"] = 20
+    delta = update_scenario(grown, path, path + ".state")
+
+    assert not delta["rebuilt"]
+    assert len(delta["added_nodes"]) == 8
+    nodes, linked = check_scenario(parse(path))
+    assert len(nodes) == 27
+    assert {str(node_id) for node_id in delta["added_nodes"]} <= linked
+    for record in parse_records(before):
+        assert record in read_bytes(path)
+
+
+@pytest.mark.parametrize("deterministic", [True, False])
+def test_children_of_removed_nodes_are_attached_again(tmp_path, deterministic):
+    config = {"devices": {"SWITCH": 3, "PC": 12, "router": 4}, "autogenerate_links": True,
+              "deterministic_links": deterministic, "seed": 3}
+    path = str(tmp_path / "s.xml")
+    build_scenario(config, path, state_path=path + ".state")
+
+    shrunk = copy.deepcopy(config)
+    shrunk["devices"]["SWITCH"] = 2
+    delta = update_scenario(shrunk, path, path + ".state")
+
+    assert delta["removed_nodes"] and delta["reattached_nodes"]
+    nodes, linked = check_scenario(parse(path))
+    assert [node_id for node_id, node_type in nodes.items() if node_type == "PC" and node_id not in linked] == []
+
+
+def test_unchanged_config_leaves_the_file_as_it_is(tmp_path):
+    config = load_config("mixed_deterministic")
+    path = str(tmp_path / "s.xml")
+    build_scenario(config, path, state_path=path + ".state")
+    before = read_bytes(path)
+
+    delta = update_scenario(config, path, path + ".state")
+    assert not delta["rebuilt"] and not delta["added_links"] and not delta["removed_links"]
+    assert read_bytes(path) == before
+
+
+def test_compressed_scenarios_are_updated(tmp_path):
+    config = load_config("larger_deterministic")
+    path = str(tmp_path / "s.xml.gz")
+    build_scenario(config, path, state_path=path + ".state")
+
+    config["devices"]["PC"] += 5
+    delta = update_scenario(config, path, path + ".state")
+    assert not delta["rebuilt"]
+    nodes, _ = check_scenario(parse(path))
+    assert len(nodes) == sum(config["devices"].values())
+    assert [name for name in tmp_path.iterdir() if ".tmp" in name.name] == []
+
+
+def test_invalid_counts_raise_a_topology_error(tmp_path):
+    config = load_config("mixed_deterministic")
+    path = str(tmp_path / "s.xml")
+    build_scenario(config, path, state_path=path + ".state")
+
+    config["devices"]["SWITCH"] = 9
+    with pytest.raises(TopologyError):
+        update_scenario(config, path, path + ".state")
@@ -0,0 +1,84 @@
+import collections
+import xml.etree.ElementTree as ET
+
+from conftest import DATA, expected_xml, read_bytes
+from xml_repair import duplicate_node_ids, fix_duplicate_ids, repair_file
+
+MERGED_SECTIONS = ["networks", "devices", "links", "configservice_configurations", "mobility_configurations"]
+
+
+def merge(first, second, path):
+    # Concatenates the record sections of two scenarios, as a careless
+    # merge does, so every node ID of the second one collides
+    root = ET.parse(f"{DATA}/{first}.xml").getroot()
+    other = ET.parse(f"{DATA}/{second}.xml").getroot()
+    for section in MERGED_SECTIONS:
+        if other.find(section) is None:
+            continue
+        if root.find(section) is None:
+            root.append(other.find(section))
+        else:
+            root.find(section).extend(list(other.find(section)))
+    ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+    return root
+
+
+def nodes_of(root):
+    return [record for section in ("networks", "devices") for record in root.find(section)]
+
+
+def test_repairing_a_written_scenario_changes_nothing(tmp_path):
+    # Static sections go right after configservice_configurations, where
+    # the generator puts them unless there is a mobility section
+    path = str(tmp_path / "fixed.xml")
+    result = repair_file(f"{DATA}/larger_deterministic.xml", path)
+    assert "error" not in result and "duplicates" not in result
+    assert read_bytes(path) == expected_xml("larger_deterministic")
+
+
+def test_duplicate_ids_and_names_are_renumbered(tmp_path):
+    merged, fixed = str(tmp_path / "merged.xml"), str(tmp_path / "fixed.xml")
+    merge("mixed_deterministic", "config_links", merged)
+    assert duplicate_node_ids(merged)
+
+    result = repair_file(merged, fixed)
+    assert "error" not in result
+    root = ET.parse(fixed).getroot()
+    ids = [record.get("id") for record in nodes_of(root)]
+    names = [record.get("name") for record in nodes_of(root)]
+    assert len(ids) == len(set(ids))
+    assert len(names) == len(set(names))
+
+    # Only names that were taken twice change ("wlan2" stays)
+    renamed = [remap for remap in result["duplicates"]["remapped"] if "renamed" in remap]
+    assert renamed and all(remap["renamed"] == f"n{remap['new']}" for remap in renamed)
+    for link in root.find("links"):
+        assert link.get("node1") in ids and link.get("node2") in ids
+
+
+def test_links_follow_the_renumbered_copy():
+    # The second scenario's links keep their shape: same type pairs
+    root = ET.parse(f"{DATA}/mixed_deterministic.xml").getroot()
+    other = ET.parse(f"{DATA}/config_links.xml").getroot()
+
+    def type_pairs(scenario):
+        types = {record.get("id"): record.get("type") for record in nodes_of(scenario)}
+        return collections.Counter(tuple(sorted((types[link.get("node1")], types[link.get("node2")])))
+                                   for link in scenario.find("links"))
+
+    expected = type_pairs(root) + type_pairs(other)
+    for section in MERGED_SECTIONS:
+        if other.find(section) is not None and root.find(section) is not None:
+            root.find(section).extend(list(other.find(section)))
+    fix_duplicate_ids(root)
+    assert type_pairs(root) == expected
+
+
+def test_unique_names_are_kept():
+    root = ET.fromstring(
+        '<scenario><networks /><devices>'
+        '<device id="1" name="a" type="router" /><device id="1" name="b" type="router" />'
+        '</devices></scenario>'
+    )
+    report = fix_duplicate_ids(root)
+    assert [(remap["new"], remap["name"], "renamed" in remap) for remap in report["remapped"]] == [("2", "b", False)]
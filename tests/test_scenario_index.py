@@ -0,0 +1,92 @@
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from conftest import DATA, expected_xml, read_bytes
+from createXmlV2 import build_scenario
+from scenario_index import ScenarioIndex
+
+
+def canonical(elem):
+    return ET.canonicalize(ET.tostring(elem), strip_text=True)
+
+
+def test_records_match_the_parsed_tree(scenario):
+    name, _ = scenario
+    root = ET.parse(f"{DATA}/{name}.xml").getroot()
+    with ScenarioIndex(f"{DATA}/{name}.xml") as index:
+        nodes = [record for section in ("networks", "devices") for record in root.find(section)]
+        assert index.node_count() == len(nodes)
+        for record in nodes:
+            assert canonical(index.node(int(record.get("id")))) == canonical(record)
+        assert index.node(10 ** 6) is None
+
+        links = list(root.find("links"))
+        assert [canonical(link) for link in index.links()] == [canonical(link) for link in links]
+        assert list(index.link_pairs()) == [(int(link.get("node1")), int(link.get("node2"))) for link in links]
+        for record in nodes:
+            node_id = record.get("id")
+            expected = [canonical(link) for link in links if node_id in (link.get("node1"), link.get("node2"))]
+            assert [canonical(link) for link in index.links_of(int(node_id))] == expected
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_dropping_and_adding_a_section_gives_the_file_back(tmp_path, compact):
+    path, dropped, restored = (str(tmp_path / name) for name in ("s.xml", "dropped.xml", "restored.xml"))
+    build_scenario({"devices": {"SWITCH": 2, "WIRELESS_LAN": 1, "PC": 6, "router": 3, "mdr": 1},
+                    "autogenerate_links": True, "deterministic_links": True}, path, compact=compact)
+
+    with ScenarioIndex(path) as index:
+        section = bytes(index.section_bytes("mobility_configurations"))
+        index.rewrite_section("mobility_configurations", None, dropped)
+    with ScenarioIndex(dropped) as index:
+        assert "mobility_configurations" not in index.sections
+        index.rewrite_section("mobility_configurations", section, restored)
+    assert read_bytes(restored) == read_bytes(path)
+
+
+def test_sections_rewritten_in_place_are_mapped_again(tmp_path):
+    path = str(tmp_path / "s.xml")
+    shutil.copy(f"{DATA}/mixed_deterministic.xml", path)
+    with ScenarioIndex(path) as index:
+        links = bytes(index.section_bytes("links"))
+        index.rewrite_section("links", None, path)
+        assert "links" not in index.sections and index.link_count() == 0
+        index.rewrite_section("links", links, path)
+        assert index.link_count() == len(ET.fromstring(links))
+    assert read_bytes(path) == expected_xml("mixed_deterministic")
+
+
+def test_element_replacements_are_indented_like_the_file(tmp_path):
+    path = str(tmp_path / "s.xml")
+    with ScenarioIndex(f"{DATA}/larger_deterministic.xml") as index:
+        index.rewrite_section("session_metadata", index.section("session_metadata"), path)
+    assert read_bytes(path) == expected_xml("larger_deterministic")
+
+
+def test_saved_indexes_are_used_until_the_file_changes(tmp_path):
+    path, index_path = str(tmp_path / "s.xml"), str(tmp_path / "s.xml.idx")
+    shutil.copy(f"{DATA}/larger_deterministic.xml", path)
+    with ScenarioIndex(path, index_path) as index:
+        assert not index.index_loaded
+        expected = (index.node_bytes(7), [ET.tostring(link) for link in index.links_of(7)])
+        index.save_index()
+
+    with ScenarioIndex(path, index_path) as index:
+        assert index.index_loaded
+        assert (index.node_bytes(7), [ET.tostring(link) for link in index.links_of(7)]) == expected
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    with ScenarioIndex(path, index_path) as index:
+        assert not index.index_loaded
+        assert index.node_bytes(7) == expected[0]
+
+
+def test_compressed_files_are_rejected(tmp_path):
+    path = str(tmp_path / "s.xml.gz")
+    build_scenario({"devices": {"router": 2}, "autogenerate_links": True, "deterministic_links": True}, path)
+    with pytest.raises(ValueError, match="compressed"):
+        ScenarioIndex(path)
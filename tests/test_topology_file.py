@@ -0,0 +1,56 @@
+import pytest
+
+from conftest import expected_xml, read_bytes
+from createXmlV2 import build_scenario
+from scenario_io import open_input
+from topology_file import load_topology, render_topology, restore_builder, save_topology
+
+RENDERINGS = [("etree", False), ("template", False), ("etree", True), ("template", True)]
+
+
+@pytest.fixture
+def exported(tmp_path, scenario):
+    # A scenario built once, with its topology file next to it
+    name, config = scenario
+    topology_path = str(tmp_path / "s.topo")
+    build_scenario(config, str(tmp_path / "s.xml"), export_path=topology_path)
+    return name, config, topology_path
+
+
+@pytest.mark.parametrize("backend, compact", RENDERINGS)
+def test_rendering_writes_the_bytes_of_the_build(tmp_path, exported, backend, compact):
+    _, config, topology_path = exported
+    built, rendered = str(tmp_path / "built.xml"), str(tmp_path / "rendered.xml")
+    build_scenario(config, built, backend=backend, compact=compact)
+    with load_topology(topology_path) as topology:
+        render_topology(topology, rendered, backend, compact)
+    assert read_bytes(rendered) == read_bytes(built)
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_mapped_topologies_render_the_same(tmp_path, exported, use_mmap):
+    name, _, topology_path = exported
+    path = str(tmp_path / "rendered.xml.gz")
+    with load_topology(topology_path, use_mmap) as topology:
+        render_topology(topology, path)
+    with open_input(path) as f:
+        assert f.read() == expected_xml(name)
+
+
+def test_restored_builders_save_the_same_topology(tmp_path, exported):
+    _, _, topology_path = exported
+    saved = str(tmp_path / "saved.topo")
+    with load_topology(topology_path) as topology:
+        builder = restore_builder(topology)
+        save_topology(saved, builder, topology.header["scenario_attrib"])
+        summary = topology.summary()
+    assert read_bytes(saved) == read_bytes(topology_path)
+    with load_topology(saved) as topology:
+        assert topology.summary() == summary
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = str(tmp_path / "s.xml")
+    build_scenario({"devices": {"router": 2}, "autogenerate_links": True, "deterministic_links": True}, path)
+    with pytest.raises(ValueError):
+        load_topology(path)
@@ -0,0 +1,223 @@
+import math
+
+###
+# Router backbone models for NetworkBuilder.generate_topology_links.
+#
+# A model wires the routers to each other; the builder then attaches
+# switches / hubs and PCs the same way the classic generators do. Every
+# model takes (routers, rng, links, **params): the router IDs, a
+# random.Random, and the LinkIndex to add links to. It returns the routers
+# switches should hang off (e.g. the leaves of a tree), or None for all of
+# them. All of them run in O(routers + links):
+#
+#   ring             cycle through the routers
+#   tree             fanout-ary tree (fanout=2); switches go to the leaves
+#   fat_tree         k-ary fat-tree (core / aggregation / edge), k chosen
+#                    from the router count; switches go to the edge layer
+#   k_regular        random graph where every router has degree k (k=3)
+#   waxman           routers scattered on a plane, linked with probability
+#                    beta * exp(-distance / alpha); distances are in units
+#                    of the mean router spacing so the graph stays sparse at
+#                    any size. beta is derived from degree (4) unless given
+#   barabasi_albert  preferential attachment, m links per new router (m=2)
+#   sparse           random spanning tree plus random links up to an
+#                    average degree (degree=3)
+#
+# Random models are made connected afterwards by linking their components
+# in a chain, since a router backbone with islands cannot route.
+#
+# New models are added with @register_topology("name").
+###
+
+TOPOLOGIES = {}
+
+
+def register_topology(name):
+    def register(model):
+        TOPOLOGIES[name] = model
+        return model
+    return register
+
+
+def _connect_components(routers, links):
+    # Links one router of every connected component to one of the next, so
+    # the backbone is connected; union-find over the links, near O(V + E)
+    parent = {router: router for router in routers}
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for node1, node2 in links:
+        if node1 in parent and node2 in parent:
+            root1, root2 = find(node1), find(node2)
+            if root1 != root2:
+                parent[root2] = root1
+
+    heads = [router for router in routers if find(router) == router]
+    for head1, head2 in zip(heads, heads[1:]):
+        links.add(head1, head2)
+        parent[find(head2)] = find(head1)
+
+
+@register_topology("ring")
+def ring(routers, rng, links):
+    if len(routers) == 2:
+        links.add(routers[0], routers[1])
+    elif len(routers) > 2:
+        for i, router in enumerate(routers):
+            links.add(router, routers[i - 1])
+    return None
+
+
+@register_topology("tree")
+def tree(routers, rng, links, fanout=2):
+    if fanout < 1:
+        raise ValueError("tree fanout must be at least 1")
+    for i in range(1, len(routers)):
+        links.add(routers[(i - 1) // fanout], routers[i])
+    # Routers without children
+    first_leaf = (len(routers) - 2) // fanout + 1 if len(routers) > 1 else 0
+    return routers[first_leaf:]
+
+
+@register_topology("fat_tree")
+def fat_tree(routers, rng, links, k=None):
+    # A full k-ary fat-tree uses 5k^2/4 routers: (k/2)^2 core routers and k
+    # pods of k/2 aggregation + k/2 edge routers. k defaults to the largest
+    # even k that fits; routers beyond it become extra edge routers of the
+    # pods, round-robin.
+    count = len(routers)
+    if k is None:
+        k = 2 * int(math.sqrt(count / 5))
+    if k < 2 or k % 2 or 5 * k * k // 4 > count:
+        if count < 5:
+            return tree(routers, rng, links)
+        raise ValueError(f"fat_tree k must be even and need at most {count} routers (5k^2/4)")
+
+    half = k // 2
+    core = routers[:half * half]
+    pods = []
+    position = len(core)
+    for _ in range(k):
+        aggregation = routers[position:position + half]
+        edge = routers[position + half:position + k]
+        pods.append((aggregation, edge))
+        position += k
+    for i, router in enumerate(routers[position:]):
+        pods[i % k][1].append(router)
+
+    for aggregation, edge in pods:
+        for j, agg in enumerate(aggregation):
+            # Aggregation router j of every pod links to core group j
+            for core_router in core[j * half:(j + 1) * half]:
+                links.add(agg, core_router)
+            for edge_router in edge:
+                links.add(agg, edge_router)
+    return [router for _, edge in pods for router in edge]
+
+
+@register_topology("k_regular")
+def k_regular(routers, rng, links, k=3):
+    # Configuration model: k stubs per router, shuffled and paired. Pairs
+    # that would form a self-loop or a repeated link are paired again
+    # among themselves a few times, then dropped (degree k - 1 for a few).
+    if k < 1:
+        raise ValueError("k_regular k must be at least 1")
+    k = min(k, len(routers) - 1)
+    stubs = [router for router in routers for _ in range(k)]
+    for _ in range(10):
+        rng.shuffle(stubs)
+        left = []
+        for i in range(0, len(stubs) - 1, 2):
+            a, b = stubs[i], stubs[i + 1]
+            if a == b or not links.add(a, b):
+                left.extend((a, b))
+        if len(left) < 2:
+            break
+        stubs = left
+    _connect_components(routers, links)
+    return None
+
+
+@register_topology("waxman")
+def waxman(routers, rng, links, degree=4, alpha=1.0, beta=None):
+    # Expected degree is beta * 2 * pi * alpha^2 on a plane with one router
+    # per unit area. Pairs further apart than where the probability drops
+    # under 1e-3 are never considered, so only nearby grid cells are
+    # visited.
+    count = len(routers)
+    if count < 2:
+        return None
+    if beta is None:
+        beta = min(1.0, degree / (2 * math.pi * alpha * alpha))
+    reach = max(alpha * math.log(beta * 1000), alpha) if beta > 0.001 else 0.0
+    if reach <= 0:
+        return None
+
+    side = math.sqrt(count)
+    points = [(rng.random() * side, rng.random() * side) for _ in routers]
+
+    cells = {}
+    for index, (x, y) in enumerate(points):
+        cells.setdefault((int(x // reach), int(y // reach)), []).append(index)
+
+    for index, (x, y) in enumerate(points):
+        cx, cy = int(x // reach), int(y // reach)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other in cells.get((cx + dx, cy + dy), ()):
+                    if other <= index:
+                        continue
+                    ox, oy = points[other]
+                    distance = math.hypot(x - ox, y - oy)
+                    if distance <= reach and rng.random() < beta * math.exp(-distance / alpha):
+                        links.add(routers[index], routers[other])
+
+    _connect_components(routers, links)
+    return None
+
+
+@register_topology("barabasi_albert")
+def barabasi_albert(routers, rng, links, m=2):
+    # Every new router links to m distinct earlier ones, picked with
+    # probability proportional to their degree: each link end is kept in
+    # `ends`, so a uniform pick from it is a degree-weighted pick
+    if m < 1:
+        raise ValueError("barabasi_albert m must be at least 1")
+    seeds = routers[:m + 1]
+    for i, router in enumerate(seeds):
+        for other in seeds[:i]:
+            links.add(router, other)
+    ends = [router for router in seeds for _ in range(len(seeds) - 1)] or list(seeds)
+
+    for router in routers[m + 1:]:
+        targets = set()
+        while len(targets) < m:
+            targets.add(ends[rng.randrange(len(ends))])
+        for target in targets:
+            links.add(router, target)
+            ends.append(target)
+        ends.extend([router] * m)
+    return None
+
+
+@register_topology("sparse")
+def sparse(routers, rng, links, degree=3):
+    # Random recursive tree (every router links to a random earlier one),
+    # then random extra links until the average degree is reached
+    count = len(routers)
+    start = len(links)
+    for i in range(1, count):
+        links.add(routers[i], routers[rng.randrange(i)])
+
+    target = start + min(int(degree * count / 2), count * (count - 1) // 2)
+    attempts = 0
+    while len(links) < target and attempts < 10 * target:
+        a, b = routers[rng.randrange(count)], routers[rng.randrange(count)]
+        if a != b:
+            links.add(a, b)
+        attempts += 1
+    return None
@@ -0,0 +1,284 @@
+import argparse
+import json
+from array import array
+from basic_core_structure import (
+    add_session_origin,
+    add_session_options,
+    add_session_metadata,
+    add_default_services,
+    add_mobility_configurations
+)
+from column_file import read_columns, write_columns
+from device_registry import REMOVED
+from emitters import EMITTERS, make_emitter
+from link_table import LinkTable, FIELDS as LINK_FIELDS, REMOVED_LINK
+from network_builder import NetworkBuilder, DEVICE_SERVICES
+from scenario_writer import open_scenario_writer, open_section, close_section
+
+###
+# Topology files: a NetworkBuilder's topology, columnar, without the XML.
+#
+# Everything createXmlV2 knows after generating a scenario -- the node
+# registry, the address plan, the layout and every link with its
+# interfaces and subnet -- is saved as flat integer columns of a column
+# file (see column_file.py), with addressing, layout, type names and the
+# scenario attributes in its JSON header:
+#
+#   nodes      type_codes, interfaces, cell_col, cell_row (per node ID)
+#   links      link_kind, link_node1, ..., link_host (see link_table.py)
+#   addresses  subnets_used, subnets_free, lan_center, lan_subnet,
+#              lan_next_host
+#   adjacency  adjacency_nodes, adjacency_offsets, adjacency_targets (CSR)
+#
+# A file is a few tens of bytes per link. load_topology() reads every
+# column straight into its array, or with use_mmap=True maps the file
+# and hands out memoryviews over it, so even a million-link topology is
+# available in milliseconds for analysis. render_topology() writes the
+# scenario XML from it (the same bytes createXmlV2 wrote, any backend,
+# compressed or not) and restore_builder() turns it back into a
+# NetworkBuilder that can keep growing.
+#
+#   python createXmlV2.py --config big.json --export-topology big.topo
+#   python topology_file.py info big.topo
+#   python topology_file.py render big.topo -o big.xml.gz
+###
+
+MAGIC = b"CORETOPO"
+
+FORMAT_VERSION = 1
+
+
+class Topology:
+    # A loaded topology file: its header and its columns by name
+
+    def __init__(self, header, columns, mapping=None):
+        self.header = header
+        self.columns = columns
+        self._mapping = mapping
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def links(self):
+        # Link table rows (see link_table.py) of the links still there
+        columns = self.columns
+        for row in zip(*(columns["link_" + name] for name in LINK_FIELDS)):
+            if row[0] != REMOVED_LINK:
+                yield row
+
+    def summary(self):
+        type_names = self.header["type_names"]
+        nodes = {}
+        for code in self.columns["type_codes"]:
+            if code != REMOVED:
+                nodes[type_names[code]] = nodes.get(type_names[code], 0) + 1
+        links = sum(1 for kind in self.columns["link_kind"] if kind != REMOVED_LINK)
+        return {"nodes": nodes, "links": links, "lans": len(self.columns["lan_center"]),
+                "canvas": self.header["canvas"]}
+
+    def close(self):
+        if self._mapping is not None:
+            self.columns = {}
+            self._mapping.close()
+            self._mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _builder_columns(builder):
+    registry = builder.device_registry
+    subnets = builder.subnets.snapshot()
+
+    cell_col = array("I", bytes(4 * len(registry.type_codes)))
+    cell_row = array("I", cell_col)
+    cell = builder.layout.cell
+    for node_id in registry:
+        cell_col[node_id - registry.start_id], cell_row[node_id - registry.start_id] = cell(node_id)
+
+    offsets = array("I", [0])
+    targets = array("I")
+    for neighbors in builder.adjacency.values():
+        targets.extend(neighbors)
+        offsets.append(len(targets))
+
+    columns = {
+        "type_codes": registry.type_codes,
+        "interfaces": registry.interfaces,
+        "cell_col": cell_col,
+        "cell_row": cell_row,
+        "subnets_used": array("B", subnets["used"]),
+        "subnets_free": array("I", subnets["free"]),
+        "lan_center": array("I", builder.lans),
+        "lan_subnet": array("I", [subnet for subnet, _ in builder.lans.values()]),
+        "lan_next_host": array("I", [next_host for _, next_host in builder.lans.values()]),
+        "adjacency_nodes": array("I", builder.adjacency),
+        "adjacency_offsets": offsets,
+        "adjacency_targets": targets
+    }
+    for name, column in builder.link_table.columns().items():
+        columns["link_" + name] = column
+    return columns
+
+
+##
+# Saves the topology of a builder that has written its scenario.
+# scenario_attrib are the <scenario> attributes render_topology writes.
+##
+def save_topology(path, builder, scenario_attrib=None):
+    if builder.link_table is None:
+        raise ValueError("builder has no link table (restored from a state file); regenerate it to export")
+
+    registry = builder.device_registry
+    subnets = builder.subnets.snapshot()
+    columns = _builder_columns(builder)
+    header = {
+        "format": "core-topology",
+        "version": FORMAT_VERSION,
+        "start_id": registry.start_id,
+        "ip4_base": builder.ip4_base,
+        "ip6_base": builder.ip6_base,
+        "ip4_prefix": builder.subnets.ip4_prefix,
+        "ip6_prefix": builder.subnets.ip6_prefix,
+        "type_names": registry.type_names,
+        "prefixes": registry.prefixes,
+        "subnets": {"next": subnets["next"], "allocated": subnets["allocated"]},
+        "layout": builder.layout.snapshot(),
+        "canvas": builder.canvas_dimensions(),
+        "scenario_attrib": scenario_attrib or {}
+    }
+    write_columns(path, MAGIC, header, columns)
+
+
+##
+# Reads a topology file. Columns are arrays, read straight into place, or
+# with use_mmap=True read-only memoryviews over the mapped file (close the
+# Topology, or use it as a context manager, to unmap it).
+##
+def load_topology(path, use_mmap=False):
+    header, columns, mapping = read_columns(path, MAGIC, "topology", use_mmap)
+    if header.get("format") != "core-topology" or header.get("version") != FORMAT_VERSION:
+        if mapping is not None:
+            columns.clear()
+            mapping.close()
+        raise ValueError(f"{path}: unsupported topology file version {header.get('version')}")
+    return Topology(header, columns, mapping)
+
+
+def _restore(topology, emitter, full):
+    header = topology.header
+    columns = topology.columns
+    snapshot = {
+        "start_id": header["start_id"],
+        "ip4_base": header["ip4_base"],
+        "ip6_base": header["ip6_base"],
+        "ip4_prefix": header["ip4_prefix"],
+        "ip6_prefix": header["ip6_prefix"],
+        "registry": {
+            "start_id": header["start_id"],
+            "type_names": header["type_names"],
+            "prefixes": header["prefixes"],
+            "type_codes": bytes(columns["type_codes"]),
+            "interfaces": columns["interfaces"]
+        },
+        "subnets": dict(header["subnets"], used=bytes(columns["subnets_used"]), free=columns["subnets_free"]),
+        "layout": header["layout"],
+        "adjacency": {},
+        "links": {},
+        "lans": {}
+    }
+
+    if full:
+        nodes, offsets, targets = columns["adjacency_nodes"], columns["adjacency_offsets"], columns["adjacency_targets"]
+        snapshot["adjacency"] = {
+            node_id: list(targets[offsets[i]:offsets[i + 1]]) for i, node_id in enumerate(nodes)
+        }
+        snapshot["links"] = {
+            ((node1, node2) if node1 < node2 else (node2, node1)): subnet
+            for _, node1, node2, _, _, subnet, _ in topology.links()
+        }
+        snapshot["lans"] = {
+            center_id: [subnet, next_host]
+            for center_id, subnet, next_host in zip(columns["lan_center"], columns["lan_subnet"],
+                                                    columns["lan_next_host"])
+        }
+
+    builder = NetworkBuilder.restore(snapshot, emitter)
+    start_id = builder.device_registry.start_id
+    cell_col, cell_row = columns["cell_col"], columns["cell_row"]
+    builder.layout.planned = {
+        node_id: (cell_col[node_id - start_id], cell_row[node_id - start_id]) for node_id in builder.device_registry
+    }
+    if full:
+        builder.link_table = LinkTable.from_columns({name: columns["link_" + name] for name in LINK_FIELDS})
+    return builder
+
+
+def restore_builder(topology, emitter=None):
+    # A NetworkBuilder in the state the topology was saved in; new devices
+    # and links can be added to it as after generation (and saved again)
+    return _restore(topology, emitter, True)
+
+
+##
+# Writes the scenario XML of a topology without generating anything: the
+# records come from the columns, the static sections from
+# basic_core_structure. Same bytes createXmlV2 writes for it (networks and
+# devices in ID order, links in the order they were made). output_path may
+# be compressed or "-" (see scenario_io).
+##
+def render_topology(topology, output_path, backend="etree", compact=False):
+    space = None if compact else "  "
+    builder = _restore(topology, make_emitter(backend, space), False)
+    registry = builder.device_registry
+
+    with open_scenario_writer(output_path, topology.header["scenario_attrib"], space) as writer:
+        networks = open_section(writer, "networks")
+        builder.add_networks(networks, registry.ids_of(*builder.network_prefixes))
+        close_section(networks)
+
+        devices = open_section(writer, "devices")
+        builder.add_devices(devices, registry.ids_of(*DEVICE_SERVICES))
+        close_section(devices)
+
+        links = open_section(writer, "links")
+        emit = builder.emitter.sink(links)
+        format_link = builder.format_link
+        for row in topology.links():
+            emit(format_link(*row))
+        close_section(links)
+
+        builder.add_configservice_configurations(writer)
+        add_mobility_configurations(writer, registry)
+
+        add_session_origin(writer)
+        add_session_options(writer)
+        add_session_metadata(writer, topology.header["canvas"])
+        add_default_services(writer)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect a topology file or write its scenario XML")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    info = commands.add_parser("info", help="print node and link counts")
+    info.add_argument("topology")
+
+    render = commands.add_parser("render", help="write the scenario XML")
+    render.add_argument("topology")
+    render.add_argument("-o", "--output", required=True,
+                        help="ending in .gz or .zst compresses the XML; \"-\" writes it to stdout")
+    render.add_argument("--backend", choices=list(EMITTERS), default="template",
+                        help="serialize records with ElementTree or with string templates")
+    render.add_argument("--compact", action="store_true", help="write the XML without indentation")
+    args = parser.parse_args()
+
+    with load_topology(args.topology, use_mmap=True) as topology:
+        if args.command == "info":
+            print(json.dumps(topology.summary(), indent=2))
+        else:
+            render_topology(topology, args.output, args.backend, args.compact)
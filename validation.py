@@ -0,0 +1,268 @@
+from array import array
+from device_registry import SWITCH, HUB, WIRELESS_LAN, PC, ROUTER, MDR, REMOVED
+
+###
+# Topology validation.
+#
+# validate_topology() checks a connection list against the registry before
+# any XML is written, so a broken scenario is reported instead of half
+# generated. Every check is one pass over the nodes or the connections,
+# using per-node arrays indexed by (node_id - start_id), the layout of the
+# DeviceRegistry columns:
+#
+#   parent      union-find forest, for connected components
+#   interfaces  interfaces every node will have once the links are made
+#   lan_size    hosts on the LAN of each switch / hub
+#   routed      1 for switches / hubs with a router or MDR neighbor
+#
+# Findings come back as diagnostics, one per kind of problem:
+#
+#   {"severity": "error" | "warning", "code": "self_loop",
+#    "message": "...", "count": 3, "nodes": [...] or "links": [[a, b], ...]}
+#
+# with at most MAX_LISTED offending nodes or links listed. Errors are
+# scenarios CORE cannot run or the generator cannot address; warnings are
+# scenarios that work but are probably not what was meant:
+#
+#   error    too_many_switches   more switches than routers
+#   error    unknown_node        link to an ID that is not in the registry
+#   error    self_loop           link from a node to itself
+#   error    interface_overflow  node above max_interfaces
+#   error    lan_overflow        LAN with more hosts than its subnet holds
+#   error    subnet_exhausted    more link / LAN subnets than the address space
+#   error    ip_collision        subnet assigned twice (check_addresses)
+#   warning  duplicate_link      the same pair linked twice; LAN links are
+#                                made once, direct links twice
+#   warning  orphaned_lan        switch / hub without a router or MDR; its
+#                                links are dropped by generate_links, which
+#                                reports it even when validation is off
+#   warning  disconnected        more than one connected component
+###
+
+MAX_LISTED = 20
+
+DIRECT_CODES = {ROUTER, PC, MDR}
+LAN_CODES = {SWITCH, HUB}
+ROUTER_CODES = {ROUTER, MDR}
+
+
+class TopologyError(ValueError):
+    # Raised for a topology with error diagnostics; carries the report
+
+    def __init__(self, report):
+        self.report = report
+        errors = [d["message"] for d in report["diagnostics"] if d["severity"] == "error"]
+        super().__init__("; ".join(errors) or "invalid topology")
+
+
+def diagnostic(severity, code, message, nodes=None, links=None, count=None):
+    entry = {"severity": severity, "code": code, "message": message}
+    items = nodes if nodes is not None else links
+    if items is not None:
+        entry["count"] = len(items) if count is None else count
+        if nodes is not None:
+            entry["nodes"] = list(nodes[:MAX_LISTED])
+        else:
+            entry["links"] = [list(link) for link in links[:MAX_LISTED]]
+    return entry
+
+
+def orphaned_lan(nodes):
+    return diagnostic("warning", "orphaned_lan",
+                      f"{len(nodes)} switches / hubs have no router or MDR neighbor and get no links.", nodes=nodes)
+
+
+def make_report(diagnostics, **stats):
+    report = dict(stats)
+    report["valid"] = not any(d["severity"] == "error" for d in diagnostics)
+    report["diagnostics"] = diagnostics
+    return report
+
+
+def check_device_counts(device_counts):
+    # The rule register_devices enforces on a config's device counts
+    switches = device_counts.get("SWITCH", 0)
+    routers = device_counts.get("router", 0)
+    if switches > routers:
+        return [diagnostic("error", "too_many_switches",
+                           f"Invalid topology: number of switches ({switches}) exceeds number of routers ({routers}).")]
+    return []
+
+
+def _find(parent, index):
+    # Root of index, halving the path on the way
+    while parent[index] != index:
+        parent[index] = parent[parent[index]]
+        index = parent[index]
+    return index
+
+
+##
+# Checks `connections` ((node1, node2) pairs) against the registry.
+# subnets is the SubnetAllocator the links will be addressed from; without
+# it the addressing checks are skipped. max_interfaces caps the interfaces
+# of any single node (None: no cap). Interfaces and LAN hosts already
+# handed out (incremental updates) count towards the limits.
+#
+# Returns {"valid", "nodes", "links", "components", "largest_component",
+# "diagnostics"}; linear in nodes + connections.
+##
+def validate_topology(registry, connections, subnets=None, max_interfaces=None, lans=None):
+    start_id = registry.start_id
+    type_codes = registry.type_codes
+    size = len(type_codes)
+
+    parent = array("I", range(size))
+    interfaces = array("I", registry.interfaces)
+    lan_size = array("I", [0]) * size
+    routed = bytearray(size)
+    for center_id, (_, next_host) in (lans or {}).items():
+        lan_size[center_id - start_id] = next_host - 1
+        routed[center_id - start_id] = 1
+
+    unknown, self_loops, duplicates = [], [], []
+    seen = set()
+    point_to_point = 0
+
+    for node1, node2 in connections:
+        index1, index2 = node1 - start_id, node2 - start_id
+        if not (0 <= index1 < size and type_codes[index1] != REMOVED):
+            unknown.append(node1)
+            continue
+        if not (0 <= index2 < size and type_codes[index2] != REMOVED):
+            unknown.append(node2)
+            continue
+        if node1 == node2:
+            self_loops.append(node1)
+            continue
+
+        key = (node1, node2) if node1 < node2 else (node2, node1)
+        if key in seen:
+            duplicates.append(key)
+        seen.add(key)
+
+        root1, root2 = _find(parent, index1), _find(parent, index2)
+        if root1 != root2:
+            parent[root2] = root1
+
+        # Interfaces and addressing as generate_links will make them
+        code1, code2 = type_codes[index1], type_codes[index2]
+        if code1 == WIRELESS_LAN or code2 == WIRELESS_LAN:
+            point_to_point += 1
+            if code1 != WIRELESS_LAN:
+                interfaces[index1] += 1
+            if code2 != WIRELESS_LAN:
+                interfaces[index2] += 1
+        elif code1 in DIRECT_CODES and code2 in DIRECT_CODES:
+            point_to_point += 1
+            interfaces[index1] += 1
+            interfaces[index2] += 1
+        else:
+            for index, code, other in ((index1, code1, code2), (index2, code2, code1)):
+                if code in LAN_CODES:
+                    lan_size[index] += 1
+                    if other in ROUTER_CODES:
+                        routed[index] = 1
+                else:
+                    interfaces[index] += 1
+
+    diagnostics = check_device_counts({
+        "SWITCH": registry.count_of("SWITCH"),
+        "router": registry.count_of("router")
+    })
+    if unknown:
+        diagnostics.append(diagnostic("error", "unknown_node",
+                                      f"{len(unknown)} link ends name nodes that do not exist.", nodes=unknown))
+    if self_loops:
+        diagnostics.append(diagnostic("error", "self_loop",
+                                      f"{len(self_loops)} links connect a node to itself.", nodes=self_loops))
+    if duplicates:
+        diagnostics.append(diagnostic("warning", "duplicate_link",
+                                      f"{len(duplicates)} links repeat a pair that is already linked.", links=duplicates))
+
+    # Switches / hubs: orphaned LANs and LAN sizes
+    orphaned, lans_needed, crowded = [], 0, []
+    max_hosts = subnets.ip4_size - 2 if subnets is not None else None
+    for node_id in registry.ids_of("SWITCH", "HUB"):
+        index = node_id - start_id
+        if not routed[index]:
+            orphaned.append(node_id)
+            continue
+        if not lans or node_id not in lans:
+            lans_needed += 1
+        if max_hosts is not None and lan_size[index] > max_hosts:
+            crowded.append(node_id)
+    if crowded:
+        diagnostics.append(diagnostic("error", "lan_overflow",
+                                      f"{len(crowded)} switches / hubs have more neighbors than a "
+                                      f"/{subnets.ip4_prefix} subnet has hosts ({max_hosts}).", nodes=crowded))
+    if orphaned:
+        diagnostics.append(orphaned_lan(orphaned))
+
+    if max_interfaces is not None:
+        over = [node_id for node_id in registry if interfaces[node_id - start_id] > max_interfaces]
+        if over:
+            diagnostics.append(diagnostic("error", "interface_overflow",
+                                          f"{len(over)} nodes need more than {max_interfaces} interfaces.", nodes=over))
+
+    if subnets is not None:
+        needed = point_to_point + lans_needed
+        available = subnets.capacity - subnets.allocated
+        if needed > available:
+            diagnostics.append(diagnostic("error", "subnet_exhausted",
+                                          f"The links need {needed} /{subnets.ip4_prefix} subnets but only "
+                                          f"{available} are left; use a larger ip4_subnet_prefix or base."))
+
+    # Components; every node of the registry counts, linked or not
+    component_size = {}
+    for node_id in registry:
+        root = _find(parent, node_id - start_id)
+        component_size[root] = component_size.get(root, 0) + 1
+    if len(component_size) > 1:
+        # One node of every component but the largest
+        largest = max(component_size, key=component_size.get)
+        heads = [root + start_id for root in component_size if root != largest]
+        diagnostics.append(diagnostic("warning", "disconnected",
+                                      f"The topology has {len(component_size)} connected components; "
+                                      f"listed nodes are one of each component outside the largest.",
+                                      nodes=heads))
+
+    return make_report(
+        diagnostics,
+        nodes=len(registry),
+        links=len(seen),
+        components=len(component_size),
+        largest_component=max(component_size.values(), default=0)
+    )
+
+
+##
+# Checks the addresses a NetworkBuilder has handed out: every link subnet
+# belongs to one point-to-point link, or to one LAN and only links of its
+# switch / hub. Returns a report like validate_topology.
+##
+def check_addresses(builder):
+    lan_owner = {}
+    collisions = []
+    for center_id, (subnet, _) in builder.lans.items():
+        if subnet in lan_owner:
+            collisions.append((lan_owner[subnet], center_id))
+        lan_owner[subnet] = center_id
+
+    used_by = {}
+    for pair, subnet in builder.links.items():
+        center_id = lan_owner.get(subnet)
+        if center_id is not None:
+            if center_id not in pair:
+                collisions.append(pair)
+        elif subnet in used_by:
+            collisions.append(pair)
+        else:
+            used_by[subnet] = pair
+
+    diagnostics = []
+    if collisions:
+        diagnostics.append(diagnostic("error", "ip_collision",
+                                      f"{len(collisions)} links or LANs share a subnet with another one.",
+                                      links=collisions))
+    return make_report(diagnostics, links=len(builder.links), lans=len(builder.lans))
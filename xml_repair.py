@@ -0,0 +1,557 @@
+import io
+import json
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+from basic_core_structure import DEFAULT_CANVAS_DIMENSIONS, STATIC_SECTIONS, static_fragment_bytes
+from scenario_io import STDIO, is_compressed, open_input, open_output, temporary_path
+
+###
+# Streaming repair of scenario files.
+#
+# The static sections (session_origin, session_options, session_metadata,
+# default_services) are a few hundred bytes at the end of files that can
+# hold millions of records, so repair_file never parses the rest:
+#
+#   1. the top level of <scenario> is walked tag by tag; the content of
+#      every other section (networks, devices, links, ...) is copied to the
+#      output in CHUNK_SIZE blocks up to its closing tag, byte for byte
+#   2. existing static sections are dropped on the way (the canvas size of
+#      <session_metadata> is read first, so grown canvases survive)
+#   3. fresh pre-rendered sections are written after
+#      configservice_configurations, or before </scenario> without it
+#
+# Memory per file is a couple of chunks whatever the file size, and the
+# cost is one read and one write of it. Only the top level is checked for
+# well-formedness; section contents are copied as they are.
+#
+# Duplicate node IDs (merged or hand-edited scenarios) are looked for in
+# the same streaming way; only a file that has some is parsed in full and
+# renumbered with fix_duplicate_ids before the static sections are added.
+#
+# Inputs may be gzip / Zstandard compressed and outputs compressed or
+# stdout, through scenario_io; the copying stays streaming either way.
+###
+
+CHUNK_SIZE = 1 << 20
+
+# session_metadata normally sits in the last few KB; larger files are
+# scanned in full only when it is not there
+_TAIL_SIZE = 1 << 16
+
+_TAG_END_OR_QUOTE = re.compile(rb"[>\"']")
+
+_NODE_ID = re.compile(rb"<(?:network|device)\s[^>]*?\bid\s*=\s*[\"']([^\"']*)")
+
+
+class _Discard:
+    def write(self, data):
+        pass
+
+
+_DISCARD = _Discard()
+
+
+class _ChunkReader:
+    # Forward-only reader over a binary file with a small lookahead buffer
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = b""
+        self.pos = 0
+
+    def _fill(self):
+        # Appends one chunk to the unread part of the buffer; False at EOF
+        data = self.f.read(self.chunk_size)
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self, size):
+        while len(self.buffer) - self.pos < size and self._fill():
+            pass
+        return self.buffer[self.pos:self.pos + size]
+
+    def read_until(self, marker, out=None):
+        # Consumes everything up to and including marker. The bytes go to
+        # out.write() when given, otherwise they are returned (keep that for
+        # short runs such as tags and whitespace)
+        kept = []
+        while True:
+            found = self.buffer.find(marker, self.pos)
+            if found != -1:
+                end = found + len(marker)
+                data = self.buffer[self.pos:end]
+                self.pos = end
+                if out is None:
+                    kept.append(data)
+                    return b"".join(kept)
+                out.write(data)
+                return None
+
+            # Flush all but a possible partial marker at the end
+            safe = max(self.pos, len(self.buffer) - len(marker) + 1)
+            data = self.buffer[self.pos:safe]
+            if out is None:
+                kept.append(data)
+            else:
+                out.write(data)
+            self.pos = safe
+            if not self._fill():
+                raise ValueError(f"unexpected end of file looking for {marker!r}")
+
+    def read_rest(self, out):
+        out.write(self.buffer[self.pos:])
+        self.buffer = b""
+        self.pos = 0
+        while True:
+            data = self.f.read(self.chunk_size)
+            if not data:
+                return
+            out.write(data)
+
+    def read_tag(self):
+        # One "<...>" markup token; quoted attribute values may contain ">"
+        head = self.peek(4)
+        if head.startswith(b"<!--"):
+            return self.read_until(b"-->")
+        if head.startswith(b"<?"):
+            return self.read_until(b"?>")
+        if head.startswith(b"<![CDATA["):
+            return self.read_until(b"]]>")
+
+        parts = []
+        quote = None
+        while True:
+            if quote is None:
+                part = self._read_until_any()
+                parts.append(part)
+                last = part[-1:]
+                if last == b">":
+                    return b"".join(parts)
+                quote = last
+            else:
+                parts.append(self.read_until(quote))
+                quote = None
+
+    def _read_until_any(self):
+        # Up to and including the next ">" or quote
+        while True:
+            match = _TAG_END_OR_QUOTE.search(self.buffer, self.pos)
+            if match:
+                data = self.buffer[self.pos:match.end()]
+                self.pos = match.end()
+                return data
+            if not self._fill():
+                raise ValueError("unexpected end of file inside a tag")
+
+    def read_text(self):
+        # Character data up to the next "<" (not consumed)
+        parts = []
+        while True:
+            found = self.buffer.find(b"<", self.pos)
+            if found != -1:
+                parts.append(self.buffer[self.pos:found])
+                self.pos = found
+                return b"".join(parts)
+            parts.append(self.buffer[self.pos:])
+            self.pos = len(self.buffer)
+            if not self._fill():
+                return b"".join(parts)
+
+
+def _tag_name(tag):
+    # Element name of a start or end tag
+    name = tag[2:] if tag.startswith(b"</") else tag[1:]
+    for i, byte in enumerate(name):
+        if byte in b" \t\r\n/>":
+            return name[:i].decode("utf-8")
+    return name.decode("utf-8")
+
+
+def _is_markup(tag):
+    # Comments, processing instructions, doctype
+    return tag.startswith(b"<!") or tag.startswith(b"<?")
+
+
+def _copy_element(reader, name, out=_DISCARD):
+    # Copies (or with no out, skips) the rest of element `name` after its
+    # start tag. Sections never nest an element of their own name.
+    close = b"</" + name.encode("utf-8")
+    while True:
+        reader.read_until(close, out)
+        if reader.peek(1) in (b">", b" ", b"\t", b"\r", b"\n"):
+            reader.read_until(b">", out)
+            return
+
+
+def canvas_dimensions(metadata):
+    # Canvas size stored in a <session_metadata> Element
+    canvas = metadata.find("configuration[@name='canvas']") if metadata is not None else None
+    try:
+        return tuple(json.loads(canvas.get("value"))["canvases"][0]["dimensions"])
+    except (AttributeError, TypeError, ValueError, KeyError, IndexError):
+        return DEFAULT_CANVAS_DIMENSIONS
+
+
+def _metadata_in(reader):
+    # Parses the first <session_metadata> after the reader position
+    try:
+        reader.read_until(b"<session_metadata", _DISCARD)
+        section = b"<session_metadata" + reader.read_until(b"</session_metadata>")
+        return ET.fromstring(section)
+    except (ValueError, ET.ParseError):
+        return None
+
+
+def existing_dimensions(path):
+    # Canvas size of the file's <session_metadata>, or the default.
+    # Compressed files cannot seek to their tail and are scanned whole.
+    if is_compressed(path):
+        with open_input(path) as f:
+            return canvas_dimensions(_metadata_in(_ChunkReader(f)))
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - _TAIL_SIZE))
+        metadata = _metadata_in(_ChunkReader(io.BytesIO(f.read())))
+        if metadata is None and size > _TAIL_SIZE:
+            f.seek(0)
+            metadata = _metadata_in(_ChunkReader(f))
+    return canvas_dimensions(metadata)
+
+
+class _IdCounter:
+    # write() target that counts the <network>/<device> ids passing through
+    # it; a record split across two writes is completed by the next one
+
+    def __init__(self):
+        self.counts = {}
+        self.rest = b""
+
+    def write(self, data):
+        data = self.rest + data
+        cut = data.rfind(b"<")
+        if cut == -1:
+            cut = len(data)
+        counts = self.counts
+        for match in _NODE_ID.finditer(data, 0, cut):
+            node_id = match.group(1)
+            counts[node_id] = counts.get(node_id, 0) + 1
+        self.rest = data[cut:]
+
+    def flush(self):
+        self.write(b"<")
+        self.rest = b""
+
+
+def duplicate_node_ids(path):
+    # IDs used by more than one <network>/<device>; reads only the
+    # networks and devices sections, everything else is skipped
+    counter = _IdCounter()
+    with open_input(path) as f:
+        reader = _ChunkReader(f)
+        in_root = False
+        while True:
+            reader.read_text()
+            if not reader.peek(1):
+                break
+            tag = reader.read_tag()
+            if _is_markup(tag):
+                continue
+            if tag.startswith(b"</") or not in_root and tag.endswith(b"/>"):
+                break
+            if not in_root:
+                in_root = True
+                continue
+            if tag.endswith(b"/>"):
+                continue
+            name = _tag_name(tag)
+            if name in ("networks", "devices"):
+                _copy_element(reader, name, counter)
+                counter.flush()
+            else:
+                _copy_element(reader, name)
+    return {node_id.decode("utf-8") for node_id, count in counter.counts.items() if count > 1}
+
+
+def _is_network(record):
+    return record.tag == "network"
+
+
+def _is_device(record):
+    return record.tag == "device"
+
+
+def _link_ends(link):
+    # (attribute, node check) per end and the claims of one <link>. Networks
+    # have no interface, except the veth of a WLAN-switch link
+    ends = []
+    claims = {("link", link.get("node1"), link.get("node2"))}
+    for attribute, side in (("node1", "iface1"), ("node2", "iface2")):
+        iface = link.find(side)
+        if iface is None or iface.get("name", "").startswith("veth"):
+            ends.append((attribute, _is_network))
+        else:
+            ends.append((attribute, _is_device))
+        if iface is not None:
+            claims.add(("iface", link.get(attribute), iface.get("id")))
+    return ends, claims
+
+
+def _service_ends(service):
+    name = service.get("name")
+
+    def runs_service(record):
+        return record.tag == "device" and any(svc.get("name") == name for svc in record.iterfind("configservices/service"))
+
+    return [("node", runs_service)], {("service", service.get("node"), name)}
+
+
+def _mobility_ends(mobility):
+    def is_wireless_lan(record):
+        return record.tag == "network" and record.get("type") == "WIRELESS_LAN"
+
+    return [("node", is_wireless_lan)], {("mobility", mobility.get("node"))}
+
+
+# Sections that refer to nodes: section, record tag, ends function
+NODE_REFERENCES = [
+    ("links", "link", _link_ends),
+    ("configservice_configurations", "service", _service_ends),
+    ("mobility_configurations", "mobility_configuration", _mobility_ends)
+]
+
+
+def _unique_name(name, node_id, names):
+    # name's prefix ("n" of "n1") + node_id, not in names; moves the count
+    prefix = name.rstrip("0123456789")
+    renamed = f"{prefix}{node_id}"
+    suffix = 1
+    while renamed in names:
+        renamed = f"{prefix}{node_id}_{suffix}"
+        suffix += 1
+    names[name] -= 1
+    names[renamed] = 1
+    return renamed
+
+
+##
+# Renumbers nodes whose id is already taken by another <network> or
+# <device>, in place, and rewrites the references to them: link@node1/2,
+# configservice service@node and mobility_configuration@node.
+#
+# Colliding ids come from scenarios whose sections were concatenated, so
+# every section is read as a run of pieces. A node record starts a new
+# piece when its id was already used in the current one or is lower than
+# the previous id; the first record of an id keeps it and later copies get
+# max id + 1, + 2... A reference record belongs to the piece of any
+# endpoint that is not duplicated. Otherwise it stays in the piece of the
+# previous record, or moves on to the next piece where it fits: where every
+# duplicated endpoint is a node of the right kind (a link end with an
+# interface is a device, a config service runs on the device, a mobility
+# configuration is for a WLAN) and none of its claims (the link, a node's
+# interface id, a node's service) was made yet.
+#
+# A renumbered node whose name is also taken (the "n1" of both copies)
+# gets the name's prefix plus its new id instead ("n12"), as CORE wants
+# node names unique too.
+#
+# One pass over the nodes and one over the references with dict and set
+# lookups. Returns {"remapped": [{old, new, tag, name[, renamed]}],
+# "references": count}, renamed being the node's new name.
+##
+def fix_duplicate_ids(root, duplicates=None):
+    nodes = []
+    for section, tag in (("networks", "network"), ("devices", "device")):
+        found = root.find(section)
+        if found is not None:
+            nodes.append((tag, found.findall(tag)))
+
+    report = {"remapped": [], "references": 0}
+    if duplicates is None:
+        seen = set()
+        duplicates = set()
+        for _, records in nodes:
+            for record in records:
+                node_id = record.get("id", "")
+                if node_id in seen:
+                    duplicates.add(node_id)
+                seen.add(node_id)
+    if not duplicates:
+        return report
+
+    next_id = max((int(record.get("id")) for _, records in nodes for record in records
+                   if record.get("id", "").isdigit()), default=0) + 1
+    names = {}
+    for _, records in nodes:
+        for record in records:
+            names[record.get("name")] = names.get(record.get("name"), 0) + 1
+
+    # ids used per piece are shared by the networks and devices sections
+    used = [set()]
+    piece_of = {}   # unique id -> piece
+    copies = {}     # (duplicated id, piece) -> its record there
+    kept = set()
+    for tag, records in nodes:
+        piece = 0
+        previous = -1
+        for record in records:
+            node_id = record.get("id", "")
+            number = int(node_id) if node_id.isdigit() else previous
+            if node_id in used[piece] or number < previous:
+                piece += 1
+                if piece == len(used):
+                    used.append(set())
+            used[piece].add(node_id)
+            previous = number
+
+            if node_id not in duplicates:
+                piece_of[node_id] = piece
+                continue
+            copies[(node_id, piece)] = record
+            if node_id in kept:
+                record.set("id", str(next_id))
+                remap = {"old": node_id, "new": str(next_id), "tag": tag, "name": record.get("name")}
+                if remap["name"] is not None and names[remap["name"]] > 1:
+                    remap["renamed"] = _unique_name(remap["name"], next_id, names)
+                    record.set("name", remap["renamed"])
+                report["remapped"].append(remap)
+                next_id += 1
+            else:
+                kept.add(node_id)  # the first record keeps its id
+
+    def fits(piece, ends, claims, seen):
+        for node_id, check in ends:
+            copy = copies.get((node_id, piece))
+            if copy is None:
+                if node_id in duplicates:
+                    return False
+            elif not check(copy):
+                return False
+        return seen.isdisjoint(claims)
+
+    for section, tag, references in NODE_REFERENCES:
+        found = root.find(section)
+        if found is None:
+            continue
+        piece = 0
+        seen = set()
+        for record in found.iterfind(tag):
+            attributes, claims = references(record)
+            ends = [(record.get(attribute), check) for attribute, check in attributes]
+            target = next((piece_of[node_id] for node_id, _ in ends if node_id in piece_of), None)
+            if target is None:
+                target = next((later for later in range(piece, len(used))
+                               if fits(later, ends, claims, seen if later == piece else set())), piece)
+            if target != piece:
+                piece, seen = target, set()
+            seen |= claims
+
+            for (attribute, _), (node_id, _) in zip(attributes, ends):
+                copy = copies.get((node_id, piece))
+                if copy is not None and copy.get("id") != node_id:
+                    record.set(attribute, copy.get("id"))
+                    report["references"] += 1
+
+    return report
+
+
+##
+# Copies the scenario read by `reader` to `out` with fresh static sections.
+# Returns the names of the static sections that were dropped.
+##
+def repair_stream(reader, out, dimensions=DEFAULT_CANVAS_DIMENSIONS):
+    fragments = b"".join(static_fragment_bytes(tag, dimensions) for tag in STATIC_SECTIONS)
+    replaced = []
+
+    # Prolog: declaration, comments, doctype, up to the root start tag
+    while True:
+        out.write(reader.read_text())
+        if not reader.peek(1):
+            raise ValueError("no root element")
+        tag = reader.read_tag()
+        if not _is_markup(tag):
+            break
+        out.write(tag)
+
+    root = _tag_name(tag)
+    if tag.endswith(b"/>"):
+        # "<scenario />": opened so the sections fit in
+        out.write(tag[:-2].rstrip() + b">" + fragments + b"\n</" + root.encode("utf-8") + b">")
+        reader.read_rest(out)
+        return replaced
+    out.write(tag)
+
+    inserted = False
+    while True:
+        space = reader.read_text()
+        if not reader.peek(1):
+            raise ValueError(f"<{root}> is not closed")
+        tag = reader.read_tag()
+
+        if tag.startswith(b"</"):
+            if not inserted:
+                out.write(fragments)
+            out.write(space + tag)
+            reader.read_rest(out)
+            return replaced
+
+        if _is_markup(tag):
+            out.write(space + tag)
+            continue
+
+        name = _tag_name(tag)
+        if name in STATIC_SECTIONS:
+            # Dropped with the whitespace in front of it
+            if not tag.endswith(b"/>"):
+                _copy_element(reader, name)
+            replaced.append(name)
+            continue
+
+        out.write(space + tag)
+        if not tag.endswith(b"/>"):
+            _copy_element(reader, name, out)
+        if name == "configservice_configurations" and not inserted:
+            out.write(fragments)
+            inserted = True
+
+
+def repair_file(path, output_path, chunk_size=CHUNK_SIZE):
+    # Returns a summary dict for the repair of one file; errors are
+    # reported in it rather than raised, so one bad file does not stop a batch.
+    # Compressed input is read transparently; output_path ending in .gz /
+    # .zst is compressed and "-" is stdout (see scenario_io).
+    start = time.perf_counter()
+    result = {"input": path, "output": output_path}
+    tmp_path = temporary_path(output_path) if output_path != STDIO else None
+    try:
+        dimensions = existing_dimensions(path)
+        duplicates = duplicate_node_ids(path)
+        if duplicates:
+            # Renumbering touches records anywhere in the file: parse it all
+            with open_input(path) as f:
+                tree = ET.parse(f)
+            result["duplicates"] = fix_duplicate_ids(tree.getroot(), duplicates)
+            source = io.BytesIO()
+            tree.write(source, encoding="utf-8", xml_declaration=True)
+            source.seek(0)
+        else:
+            source = open_input(path)
+        with source as f, open_output(tmp_path or STDIO) as out:
+            result["replaced"] = repair_stream(_ChunkReader(f, chunk_size), out, dimensions)
+        if tmp_path:
+            os.replace(tmp_path, output_path)
+    except (OSError, ValueError, ET.ParseError) as e:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    if tmp_path:
+        result["bytes"] = os.path.getsize(output_path)
+    result["seconds"] = round(time.perf_counter() - start, 6)
+    return result